@@ -0,0 +1,268 @@
+"""
+Serve the app: a reloading development server, or a production server with
+preloaded, forked workers
+"""
+import asyncio
+import importlib
+import importlib.util
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import traceback
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+import uvicorn
+
+
+class StartupTimer:
+    """Records and logs how long each startup phase takes"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: List[Tuple[str, float]] = []
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        yield
+        elapsed = time.perf_counter() - start
+        self.phases.append((name, elapsed))
+        print(f"⏱️  {name}: {elapsed * 1000:.0f} ms")
+
+    def total(self) -> float:
+        return time.perf_counter() - self.started
+
+
+def import_times(module: str, preimported: Tuple[str, ...] = (), cwd: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Import `module` in a fresh interpreter and return `python -X importtime`
+    figures for every module it imported, in import order.
+
+    Modules in `preimported` are imported first and left out, so their cost
+    isn't counted against `module`.
+    """
+    code = "".join(f"import {name}; " for name in preimported) + f"import sys; sys.stderr.write('---\\n'); import {module}"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True
+    )
+    timings = []
+    for line in result.stderr.split("---\n", 1)[-1].splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        if not self_us.strip().isdigit():
+            continue  # The header line
+        timings.append({
+            "module": name.strip(),
+            "depth": (len(name) - len(name.lstrip())) // 2,
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000
+        })
+    return timings
+
+
+async def run_lifespan(app):
+    """Run an ASGI app's startup and then its shutdown, without serving"""
+    messages = asyncio.Queue()
+    for event in ("startup", "shutdown"):
+        messages.put_nowait({"type": f"lifespan.{event}"})
+    results = []
+
+    async def send(message):
+        results.append(message)
+        if message["type"].endswith(".failed"):
+            raise RuntimeError(message.get("message", message["type"]))
+
+    await app({"type": "lifespan", "asgi": {"version": "3.0"}, "state": {}}, messages.get, send)
+    return results
+
+
+def profile_startup(app_path: str = "app.main:app", top: int = 15) -> Dict[str, Any]:
+    """Report where startup time goes, without serving: the slowest imports
+    (measured in a fresh interpreter) and the time each service of the app
+    takes to construct and initialize (its `startup_timings`).
+    """
+    module_name, _, attribute = app_path.partition(":")
+    imports = import_times(module_name, cwd=os.getcwd())
+    total_import = next((t["cumulative_ms"] for t in imports if t["module"] == module_name), 0.0)
+    print(f"📦 import {module_name}: {total_import:.0f} ms; slowest modules (cumulative):")
+    for timing in sorted(imports, key=lambda t: t["cumulative_ms"], reverse=True)[:top]:
+        print(f"   {timing['cumulative_ms']:8.1f} ms  {timing['self_ms']:8.1f} ms self  {timing['module']}")
+
+    module = importlib.import_module(module_name)
+    app = getattr(module, attribute or "app")
+
+    asyncio.run(run_lifespan(app))
+    services = getattr(module, "startup_timings", {})
+    print("⚙️  services (construct / initialize):")
+    for name in services.get("construct", {}):
+        print(f"   {name:24s} {services['construct'][name]:8.1f} ms  {services.get('initialize', {}).get(name, 0.0):8.1f} ms")
+    return {"import_ms": total_import, "imports": imports, "services": services}
+
+
+def event_loop_implementation() -> str:
+    """uvloop when it is installed, else the standard asyncio loop"""
+    return "uvloop" if importlib.util.find_spec("uvloop") else "asyncio"
+
+
+def http_implementation() -> str:
+    """httptools when it is installed, else the pure-Python h11 parser"""
+    return "httptools" if importlib.util.find_spec("httptools") else "h11"
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """Listening socket shared by all workers"""
+    family = socket.AF_INET6 if ":" in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def serve(
+    app_path: str = "app.main:app",
+    host: str = "0.0.0.0",
+    port: int = 8000,
+    workers: int = 1,
+    profile: str = "production",
+    preload: bool = True,
+    graceful_timeout: float = 30.0,
+    log_level: str = "info"
+):
+    """Run the server.
+
+    The development profile is uvicorn with autoreload. The production
+    profile imports the app once, runs its `preload()` coroutine (loading the
+    model) and binds the socket, then forks `workers` processes that share
+    the preloaded memory copy-on-write. An app whose `fork_safe()` returns
+    False after preloading (a model behind a single subprocess, whose pipes
+    the workers would share) is served by one worker. SIGTERM or SIGINT makes every worker
+    stop accepting connections and finish in-flight requests, for up to
+    `graceful_timeout` seconds, before the app's shutdown handlers run.
+    """
+    if profile == "development":
+        uvicorn.run(app_path, host=host, port=port, reload=True, log_level=log_level)
+        return
+
+    timer = StartupTimer()
+    if workers > 1 and not hasattr(os, "fork"):
+        print("⚠️  Multiple workers need fork(); starting a single worker")
+        workers = 1
+    split_threads = workers > 1 and "LOCALAI_N_THREADS" not in os.environ
+    if split_threads:
+        # Workers generate concurrently; split the cores between them
+        os.environ["LOCALAI_N_THREADS"] = str(max(1, (os.cpu_count() or 1) // workers))
+
+    module_name, _, attribute = app_path.partition(":")
+    with timer.phase("import app"):
+        module = importlib.import_module(module_name)
+        app = getattr(module, attribute or "app")
+    if preload and hasattr(module, "preload"):
+        with timer.phase("preload"):
+            asyncio.run(module.preload())
+    if workers > 1 and hasattr(module, "fork_safe") and not module.fork_safe():
+        print("⚠️  The preloaded app can't be shared by forked workers; starting a single worker")
+        workers = 1
+        if split_threads:
+            os.environ.pop("LOCALAI_N_THREADS")
+    with timer.phase("bind"):
+        sock = bind_socket(host, port)
+
+    loop, http = event_loop_implementation(), http_implementation()
+    print(f"🚀 Serving on http://{host}:{port} with {workers} worker(s), loop={loop}, http={http} "
+          f"(ready to fork after {timer.total() * 1000:.0f} ms)")
+    config = uvicorn.Config(
+        app,
+        loop=loop,
+        http=http,
+        log_level=log_level,
+        timeout_graceful_shutdown=graceful_timeout
+    )
+
+    if workers <= 1:
+        uvicorn.Server(config).run(sockets=[sock])
+    else:
+        Supervisor(config, sock, workers, graceful_timeout).run()
+
+
+class Supervisor:
+    """Forks workers from the preloaded parent and restarts any that die"""
+
+    def __init__(self, config: uvicorn.Config, sock: socket.socket, workers: int, graceful_timeout: float):
+        self.config = config
+        self.sock = sock
+        self.count = workers
+        self.graceful_timeout = graceful_timeout
+        self.workers: Dict[int, float] = {}
+        self.stopping = False
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGALRM, self._kill)
+        for _ in range(self.count):
+            self._spawn()
+
+        while self.workers:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            started = self.workers.pop(pid, None)
+            if started is None or self.stopping:
+                continue
+            print(f"⚠️  Worker {pid} exited with status {status}; restarting")
+            if time.monotonic() - started < 1:
+                # Don't spin if workers die right away
+                time.sleep(1)
+            self._spawn()
+        signal.alarm(0)
+        print("👋 All workers stopped")
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers[pid] = time.monotonic()
+            return
+
+        # Worker: its own process group, so a terminal's Ctrl+C reaches only
+        # the supervisor, which then stops every worker exactly once
+        code = 0
+        try:
+            os.setpgid(0, 0)
+            for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGALRM):
+                signal.signal(sig, signal.SIG_DFL)
+            uvicorn.Server(self.config).run(sockets=[self.sock])
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            os._exit(code)
+
+    def _stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        print(f"⏹️  Draining {len(self.workers)} worker(s)...")
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        # Workers still running after the grace period are killed
+        signal.alarm(int(self.graceful_timeout) + 5)
+
+    def _kill(self, signum, frame):
+        for pid in self.workers:
+            try:
+                os.kill(pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
@@ -1,24 +1,36 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, WebSocket
+from fastapi import Depends, FastAPI, UploadFile, File, HTTPException, WebSocket, Query, Request
+from starlette.requests import HTTPConnection
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
-import uvicorn
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 import json
 import os
 from typing import List, Optional, Dict, Any
-import uuid
 from datetime import datetime
 import asyncio
+import hmac
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
 
 from .models.chat_models import ChatRequest, ChatResponse, Conversation, BranchRequest
 from .services.model_manager import ModelManager
 from .services.document_processor import DocumentProcessor
 from .services.conversation_manager import ConversationManager
+from .services.streaming import SSE_KEEPALIVE, sse_event, with_keepalive
+from .services.ws_protocol import ChatSocket
+from .services.batch_manager import BatchManager, parse_batch_requests
+from .services.admission import AdmissionController, Overloaded
+from .services.tracing import TracingMiddleware, ring_buffer, tracer
+from .services.profiler import SamplingProfiler
+from .services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, MetricsMiddleware, registry
+from .services.static_assets import Asset, StaticAssets
 
 app = FastAPI(title="LocalAI Chat", description="Completely offline AI chat application", version="1.0.0")
 
-# Serve frontend files
-app.mount("/static", StaticFiles(directory="frontend"), name="static")
+# Frontend files, located relative to the repo whatever the working directory;
+# served from memory by static_assets
+FRONTEND_DIR = Path(__file__).resolve().parents[2] / "frontend"
 
 # CORS middleware
 app.add_middleware(
@@ -28,25 +40,197 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# A root span per request while tracing is on (LOCALAI_TRACING=1 or /api/admin/tracing)
+app.add_middleware(TracingMiddleware, tracer=tracer)
+# Request latency per route for /metrics
+app.add_middleware(MetricsMiddleware)
+
+# Services are constructed by create_services() at startup, not on import,
+# so importing the app (tests, worker respawn, tooling) stays cheap
+model_manager: Optional[ModelManager] = None
+document_processor: Optional[DocumentProcessor] = None
+conversation_manager: Optional[ConversationManager] = None
+admission: Optional[AdmissionController] = None
+batch_manager: Optional[BatchManager] = None
+static_assets: Optional[StaticAssets] = None
+
+SERVICE_FACTORIES = {
+    "admission": lambda: AdmissionController(
+        max_concurrent=int(os.environ.get("LOCALAI_MAX_CONCURRENT", "1")),
+        max_per_client=int(os.environ.get("LOCALAI_MAX_PER_CLIENT", "4")),
+        max_queue=int(os.environ.get("LOCALAI_MAX_QUEUE", "64"))
+    ),
+    "model_manager": lambda: ModelManager(admission=admission),
+    "document_processor": lambda: DocumentProcessor(),
+    "conversation_manager": lambda: ConversationManager(
+        fsync_policy=os.environ.get("LOCALAI_FSYNC_POLICY", "batch"),
+        write_window=float(os.environ.get("LOCALAI_WRITE_WINDOW_MS", "50")) / 1000
+    ),
+    "batch_manager": lambda: BatchManager(model_manager, admission=admission),
+    "static_assets": lambda: StaticAssets(FRONTEND_DIR),
+}
+
+profiler = SamplingProfiler()
+
+# Milliseconds spent constructing and initializing each service
+startup_timings: Dict[str, Dict[str, float]] = {"construct": {}, "initialize": {}}
+
+# Seconds without output before an SSE stream sends a keep-alive comment
+SSE_KEEPALIVE_INTERVAL = float(os.environ.get("LOCALAI_SSE_KEEPALIVE", "15"))
+
+@contextmanager
+def _timed(stage: str, name: str):
+    start = time.perf_counter()
+    yield
+    startup_timings[stage][name] = round((time.perf_counter() - start) * 1000, 1)
+
+def create_services():
+    """Construct the services that don't exist yet, in dependency order"""
+    for name, factory in SERVICE_FACTORIES.items():
+        if globals()[name] is None:
+            with _timed("construct", name):
+                globals()[name] = factory()
 
-# Initialize services
-model_manager = ModelManager()
-document_processor = DocumentProcessor()
-conversation_manager = ConversationManager()
+def _service_metrics():
+    """Metrics read from the services when /metrics is scraped"""
+    if admission is not None:
+        stats = admission.stats()
+        yield ("localai_admission_queue_depth", "gauge", "Requests waiting for a model slot",
+               [({"priority": name}, depth) for name, depth in stats["queue_depth"].items()])
+        yield ("localai_admission_in_flight", "gauge", "Requests holding a model slot", [({}, stats["in_flight"])])
+        for outcome in ("admitted", "rejected", "shed"):
+            yield (f"localai_admission_{outcome}_total", "counter", f"Requests {outcome} by admission control",
+                   [({"priority": name}, count) for name, count in stats[outcome].items()])
+    if model_manager is not None and model_manager.remote is not None:
+        nodes = model_manager.remote.nodes
+        yield ("localai_remote_node_up", "gauge", "Whether a remote backend passed its last health probe",
+               [({"node": node.url}, int(node.healthy)) for node in nodes])
+        yield ("localai_remote_node_in_flight", "gauge", "Generations this worker has running on a remote backend",
+               [({"node": node.url}, node.in_flight) for node in nodes])
+    if model_manager is not None:
+        yield ("localai_model_loaded", "gauge", "Whether a model is loaded, labelled with its name",
+               [({"model": model_manager.current_model_name or ""}, int(model_manager.current_model is not None))])
+        yield ("localai_active_generations", "gauge", "Generations running or waiting for the model",
+               [({}, model_manager.active_generations)])
+    if conversation_manager is not None:
+        hits, misses = conversation_manager.cache_hits, conversation_manager.cache_misses
+        yield ("localai_conversation_cache_total", "counter", "Conversation lookups by whether the LRU cache held them",
+               [({"result": "hit"}, hits), ({"result": "miss"}, misses)])
+        yield ("localai_conversation_cache_hit_ratio", "gauge", "Share of conversation lookups served from the LRU cache",
+               [({}, hits / (hits + misses) if hits + misses else 0.0)])
+        yield ("localai_conversation_cache_size", "gauge", "Conversations held in the LRU cache",
+               [({}, len(conversation_manager.cache))])
+
+registry.register_collector(_service_metrics)
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize services on startup"""
     print("🚀 Starting LocalAI Chat Server...")
-    await model_manager.initialize()
-    await document_processor.initialize()
-    print("✅ Services initialized successfully")
+    started = time.perf_counter()
+    create_services()
+    for name in ["model_manager", "document_processor", "conversation_manager", "batch_manager", "static_assets"]:
+        with _timed("initialize", name):
+            await globals()[name].initialize()
+        print(f"⏱️  {name}: {startup_timings['initialize'][name]:.0f} ms")
+    if model_manager.remote is not None and "LOCALAI_MAX_CONCURRENT" not in os.environ:
+        # Remote nodes generate in parallel: admit as many requests as they have slots
+        admission.max_concurrent = model_manager.remote.capacity()
+    print(f"✅ Services initialized successfully in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+async def preload():
+    """Startup work done once before the launcher forks workers.
+
+    Only state that is safe to share across fork() belongs here: the model
+    (read-only weights, shared copy-on-write). Database connections and
+    background tasks are created per worker in startup_event.
+    """
+    create_services()
+    with _timed("initialize", "model_manager"):
+        await model_manager.initialize()
+    # Remote backend connections belong to this (preload) event loop; each
+    # worker reopens them in startup_event
+    await model_manager.close()
+
+def fork_safe() -> bool:
+    """Whether workers forked after preload() can share its state: not when
+    the model runs in one llama.cpp subprocess, whose pipes they would share"""
+    return model_manager is None or model_manager.model_process is None
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Flush and close services on shutdown"""
+    await batch_manager.close()
+    await conversation_manager.close()
+    await document_processor.close()
+    await model_manager.close()
+
+@app.exception_handler(Overloaded)
+async def overloaded_handler(request: Request, exc: Overloaded):
+    """Turned-away requests get 503 (or 429 for per-client limits) with Retry-After"""
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail, "retry_after": exc.retry_after},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+def _require_admin(request: Request):
+    """Guard for /api/admin/*: traces hold prompt-derived data and the profiler costs CPU.
+
+    The app listens on every interface with CORS open to any origin, so
+    these endpoints are off (404) unless LOCALAI_ADMIN_TOKEN is set, and
+    then need "Authorization: Bearer <token>".
+    """
+    token = os.environ.get("LOCALAI_ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("authorization", "")
+    if not hmac.compare_digest(supplied.encode(), f"Bearer {token}".encode()):
+        raise HTTPException(status_code=401, detail="Admin token required", headers={"WWW-Authenticate": "Bearer"})
 
-@app.get("/")
-async def serve_frontend():
+def _client_id(connection: HTTPConnection) -> str:
+    """Key for per-client limits: an explicit X-Client-ID, else the peer address"""
+    return connection.headers.get("x-client-id") or (connection.client.host if connection.client else "unknown")
+
+async def _admitted(frames, priority: str, client: Optional[str]):
+    """Re-yield `frames` while holding an admission slot.
+
+    Interactive frames are generated with the default model, which a batch
+    job may have swapped out between its requests.
+    """
+    async with admission.slot(priority, client):
+        if priority == "interactive" and not await model_manager.use_default_model():
+            yield {
+                "response": f"Error generating response: could not load model {model_manager.default_model_name}",
+                "timestamp": datetime.now().isoformat(),
+                "error": True
+            }
+            return
+        async for frame in frames:
+            yield frame
+
+def _asset_response(asset: Optional[Asset], request: Request) -> Response:
+    """An in-memory asset in the best encoding the client accepts, or 304 if its copy is current"""
+    if asset is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    encoding = asset.select(request.headers.get("accept-encoding", ""))
+    body, etag = asset.variants[encoding]
+    headers = {"ETag": etag, "Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+    if asset.matches(request.headers.get("if-none-match")):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(body, media_type=asset.content_type, headers=headers)
+
+@app.api_route("/", methods=["GET", "HEAD"])
+async def serve_frontend(request: Request):
     """Serve the main frontend page"""
-    with open("frontend/index.html", "r") as f:
-        return f.read()
+    return _asset_response(static_assets.index, request)
+
+@app.api_route("/static/{path:path}", methods=["GET", "HEAD"])
+async def serve_static(path: str, request: Request):
+    """Frontend assets; fingerprinted names are cached as immutable"""
+    return _asset_response(static_assets.get(path), request)
 
 @app.get("/api/health")
 async def health_check():
@@ -62,6 +246,16 @@ async def get_available_models():
     """Get list of available GGUF models"""
     return await model_manager.get_available_models()
 
+@app.get("/api/models/variants")
+async def get_model_variants():
+    """Local models grouped by base model, with each quantization's benchmark on this host"""
+    return model_manager.get_variant_groups()
+
+@app.post("/api/models/benchmark", dependencies=[Depends(_require_admin)])
+async def benchmark_models(base_model: Optional[str] = None, force: bool = False):
+    """Benchmark the quantizations of each base model (or just `base_model`); pauses generation"""
+    return {"benchmarked": await model_manager.benchmark_variants(base_model, force)}
+
 @app.post("/api/models/load/{model_name}")
 async def load_model(model_name: str):
     """Load a specific model"""
@@ -83,49 +277,219 @@ async def get_current_model():
     return {"loaded": False}
 
 @app.post("/api/chat")
-async def chat(request: ChatRequest):
-    """Main chat endpoint - completely offline"""
+async def chat(request: ChatRequest, http_request: Request):
+    """Main chat endpoint - completely offline.
+
+    With `stream: true` the reply is a text/event-stream: a `start` event with
+    the conversation id, `delta` events as text is generated, and a final
+    `done` event carrying the same fields as the non-streaming response plus
+    usage and timing.
+    """
+    client = _client_id(http_request)
     try:
-        response = await model_manager.generate_response(
+        if request.stream:
+            conversation_id, frames = await _start_chat(request, client)
+            return StreamingResponse(
+                _stream_chat(http_request, conversation_id, frames),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        admission.check("interactive", client)
+        conversation_id, history = await _conversation_history(request.conversation_id)
+
+        async with admission.slot("interactive", client):
+            if not await model_manager.use_default_model():
+                raise Exception(f"Could not load model {model_manager.default_model_name}")
+            response = await model_manager.generate_response(
+                message=request.message,
+                conversation_id=conversation_id,
+                documents=request.documents,
+                json_schema=request.json_schema,
+                max_tokens=request.max_tokens,
+                history=history,
+                latency_slo_ms=request.latency_slo_ms
+            )
+
+        if not response.get("error"):
+            await _save_exchange(conversation_id, request.message, response)
+        return response
+    except Overloaded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+
+async def _start_chat(request: ChatRequest, client: Optional[str] = None):
+    """Start a streamed reply.
+
+    Returns the conversation id and the model's frames; the user turn and
+    the reply are saved just before the final frame is yielded. Requests
+    that would be turned away raise Overloaded up front; the admission slot
+    itself is taken when the frames are first read.
+    """
+    admission.check("interactive", client)
+    conversation_id, history = await _conversation_history(request.conversation_id)
+
+    async def frames():
+        generation = model_manager.stream_generate(
             message=request.message,
-            conversation_id=request.conversation_id,
+            conversation_id=conversation_id,
             documents=request.documents,
             json_schema=request.json_schema,
-            max_tokens=request.max_tokens
+            max_tokens=request.max_tokens,
+            history=history,
+            latency_slo_ms=request.latency_slo_ms
         )
-        return response
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
+        async for frame in _admitted(generation, "interactive", client):
+            if "delta" not in frame and not frame.get("error"):
+                await _save_exchange(conversation_id, request.message, frame)
+            yield frame
+
+    return conversation_id, frames()
+
+async def _stream_chat(http_request: Request, conversation_id: str, generation):
+    """SSE frames for a streamed chat reply"""
+    yield sse_event("start", {"conversation_id": conversation_id})
+    frames = with_keepalive(generation, SSE_KEEPALIVE_INTERVAL)
+    try:
+        async for frame in frames:
+            if frame is None:
+                if await http_request.is_disconnected():
+                    # Stop generating for a client that has gone away
+                    return
+                yield SSE_KEEPALIVE
+            elif "delta" in frame:
+                yield sse_event("delta", {"delta": frame["delta"]})
+            else:
+                yield sse_event("done", frame)
+    except Overloaded as e:
+        # Shed while waiting for a slot
+        yield sse_event("error", {"detail": e.detail, "retry_after": e.retry_after})
+    finally:
+        await frames.aclose()
+
+async def _conversation_history(conversation_id: Optional[str]):
+    """The id and messages of the conversation to continue, or a fresh id and no messages"""
+    if conversation_id and await conversation_manager.get_summary(conversation_id):
+        return conversation_id, await conversation_manager.get_messages(conversation_id)
+    return conversation_id or str(uuid.uuid4()), []
+
+async def _save_exchange(conversation_id: str, message: str, response: Dict[str, Any]):
+    """Record a user turn with its reply, creating the conversation with its first one.
+
+    Nothing is recorded before there is a reply, so a request that is shed
+    or fails leaves no unanswered turn behind to be duplicated by a retry.
+    """
+    await _ensure_conversation(conversation_id, message)
+    await conversation_manager.add_message(conversation_id, "user", message)
+    await conversation_manager.add_message(conversation_id, "assistant", response["response"], model=response.get("model"))
+
+async def _ensure_conversation(conversation_id: Optional[str], first_message: str) -> str:
+    """Return an existing conversation id, creating the conversation if needed"""
+    if conversation_id and await conversation_manager.get_summary(conversation_id):
+        return conversation_id
+    conversation = await conversation_manager.create_conversation(
+        title=first_message[:50],
+        conversation_id=conversation_id
+    )
+    return conversation["id"]
 
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(http_request: Request, file: UploadFile = File(...)):
     """Upload and process documents offline"""
     try:
-        content = await document_processor.process_file(file)
+        async with admission.slot("upload", _client_id(http_request)):
+            ingested = await document_processor.ingest(file)
+        content, report = ingested["text"], ingested["report"]
         return {
             "status": "success",
-            "file_id": str(uuid.uuid4()),
+            "file_id": report["document_id"],
             "filename": file.filename,
             "content_type": file.content_type,
             "content_preview": content[:200] + "..." if len(content) > 200 else content,
-            "processed_at": datetime.now().isoformat()
+            "processed_at": datetime.now().isoformat(),
+            # Segments already ingested from earlier uploads (e.g. a previous version)
+            "dedup": {key: value for key, value in report.items() if key != "segment_details"}
         }
+    except Overloaded:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"File processing error: {str(e)}")
 
+@app.delete("/api/documents/{document_id}")
+async def delete_document(document_id: str):
+    """Forget an uploaded document (its `file_id`) and the segment text only it held"""
+    if not await document_processor.remove_document(document_id):
+        raise HTTPException(status_code=404, detail="Document not found")
+    return {"status": "success"}
+
 @app.post("/api/conversations/branch")
 async def branch_conversation(request: BranchRequest):
     """Create a branch from existing conversation"""
-    new_conversation = await conversation_manager.branch_conversation(
-        request.conversation_id, 
-        request.branch_point
-    )
+    try:
+        new_conversation = await conversation_manager.branch_conversation(
+            request.conversation_id,
+            request.branch_point,
+            message_id=request.message_id
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     return new_conversation
 
 @app.get("/api/conversations")
-async def get_conversations():
-    """Get all conversations"""
-    return await conversation_manager.get_all_conversations()
+async def get_conversations(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    sort: str = "updated_at",
+    order: str = "desc"
+):
+    """List conversation summaries, one page at a time"""
+    try:
+        return await conversation_manager.list_conversations(limit, cursor, sort, order)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/conversations/{conversation_id}")
+async def get_conversation(
+    conversation_id: str,
+    offset: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1)
+):
+    """Get a conversation with all of its messages or a range of them"""
+    summary = await conversation_manager.get_summary(conversation_id)
+    if summary is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    messages = await conversation_manager.get_messages(conversation_id, offset, limit)
+    return {**summary, "offset": offset, "messages": messages}
+
+@app.get("/api/search")
+async def search_conversations(
+    q: str,
+    limit: int = Query(20, ge=1, le=200),
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+    model: Optional[str] = None,
+    conversation_id: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    recent: Optional[int] = Query(None, ge=1)
+):
+    """Search conversation history (append `*` to a term for prefix matching).
+
+    Results are the best matches overall, a page at a time (`offset`).
+    With `recent`, only the newest `recent` messages are searched: faster
+    on large histories, but approximate, as older matches are left out.
+    """
+    try:
+        results = await conversation_manager.search(q, limit, since, until, model, conversation_id, offset, recent)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "query": q,
+        "results": results,
+        "offset": offset,
+        "next_offset": offset + len(results) if len(results) == limit else None,
+        "approximate": recent is not None
+    }
 
 @app.delete("/api/conversations/{conversation_id}")
 async def delete_conversation(conversation_id: str):
@@ -136,24 +500,106 @@ async def delete_conversation(conversation_id: str):
     else:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
+@app.get("/api/admission")
+async def admission_stats():
+    """Admission queue depth, wait times and rejected/shed counts"""
+    return admission.stats()
+
+@app.get("/api/admin/backends", dependencies=[Depends(_require_admin)])
+async def remote_backends():
+    """Health, models, capacity and load of each remote backend"""
+    if model_manager.remote is None:
+        return {"capacity": 0, "nodes": []}
+    return model_manager.remote.stats()
+
+@app.get("/metrics")
+async def metrics():
+    """Counters and histograms of every service, in the Prometheus text format"""
+    return PlainTextResponse(registry.render(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/api/admin/traces", dependencies=[Depends(_require_admin)])
+async def get_traces(trace_id: Optional[str] = None, limit: int = Query(500, ge=1)):
+    """Recent finished spans (oldest first), or every span of one trace"""
+    return {"enabled": tracer.enabled, "spans": ring_buffer.dump(trace_id, None if trace_id else limit)}
+
+@app.put("/api/admin/tracing", dependencies=[Depends(_require_admin)])
+async def set_tracing(enabled: bool):
+    """Turn span recording on or off"""
+    tracer.enabled = enabled
+    return {"enabled": tracer.enabled}
+
+@app.get("/api/admin/profile", response_class=PlainTextResponse, dependencies=[Depends(_require_admin)])
+async def profile(seconds: float = Query(5.0, gt=0, le=60), interval_ms: float = Query(5.0, ge=1, le=1000)):
+    """Sample every thread's stack for `seconds` and return the collapsed
+    stacks ("frame;frame;... count" lines), for flamegraph.pl or speedscope
+    """
+    if profiler.busy:
+        raise HTTPException(status_code=409, detail="A profile is already running")
+    profiler.interval = interval_ms / 1000
+    try:
+        counts = await asyncio.get_event_loop().run_in_executor(None, profiler.run, seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(SamplingProfiler.collapsed(counts))
+
+@app.post("/api/batch", status_code=202)
+async def create_batch(request: Request):
+    """Queue a batch of chat requests (a JSON array or JSONL body).
+
+    Each request takes `message` and optionally `custom_id`, `documents`,
+    `json_schema`, `max_tokens` and `model`. Returns the job; results are
+    read from /api/batch/{job_id}/results.
+    """
+    try:
+        requests = parse_batch_requests(await request.body())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid batch: {str(e)}")
+    return await batch_manager.create_job(requests)
+
+@app.get("/api/batch")
+async def list_batches():
+    """List batch jobs, newest first"""
+    return await batch_manager.list_jobs()
+
+@app.get("/api/batch/{job_id}")
+async def get_batch(job_id: str):
+    """Get a batch job's status and progress"""
+    job = await batch_manager.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return job
+
+@app.get("/api/batch/{job_id}/results")
+async def get_batch_results(job_id: str, follow: bool = True):
+    """Stream results as JSONL in completion order (each carries its request `index`)"""
+    if await batch_manager.get_job(job_id) is None:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return StreamingResponse(batch_manager.iter_results(job_id, follow), media_type="application/x-ndjson")
+
+@app.delete("/api/batch/{job_id}")
+async def cancel_batch(job_id: str):
+    """Cancel a batch job, keeping the results it has produced"""
+    if not await batch_manager.cancel_job(job_id):
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return await batch_manager.get_job(job_id)
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    """WebSocket for real-time chat streaming"""
+    """WebSocket for real-time chat streaming (protocol in services/ws_protocol.py)"""
     await websocket.accept()
+    client = _client_id(websocket)
     try:
-        while True:
-            data = await websocket.receive_text()
-            message_data = json.loads(data)
-            
-            # Stream response chunks
-            async for chunk in model_manager.stream_response(
-                message=message_data["message"],
-                conversation_id=message_data.get("conversation_id")
-            ):
-                await websocket.send_text(json.dumps({"chunk": chunk}))
-                
+        await ChatSocket(
+            websocket,
+            start_chat=lambda payload: _start_chat(ChatRequest(**payload), client),
+            legacy_chat=lambda payload: _admitted(model_manager.stream_generate(
+                message=payload["message"],
+                conversation_id=payload.get("conversation_id")
+            ), "interactive", client)
+        ).serve()
     except Exception as e:
         print(f"WebSocket error: {e}")
 
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000, log_level="info")
@@ -7,6 +7,10 @@ class ChatRequest(BaseModel):
     documents: Optional[List[str]] = None
     json_schema: Optional[Dict[str, Any]] = None
     max_tokens: int = 2048
+    # Reply with Server-Sent Events (token deltas, then a final frame)
+    stream: bool = False
+    # Time-to-first-token target; may select a faster quantization of the model
+    latency_slo_ms: Optional[float] = None
 
 class ChatResponse(BaseModel):
     response: str
@@ -25,4 +29,5 @@ class Conversation(BaseModel):
 
 class BranchRequest(BaseModel):
     conversation_id: str
-    branch_point: int
+    branch_point: Optional[int] = None
+    message_id: Optional[str] = None
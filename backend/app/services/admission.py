@@ -0,0 +1,239 @@
+import asyncio
+import heapq
+import itertools
+import math
+import time
+from collections import Counter, deque
+from typing import Any, Dict, List, Optional
+
+from .metrics import registry
+from .tracing import tracer
+
+ADMISSION_WAIT = registry.histogram(
+    "localai_admission_wait_seconds", "Time requests waited for a model slot", ["priority"]
+)
+
+# Lower runs first
+PRIORITIES = {"interactive": 0, "upload": 1, "batch": 2}
+
+# Seconds a request may wait for a slot before it is no longer worth serving
+DEFAULT_DEADLINES = {"interactive": 30.0, "upload": 120.0, "batch": None}
+
+
+class Overloaded(Exception):
+    """A request was turned away; retry after `retry_after` seconds"""
+
+    def __init__(self, detail: str, retry_after: float, status_code: int = 503):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status_code = status_code
+
+
+class _Ticket:
+    def __init__(self, priority: str, client: Optional[str], deadline_at: Optional[float], sequence: int):
+        self.priority = priority
+        self.client = client
+        self.deadline_at = deadline_at
+        self.sequence = sequence
+        self.enqueued_at = 0.0
+        self.granted_at: Optional[float] = None
+        self.future: Optional[asyncio.Future] = None
+        self.released = False
+
+    def __lt__(self, other: "_Ticket") -> bool:
+        return (PRIORITIES[self.priority], self.sequence) < (PRIORITIES[other.priority], other.sequence)
+
+
+class AdmissionController:
+    """Decides when requests may use the model.
+
+    At most `max_concurrent` requests hold a slot at once, and each client may
+    have at most `max_per_client` requests running or queued. Waiting
+    requests are served by priority class, then in arrival order. The wait is
+    estimated from the queue ahead and the average time a slot is held; a
+    request that cannot start before its deadline is rejected up front, and
+    one that falls behind its deadline while queued is shed, rather than
+    served after its client has given up.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int = 1,
+        max_per_client: int = 4,
+        max_queue: int = 64,
+        deadlines: Optional[Dict[str, Optional[float]]] = None
+    ):
+        self.max_concurrent = max_concurrent
+        self.max_per_client = max_per_client
+        self.max_queue = max_queue
+        self.deadlines = {**DEFAULT_DEADLINES, **(deadlines or {})}
+        self.in_flight = 0
+        self.per_client = Counter()
+        self.queue: List[_Ticket] = []
+        # Moving average of how long a slot is held, in seconds
+        self.service_time: Optional[float] = None
+        self.admitted = Counter()
+        self.rejected = Counter()
+        self.shed = Counter()
+        self.wait_times = deque(maxlen=1024)
+        self._sequence = itertools.count()
+
+    def slot(self, priority: str = "interactive", client: Optional[str] = None, deadline: Optional[float] = None):
+        """Async context manager holding a slot for the duration of the block"""
+        return _Slot(self, priority, client, deadline)
+
+    def check(self, priority: str = "interactive", client: Optional[str] = None, deadline: Optional[float] = None):
+        """Raise Overloaded if a request arriving now would be turned away"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority class: {priority}")
+        if client is not None and self.per_client[client] >= self.max_per_client:
+            self.rejected[priority] += 1
+            raise Overloaded(
+                f"Too many concurrent requests from this client (limit {self.max_per_client})",
+                self._estimate_wait(self._ahead(priority)),
+                status_code=429
+            )
+        if self.in_flight < self.max_concurrent and not self.queue:
+            return
+        if len(self.queue) >= self.max_queue:
+            self.rejected[priority] += 1
+            raise Overloaded("Server busy: queue is full", self._estimate_wait(len(self.queue)))
+        timeout = deadline if deadline is not None else self.deadlines.get(priority)
+        wait = self._estimate_wait(self._ahead(priority))
+        if timeout is not None and wait > timeout:
+            self.rejected[priority] += 1
+            raise Overloaded(f"Server busy: estimated wait {wait:.1f}s exceeds {timeout:.0f}s", wait)
+
+    async def acquire(self, priority: str = "interactive", client: Optional[str] = None, deadline: Optional[float] = None) -> _Ticket:
+        """Wait for a slot; release it with release()"""
+        self.check(priority, client, deadline)
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        timeout = deadline if deadline is not None else self.deadlines.get(priority)
+        ticket = _Ticket(priority, client, now + timeout if timeout is not None else None, next(self._sequence))
+        ticket.enqueued_at = now
+        if client is not None:
+            self.per_client[client] += 1
+
+        if self.in_flight < self.max_concurrent and not self.queue:
+            self._grant(ticket, now)
+            return ticket
+
+        ticket.future = loop.create_future()
+        heapq.heappush(self.queue, ticket)
+        try:
+            remaining = None if ticket.deadline_at is None else max(0.0, ticket.deadline_at - now)
+            await asyncio.wait({ticket.future}, timeout=remaining)
+        except asyncio.CancelledError:
+            if ticket.granted_at is not None:
+                self.release(ticket)
+            else:
+                self._abandon(ticket)
+            raise
+        if ticket.granted_at is not None:
+            return ticket
+        if not ticket.future.done():
+            # Deadline passed while queued
+            self._abandon(ticket)
+            self.shed[priority] += 1
+            ticket.future.set_exception(Overloaded("Server busy: request expired in queue", self._estimate_wait(len(self.queue))))
+        return ticket.future.result()
+
+    def release(self, ticket: _Ticket):
+        """Give back a slot (idempotent)"""
+        if ticket.released or ticket.granted_at is None:
+            return
+        ticket.released = True
+        self.in_flight -= 1
+        if ticket.client is not None:
+            self.per_client[ticket.client] -= 1
+            if not self.per_client[ticket.client]:
+                del self.per_client[ticket.client]
+        held = asyncio.get_event_loop().time() - ticket.granted_at
+        self.service_time = held if self.service_time is None else 0.8 * self.service_time + 0.2 * held
+        self._dispatch()
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, wait times and admission counters"""
+        waits = sorted(self.wait_times)
+        return {
+            "max_concurrent": self.max_concurrent,
+            "in_flight": self.in_flight,
+            "queue_depth": {name: sum(t.priority == name for t in self.queue) for name in PRIORITIES},
+            "admitted": {name: self.admitted[name] for name in PRIORITIES},
+            "rejected": {name: self.rejected[name] for name in PRIORITIES},
+            "shed": {name: self.shed[name] for name in PRIORITIES},
+            "wait_ms": {
+                "avg": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+                "p95": round(waits[int(len(waits) * 0.95) - 1 if len(waits) > 1 else 0] * 1000, 1) if waits else 0.0,
+                "max": round(waits[-1] * 1000, 1) if waits else 0.0
+            },
+            "service_time_ms": round(self.service_time * 1000, 1) if self.service_time is not None else None
+        }
+
+    def pending(self, priority: str = "interactive") -> int:
+        """Requests holding a slot plus those queued at `priority` or more urgent"""
+        return self.in_flight + self._ahead(priority)
+
+    def _ahead(self, priority: str) -> int:
+        return sum(PRIORITIES[t.priority] <= PRIORITIES[priority] for t in self.queue)
+
+    def _estimate_wait(self, ahead: int) -> float:
+        if self.service_time is None:
+            return 0.0
+        # Slots free up every service_time / max_concurrent on average
+        return (ahead + 1) * self.service_time / self.max_concurrent
+
+    def _grant(self, ticket: _Ticket, now: float):
+        ticket.granted_at = now
+        self.in_flight += 1
+        self.admitted[ticket.priority] += 1
+        self.wait_times.append(now - ticket.enqueued_at)
+        ADMISSION_WAIT.labels(ticket.priority).observe(now - ticket.enqueued_at)
+        if ticket.future is not None:
+            ticket.future.set_result(ticket)
+
+    def _abandon(self, ticket: _Ticket):
+        if ticket in self.queue:
+            self.queue.remove(ticket)
+            heapq.heapify(self.queue)
+        if ticket.client is not None:
+            self.per_client[ticket.client] -= 1
+            if not self.per_client[ticket.client]:
+                del self.per_client[ticket.client]
+
+    def _dispatch(self):
+        now = asyncio.get_event_loop().time()
+        while self.in_flight < self.max_concurrent and self.queue:
+            self._grant(heapq.heappop(self.queue), now)
+
+        # Shed requests that can no longer start before their deadline
+        for position, ticket in enumerate(sorted(self.queue)):
+            if ticket.deadline_at is not None and now + self._estimate_wait(position) > ticket.deadline_at:
+                self._abandon(ticket)
+                self.shed[ticket.priority] += 1
+                ticket.future.set_exception(Overloaded(
+                    "Server busy: request would start after its deadline", self._estimate_wait(position)
+                ))
+
+
+class _Slot:
+    def __init__(self, controller: AdmissionController, priority: str, client: Optional[str], deadline: Optional[float]):
+        self.controller = controller
+        self.args = (priority, client, deadline)
+        self.ticket: Optional[_Ticket] = None
+
+    async def __aenter__(self):
+        start = time.perf_counter()
+        try:
+            self.ticket = await self.controller.acquire(*self.args)
+        except Overloaded:
+            tracer.record("admission.wait", start, time.perf_counter(), priority=self.args[0], admitted=False)
+            raise
+        tracer.record("admission.wait", start, time.perf_counter(), priority=self.args[0], admitted=True)
+        return self.ticket
+
+    async def __aexit__(self, *exc):
+        self.controller.release(self.ticket)
+        return False
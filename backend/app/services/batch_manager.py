@@ -0,0 +1,377 @@
+import asyncio
+import json
+import os
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import List, Dict, Any, AsyncGenerator, Optional
+
+import aiofiles
+
+try:
+    import fcntl
+except ImportError:  # Windows: a single server process, nothing to coordinate
+    fcntl = None
+
+from .admission import AdmissionController, Overloaded
+from .persistence import atomic_write
+
+# Fields of a batch request; anything else is rejected so typos don't go unnoticed
+REQUEST_FIELDS = {"custom_id", "message", "documents", "json_schema", "max_tokens", "model"}
+FINISHED_STATES = ("completed", "cancelled", "failed")
+
+
+def parse_batch_requests(body: bytes) -> List[Dict[str, Any]]:
+    """Requests from a JSON array or JSONL (one request object per line)"""
+    text = body.decode("utf-8").strip()
+    if text.startswith("["):
+        requests = json.loads(text)
+    else:
+        requests = []
+        for number, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                requests.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                raise ValueError(f"Line {number}: {e}")
+    if not requests:
+        raise ValueError("The batch is empty")
+
+    for index, request in enumerate(requests):
+        if not isinstance(request, dict) or not isinstance(request.get("message"), str):
+            raise ValueError(f"Request {index}: a \"message\" string is required")
+        unknown = set(request) - REQUEST_FIELDS
+        if unknown:
+            raise ValueError(f"Request {index}: unknown fields {', '.join(sorted(unknown))}")
+    return requests
+
+
+def _is_job_id(job_id: str) -> bool:
+    """Job ids are UUIDs; anything else (e.g. "..") must never become a path under batches_dir"""
+    try:
+        return str(uuid.UUID(job_id)) == job_id
+    except ValueError:
+        return False
+
+
+def schedule(requests: List[Dict[str, Any]], current_model: Optional[str] = None) -> List[int]:
+    """Order in which to run a batch, as indices into `requests`.
+
+    Requests are grouped by model, starting with the loaded one, so each model
+    is loaded at most once. Within a model they are sorted by prompt, which
+    puts requests with a common prefix (shared documents, a shared instruction
+    at the start of the message) next to each other; llama.cpp then reuses
+    the KV cache for that prefix instead of evaluating it again.
+    """
+    def key(index):
+        request = requests[index]
+        model = request.get("model") or current_model or ""
+        prompt = "\n".join(request.get("documents") or []) + "\n" + request["message"]
+        return (model != (current_model or ""), model, prompt)
+
+    return sorted(range(len(requests)), key=key)
+
+
+class BatchManager:
+    """Runs offline batch jobs on the local model.
+
+    Each job lives in its own directory under `batches_dir`: the requests
+    (requests.jsonl), the results appended as they complete (results.jsonl)
+    and the job's state (job.json). Jobs interrupted by a restart resume
+    with the requests that have no result yet. Requests run in the "batch"
+    admission class, so interactive and upload traffic always goes first.
+
+    Requests naming another model switch the loaded model for the duration
+    of their group. Interactive requests admitted in between load the
+    default model back first (ModelManager.use_default_model), so they are
+    never answered by a batch's model; it is also restored when the job ends.
+
+    Several worker processes may share `batches_dir`. A job runs in the
+    process holding the lock on its directory; the others read its state
+    from disk, and a job whose worker died is resumed by the next worker
+    to start.
+    """
+
+    def __init__(self, model_manager, batches_dir: Optional[Path] = None, admission: Optional[AdmissionController] = None):
+        self.model_manager = model_manager
+        self.admission = admission or AdmissionController()
+        self.batches_dir = Path(batches_dir or "batches")
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        self.queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Signalled whenever a result is written, for streaming readers
+        self._progress: Optional[asyncio.Condition] = None
+        # Lock file descriptors of the jobs this process runs
+        self._claims: Dict[str, int] = {}
+
+    async def initialize(self):
+        """Load saved jobs and resume the unfinished ones no other worker is running"""
+        self.batches_dir.mkdir(exist_ok=True)
+        self.queue = asyncio.Queue()
+        self._progress = asyncio.Condition()
+        for job_file in sorted(self.batches_dir.glob("*/job.json")):
+            job = self._load_job(job_file.parent.name)
+            if job is None:
+                continue
+            self.jobs[job["id"]] = job
+            if job["status"] not in FINISHED_STATES and self._claim(job["id"]):
+                print(f"🔁 Resuming batch {job['id']} ({job['done']}/{job['total']} done)")
+                self.queue.put_nowait(job["id"])
+        self._worker = asyncio.ensure_future(self._run())
+
+    async def close(self):
+        """Stop the worker; unfinished jobs resume on the next start"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        for job_id in list(self._claims):
+            self._release(job_id)
+
+    async def create_job(self, requests: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Save a batch and queue it"""
+        job = {
+            "id": str(uuid.uuid4()),
+            "status": "queued",
+            "created_at": datetime.now().isoformat(),
+            "finished_at": None,
+            "total": len(requests),
+            "done": 0,
+            "errors": 0
+        }
+        job_dir = self.batches_dir / job["id"]
+        job_dir.mkdir(parents=True)
+        self._claim(job["id"])
+        async with aiofiles.open(job_dir / "requests.jsonl", "w") as f:
+            await f.write("".join(json.dumps(request) + "\n" for request in requests))
+        await self._save_job(job)
+        self.jobs[job["id"]] = job
+        self.queue.put_nowait(job["id"])
+        return job
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job's state and progress (None for an unknown or malformed id)"""
+        if not _is_job_id(job_id):
+            return None
+        job = self.jobs.get(job_id)
+        if job_id in self._claims or (job is not None and job["status"] in FINISHED_STATES):
+            return job
+        # Run by another worker (or not yet seen): its files are authoritative
+        loaded = await asyncio.get_event_loop().run_in_executor(None, self._load_job, job_id)
+        if loaded is None:
+            return job
+        if job is None:
+            self.jobs[job_id] = job = loaded
+        else:
+            job.update(loaded)
+        return job
+
+    async def list_jobs(self) -> List[Dict[str, Any]]:
+        """All jobs, newest first"""
+        for job_file in self.batches_dir.glob("*/job.json"):
+            await self.get_job(job_file.parent.name)
+        return sorted(self.jobs.values(), key=lambda job: job["created_at"], reverse=True)
+
+    async def cancel_job(self, job_id: str) -> bool:
+        """Stop a job after the request it is running; its results are kept"""
+        job = await self.get_job(job_id)
+        if job is None:
+            return False
+        if job["status"] not in FINISHED_STATES:
+            await self._finish(job, "cancelled")
+        return True
+
+    async def iter_results(self, job_id: str, follow: bool = True) -> AsyncGenerator[str, None]:
+        """Result lines (JSONL) in completion order.
+
+        With `follow`, keeps yielding new results until the job finishes.
+        """
+        if not _is_job_id(job_id):
+            return
+        path = self.batches_dir / job_id / "results.jsonl"
+        offset = 0
+        while True:
+            job = await self.get_job(job_id)
+            if job is None:
+                return
+            finished = job["status"] in FINISHED_STATES
+            if path.exists():
+                async with aiofiles.open(path, "rb") as f:
+                    await f.seek(offset)
+                    while True:
+                        line = await f.readline()
+                        if not line.endswith(b"\n"):
+                            # Not written completely yet
+                            break
+                        offset += len(line)
+                        yield line.decode()
+            if finished or not follow:
+                return
+            async with self._progress:
+                try:
+                    await asyncio.wait_for(self._progress.wait(), 1.0)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _run(self):
+        while True:
+            job_id = await self.queue.get()
+            job = self.jobs.get(job_id)
+            if job is None or job["status"] in FINISHED_STATES:
+                self._release(job_id)
+                continue
+            try:
+                await self._run_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"❌ Batch {job_id} failed: {e}")
+                await self._finish(job, "failed", error=str(e))
+            finally:
+                if job["status"] in FINISHED_STATES:
+                    self._release(job_id)
+
+    async def _run_job(self, job: Dict[str, Any]):
+        job_dir = self.batches_dir / job["id"]
+        async with aiofiles.open(job_dir / "requests.jsonl", "r") as f:
+            requests = [json.loads(line) for line in (await f.read()).splitlines()]
+        results = await asyncio.get_event_loop().run_in_executor(
+            None, self._read_results, job_dir / "results.jsonl"
+        )
+        completed = {result["index"] for result in results}
+
+        if job["status"] != "running":
+            job["status"] = "running"
+            await self._save_job(job)
+
+        try:
+            for index in schedule(requests, self.model_manager.current_model_name):
+                if index in completed:
+                    continue
+                if job["status"] != "running" or self._cancelled_elsewhere(job):
+                    return
+                request = requests[index]
+                response = await self._generate(request)
+                result = {
+                    "index": index,
+                    "custom_id": request.get("custom_id"),
+                    "response": response["response"],
+                    "model": response.get("model"),
+                    "tokens_used": response.get("tokens_used"),
+                    "error": bool(response.get("error"))
+                }
+                async with aiofiles.open(job_dir / "results.jsonl", "a") as f:
+                    await f.write(json.dumps(result) + "\n")
+                job["done"] += 1
+                job["errors"] += result["error"]
+                async with self._progress:
+                    self._progress.notify_all()
+        finally:
+            if self.model_manager.default_model_name not in (None, self.model_manager.current_model_name):
+                async with self.admission.slot("batch"):
+                    await self.model_manager.use_default_model()
+
+        if job["status"] == "running":
+            await self._finish(job, "completed")
+
+    async def _generate(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        while True:
+            try:
+                async with self.admission.slot("batch"):
+                    await self._use_model(request.get("model"))
+                    return await self.model_manager.generate_response(
+                        message=request["message"],
+                        documents=request.get("documents"),
+                        json_schema=request.get("json_schema"),
+                        max_tokens=request.get("max_tokens", 2048)
+                    )
+            except Overloaded as e:
+                # The admission queue is full; try again once it has drained
+                await asyncio.sleep(e.retry_after)
+
+    async def _use_model(self, model_name: Optional[str]):
+        if model_name and model_name != self.model_manager.current_model_name:
+            if not await self.model_manager.load_model(model_name, default=False):
+                raise Exception(f"Could not load model {model_name}")
+
+    async def _finish(self, job: Dict[str, Any], status: str, error: Optional[str] = None):
+        job["status"] = status
+        job["finished_at"] = datetime.now().isoformat()
+        if error:
+            job["error"] = error
+        await self._save_job(job)
+        async with self._progress:
+            self._progress.notify_all()
+
+    async def _save_job(self, job: Dict[str, Any]):
+        path = self.batches_dir / job["id"] / "job.json"
+        # Progress is recounted from results.jsonl when the job is loaded
+        data = json.dumps({k: v for k, v in job.items() if k not in ("done", "errors")}, indent=2)
+        await asyncio.get_event_loop().run_in_executor(None, atomic_write, path, data)
+
+    def _claim(self, job_id: str) -> bool:
+        """Take the job's lock unless another worker holds it"""
+        if job_id in self._claims:
+            return True
+        if fcntl is None:
+            self._claims[job_id] = -1
+            return True
+        fd = os.open(self.batches_dir / job_id / ".lock", os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        self._claims[job_id] = fd
+        return True
+
+    def _release(self, job_id: str):
+        fd = self._claims.pop(job_id, None)
+        if fd is not None and fd >= 0:
+            os.close(fd)
+
+    def _cancelled_elsewhere(self, job: Dict[str, Any]) -> bool:
+        """Whether another worker cancelled the job through its job.json"""
+        try:
+            with open(self.batches_dir / job["id"] / "job.json", "r") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if saved["status"] == "cancelled":
+            job.update(status="cancelled", finished_at=saved.get("finished_at"))
+            return True
+        return False
+
+    def _load_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job_dir = self.batches_dir / job_id
+        try:
+            with open(job_dir / "job.json", 'r') as f:
+                job = json.load(f)
+            results = self._read_results(job_dir / "results.jsonl", repair=job_id in self._claims)
+            job["done"] = len(results)
+            job["errors"] = sum(result["error"] for result in results)
+            return job
+        except Exception as e:
+            print(f"Error loading batch {job_id}: {e}")
+            return None
+
+    def _read_results(self, path: Path, repair: bool = True) -> List[Dict[str, Any]]:
+        """Results written so far.
+
+        A line cut short by a crash is dropped, and with `repair` truncated;
+        only the worker running the job may repair, since for the others the
+        line may still be being written.
+        """
+        if not path.exists():
+            return []
+        with open(path, "rb") as f:
+            data = f.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        if repair and len(complete) != len(data):
+            with open(path, "r+b") as f:
+                f.truncate(len(complete))
+        return [json.loads(line) for line in complete.splitlines() if line.strip()]
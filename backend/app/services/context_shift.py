@@ -0,0 +1,223 @@
+import os
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from .metrics import registry
+from .tracing import tracer
+
+CONTEXT_SHIFTS = registry.counter(
+    "localai_context_shifts_total",
+    "Prompts trimmed to fit the context window, by whether the KV cache was shifted or re-prefilled",
+    ["result"]
+)
+CONTEXT_SHIFT_SAVED_TOKENS = registry.counter(
+    "localai_context_shift_saved_tokens_total", "Prompt tokens a context shift kept from being evaluated again"
+)
+
+# Tokens a chat template adds around each message (role markers, separators);
+# an estimate, used only to decide how many turns fit
+MESSAGE_OVERHEAD = 8
+
+
+class Shift:
+    """Drop cached tokens [keep, keep + discard) and slide the rest down.
+
+    `reused` tokens after the kept prefix then match the new prompt and are
+    not evaluated again.
+    """
+
+    def __init__(self, keep: int, discard: int, reused: int):
+        self.keep = keep
+        self.discard = discard
+        self.reused = reused
+
+    def __repr__(self):
+        return f"Shift(keep={self.keep}, discard={self.discard}, reused={self.reused})"
+
+
+class ContextShiftPolicy:
+    """Decides which turns are sent once a conversation outgrows the context window.
+
+    Leading system messages and the first `keep_messages` turns are pinned
+    and always sent. When the rest no longer fits in `n_ctx` with room for
+    the reply, the oldest turns after the pinned ones are dropped, whole
+    turns at a time, until they fill at most (1 - `discard`) of the space
+    left. Dropping more than strictly needed leaves room for the next few
+    turns, so a conversation shifts every few turns instead of every turn.
+    """
+
+    def __init__(
+        self,
+        n_ctx: int = 4096,
+        keep_messages: int = 0,
+        discard: float = 0.5,
+        reserve: int = 1024,
+        min_reuse: int = 16,
+        enabled: bool = True
+    ):
+        self.n_ctx = n_ctx
+        self.keep_messages = keep_messages
+        self.discard = min(max(discard, 0.0), 0.9)
+        # Tokens kept free for the reply (at most the request's max_tokens)
+        self.reserve = reserve
+        # Fewer matching tokens than this aren't worth shifting the cache for
+        self.min_reuse = min_reuse
+        self.enabled = enabled
+
+    @classmethod
+    def from_env(cls) -> "ContextShiftPolicy":
+        return cls(
+            n_ctx=int(os.environ.get("LOCALAI_N_CTX", "4096")),
+            keep_messages=int(os.environ.get("LOCALAI_CONTEXT_KEEP", "0")),
+            discard=float(os.environ.get("LOCALAI_CONTEXT_DISCARD", "0.5")),
+            reserve=int(os.environ.get("LOCALAI_CONTEXT_RESERVE", "1024")),
+            enabled=os.environ.get("LOCALAI_CONTEXT_SHIFT", "1").lower() not in ("0", "false", "no", "off")
+        )
+
+    def pinned(self, messages: Sequence[Dict[str, Any]]) -> int:
+        """Number of leading messages that are never dropped"""
+        count = 0
+        while count < len(messages) - 1 and messages[count]["role"] == "system":
+            count += 1
+        return min(count + self.keep_messages, max(len(messages) - 1, 0))
+
+    def window(
+        self,
+        messages: Sequence[Dict[str, Any]],
+        count_tokens: Callable[[Dict[str, Any]], int],
+        max_tokens: int,
+        start: int = 0
+    ) -> int:
+        """Index of the oldest unpinned message to send.
+
+        `start` is where the previous turn of the same conversation started;
+        the window only moves forward from there, so the cached tokens stay
+        a match. Messages are counted newest first and only as far as the
+        window reaches.
+        """
+        pinned = self.pinned(messages)
+        start = max(start, pinned)
+        last = len(messages) - 1
+        if last <= start:
+            return start
+        budget = self.n_ctx - min(max_tokens, self.reserve) - sum(count_tokens(m) for m in messages[:pinned])
+        target = budget * (1 - self.discard)
+
+        tail = 0
+        cut = last
+        for index in range(last, start - 1, -1):
+            tail += count_tokens(messages[index])
+            if tail > budget:
+                return cut
+            if tail <= target and messages[index]["role"] == "user":
+                cut = index
+        return start
+
+    def plan(self, cached: Sequence[int], prompt: Sequence[int]) -> Optional[Shift]:
+        """How to shift `cached` tokens so as much of `prompt` as possible is already evaluated.
+
+        Finds where the prompt leaves the cache (after the pinned prefix),
+        then where it picks up again further on: the tokens in between
+        belong to the dropped turns.
+        """
+        cached, prompt = list(cached), list(prompt)
+        keep = 0
+        limit = min(len(cached), len(prompt))
+        while keep < limit and cached[keep] == prompt[keep]:
+            keep += 1
+        probe = prompt[keep:keep + self.min_reuse]
+        if len(probe) < self.min_reuse:
+            return None
+        for start in range(keep + 1, len(cached) - len(probe) + 1):
+            if cached[start] == probe[0] and cached[start:start + len(probe)] == probe:
+                reused = len(probe)
+                while (
+                    start + reused < len(cached)
+                    and keep + reused < len(prompt)
+                    and cached[start + reused] == prompt[keep + reused]
+                ):
+                    reused += 1
+                return Shift(keep, start - keep, reused)
+        return None
+
+
+def _kv_operations(model):
+    """(remove, add) sequence operations of a llama-cpp-python context, if exposed"""
+    ctx = getattr(model, "_ctx", None)
+    # The names changed across llama-cpp-python releases
+    for remove, add in (
+        ("kv_cache_seq_rm", "kv_cache_seq_shift"),
+        ("kv_cache_seq_rm", "kv_cache_seq_add"),
+        ("memory_seq_rm", "memory_seq_add"),
+    ):
+        if hasattr(ctx, remove) and hasattr(ctx, add):
+            return getattr(ctx, remove), getattr(ctx, add)
+    return None
+
+
+class ContextShifter:
+    """Shifts a llama-cpp-python model's KV cache when the prompt was trimmed.
+
+    llama-cpp-python reuses the cached tokens that match the start of a new
+    prompt and evaluates the rest. Dropping the oldest turns breaks that
+    match right after the pinned prefix, so the whole remaining conversation
+    would be evaluated again. Instead, the dropped turns' tokens are removed
+    from the cache (llama_kv_cache_seq_rm) and the later ones moved down to
+    close the gap (llama_kv_cache_seq_add), which makes them a prefix match
+    again; only the new turn is evaluated.
+
+    attach() wraps the model's generate(), the point where the formatted
+    prompt's tokens are known. Shifts happen only after expect() — for
+    prompts this process trimmed — never for an unrelated prompt that
+    merely shares text with the cache.
+    """
+
+    def __init__(self, model, policy: ContextShiftPolicy):
+        self.model = model
+        self.policy = policy
+        self.operations = _kv_operations(model)
+        self.pending = 0
+        self._generate = model.generate
+
+    @classmethod
+    def attach(cls, model, policy: ContextShiftPolicy) -> "ContextShifter":
+        shifter = cls(model, policy)
+        model.generate = shifter.generate
+        return shifter
+
+    @property
+    def supported(self) -> bool:
+        return self.operations is not None
+
+    def expect(self, dropped_messages: int):
+        """The next prompt has `dropped_messages` fewer turns than the cached one"""
+        self.pending = dropped_messages
+
+    def generate(self, tokens, *args, **kwargs):
+        dropped, self.pending = self.pending, 0
+        if dropped and kwargs.get("reset", True):
+            self._shift(list(tokens), dropped)
+        return self._generate(tokens, *args, **kwargs)
+
+    def _shift(self, tokens: List[int], dropped: int):
+        model = self.model
+        with tracer.span("model.context_shift", dropped_messages=dropped, prompt_tokens=len(tokens)) as span:
+            shift = None
+            if self.supported and model.n_tokens:
+                shift = self.policy.plan(model.input_ids[:model.n_tokens], tokens)
+            if shift is None:
+                span.set(result="reprefill")
+                CONTEXT_SHIFTS.labels("reprefill").inc()
+                return
+
+            remove, add = self.operations
+            keep, discard, end = shift.keep, shift.discard, model.n_tokens
+            remove(0, keep, keep + discard)
+            add(0, keep + discard, end, -discard)
+            model.input_ids[keep:end - discard] = model.input_ids[keep + discard:end]
+            if getattr(getattr(model, "context_params", None), "logits_all", False):
+                model.scores[keep:end - discard] = model.scores[keep + discard:end]
+            model.n_tokens = end - discard
+
+            span.set(result="shifted", kept_tokens=keep, discarded_tokens=discard, reused_tokens=shift.reused)
+            CONTEXT_SHIFTS.labels("shifted").inc()
+            CONTEXT_SHIFT_SAVED_TOKENS.inc(shift.reused)
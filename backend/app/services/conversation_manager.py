@@ -1,71 +1,277 @@
 import json
+import time
 import uuid
+from collections import OrderedDict
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from pathlib import Path
 
+from .conversation_store import ConversationStore, build_message
+from .persistence import WriteBehindQueue, sqlite_synchronous
+from .metrics import registry
+from .tracing import tracer
+
+STORE_LATENCY = registry.histogram(
+    "localai_conversation_store_seconds",
+    "Time spent in conversation store operations, on the writer thread and waiting for it",
+    ["op"]
+)
+
 class ConversationManager:
-    def __init__(self):
-        self.conversations_dir = Path("conversations")
-        self.conversations = {}
-        
+    def __init__(
+        self,
+        conversations_dir: Optional[Path] = None,
+        cache_size: int = 128,
+        fsync_policy: str = "batch",
+        write_window: float = 0.05
+    ):
+        self.conversations_dir = Path(conversations_dir or "conversations")
+        self.store = ConversationStore(
+            self.conversations_dir / "conversations.db",
+            synchronous=sqlite_synchronous(fsync_policy)
+        )
+        # Writes are applied in batches off the event loop; all store access
+        # goes through the queue's thread so reads see every earlier write
+        self.writes = WriteBehindQueue(
+            self._apply_writes, window=write_window, on_failure=self._write_failed, unit_of=self._write_unit
+        )
+        # Recently used conversations (summary + messages), least recent first
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
     async def initialize(self):
         """Initialize conversation manager"""
         self.conversations_dir.mkdir(exist_ok=True)
-        await self._load_saved_conversations()
-    
-    async def _load_saved_conversations(self):
-        """Load conversations from disk"""
+        await self.writes.run(self.store.open)
+        await self.writes.run(self._import_legacy_conversations)
+        self.writes.start()
+
+    async def close(self):
+        """Flush pending writes and close the conversation store"""
+        await self.writes.close()
+        self.store.close()
+        self.cache.clear()
+
+    async def flush(self):
+        """Wait until every write made so far is committed.
+
+        Raises WriteBehindError if any write failed since the last flush.
+        """
+        await self.writes.flush()
+
+    async def _read(self, fn, *args):
+        with tracer.span("conversations.read", op=fn.__name__):
+            # Failed writes are raised by flush() and close(), not by unrelated reads
+            await self.writes.flush(check=False)
+            return await self._run(fn, *args)
+
+    async def _run(self, fn, *args):
+        """Run a store call on the writer thread, timing it"""
+        start = time.perf_counter()
+        try:
+            return await self.writes.run(fn, *args)
+        finally:
+            STORE_LATENCY.labels(fn.__name__).observe(time.perf_counter() - start)
+
+    def _apply_writes(self, writes):
+        start = time.perf_counter()
+        try:
+            self.store.apply(writes)
+        finally:
+            STORE_LATENCY.labels("write_batch").observe(time.perf_counter() - start)
+
+    @staticmethod
+    def _write_unit(write) -> str:
+        """The conversation a write belongs to: its writes are retried together after a failed batch"""
+        kind, payload = write
+        return payload["conversation_id"] if kind == "message" else payload["id"]
+
+    def _write_failed(self, write, error):
+        # The cached copy holds what couldn't be saved: read the store's instead
+        self.cache.pop(self._write_unit(write), None)
+
+    def _import_legacy_conversations(self):
+        """Move conversations saved as one JSON file each into the store"""
         for file_path in self.conversations_dir.glob("*.json"):
             try:
                 with open(file_path, 'r') as f:
                     conversation_data = json.load(f)
-                self.conversations[conversation_data['id']] = conversation_data
+                self.store.import_conversation(conversation_data)
+                file_path.rename(file_path.with_suffix(".json.imported"))
             except Exception as e:
-                print(f"Error loading conversation {file_path}: {e}")
-    
-    async def branch_conversation(self, conversation_id: str, branch_point: int) -> Dict[str, Any]:
-        """Create a branch from existing conversation"""
-        if conversation_id not in self.conversations:
+                print(f"Error importing conversation {file_path}: {e}")
+
+    def _cache_put(self, conversation: Dict[str, Any]):
+        self.cache[conversation["id"]] = conversation
+        self.cache.move_to_end(conversation["id"])
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    async def get_summary(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Get a conversation without its messages"""
+        cached = self.cache.get(conversation_id)
+        if cached is not None:
+            return {k: v for k, v in cached.items() if k != "messages"}
+        return await self._read(self.store.get_conversation, conversation_id)
+
+    async def create_conversation(self, title: Optional[str] = None, conversation_id: Optional[str] = None) -> Dict[str, Any]:
+        """Create a new, empty conversation"""
+        now = datetime.now().isoformat()
+        conversation = {
+            "id": conversation_id or str(uuid.uuid4()),
+            "title": title or "New Chat",
+            "created_at": now,
+            "updated_at": now,
+            "parent_id": None,
+            "branch_point": None,
+            "head_id": None,
+            "message_count": 0
+        }
+        self.writes.submit("conversation", conversation)
+        self._cache_put({**conversation, "messages": []})
+        return conversation
+
+    async def add_message(
+        self,
+        conversation_id: str,
+        role: str,
+        content: str,
+        model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Append a message to a conversation.
+
+        The message is built against the hydrated conversation and queued;
+        repeated appends to one conversation collapse into a single head update.
+        """
+        with tracer.span("conversations.add_message", role=role):
+            conversation = await self.get_conversation(conversation_id)
+            if conversation is None:
+                raise ValueError("Conversation not found")
+
+            parent = conversation["messages"][-1] if conversation["messages"] else None
+            message = build_message(conversation_id, parent, role, content, datetime.now().isoformat(), model)
+            conversation["messages"].append(message)
+            conversation["head_id"] = message["id"]
+            conversation["message_count"] = message["depth"] + 1
+            conversation["updated_at"] = message["created_at"]
+
+            self.writes.submit("message", message)
+            self.writes.submit("head", {
+                "id": conversation_id,
+                "head_id": message["id"],
+                "message_count": conversation["message_count"],
+                "updated_at": message["created_at"]
+            }, key=conversation_id)
+            return message
+
+    async def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Get a conversation including its messages, hydrating it into the LRU"""
+        cached = self.cache.get(conversation_id)
+        if cached is not None:
+            self.cache_hits += 1
+            self.cache.move_to_end(conversation_id)
+            return cached
+
+        self.cache_misses += 1
+        with tracer.span("conversations.hydrate") as span:
+            summary = await self._read(self.store.get_conversation, conversation_id)
+            if summary is None:
+                return None
+            conversation = {**summary, "messages": await self._run(self.store.get_path, summary["head_id"])}
+            span.set(messages=len(conversation["messages"]))
+        self._cache_put(conversation)
+        return conversation
+
+    async def get_messages(
+        self,
+        conversation_id: str,
+        offset: int = 0,
+        limit: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Messages of a conversation, oldest first, optionally a range of them"""
+        if (offset == 0 and limit is None) or conversation_id in self.cache:
+            conversation = await self.get_conversation(conversation_id)
+            if conversation is None:
+                raise ValueError("Conversation not found")
+            end = None if limit is None else offset + limit
+            return conversation["messages"][offset:end]
+
+        # Partial reads of cold conversations skip hydration entirely
+        summary = await self._read(self.store.get_conversation, conversation_id)
+        if summary is None:
             raise ValueError("Conversation not found")
-        
-        original = self.conversations[conversation_id]
+        return await self._run(self.store.get_path_range, summary["head_id"], offset, limit)
+
+    async def list_conversations(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        sort: str = "updated_at",
+        order: str = "desc"
+    ) -> Dict[str, Any]:
+        """One page of conversation summaries plus the cursor for the next page"""
+        return await self._read(self.store.list_conversations, limit, cursor, sort, order != "asc")
+
+    async def search(
+        self,
+        query: str,
+        limit: int = 20,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        model: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        offset: int = 0,
+        recent: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Full-text search over all messages, best matches first"""
+        return await self._read(self.store.search, query, limit, since, until, model, conversation_id, offset, recent)
+
+    async def branch_conversation(
+        self,
+        conversation_id: str,
+        branch_point: Optional[int] = None,
+        message_id: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Create a branch from existing conversation.
+
+        The branch is a new head pointing into the shared message tree: either
+        at `message_id`, or at the message before `branch_point`. Nothing is
+        copied.
+        """
+        original = await self.get_summary(conversation_id)
+        if original is None:
+            raise ValueError("Conversation not found")
+
+        if message_id is not None:
+            base = await self._read(self.store.get_message, message_id)
+            if base is None:
+                raise ValueError("Message not found")
+            head_id, message_count = base["id"], base["depth"] + 1
+        else:
+            message_count = max(0, min(branch_point or 0, original["message_count"]))
+            head_id = await self._read(self.store.ancestor_at, original["head_id"], message_count - 1)
+
         new_id = str(uuid.uuid4())
-        
+        now = datetime.now().isoformat()
+
         # Create branched conversation
         branched_conv = {
             "id": new_id,
             "title": f"Branch of {original.get('title', 'Conversation')}",
-            "created_at": datetime.now().isoformat(),
-            "messages": original["messages"][:branch_point],
+            "created_at": now,
+            "updated_at": now,
             "parent_id": conversation_id,
-            "branch_point": branch_point
+            "branch_point": message_count,
+            "head_id": head_id,
+            "message_count": message_count
         }
-        
-        self.conversations[new_id] = branched_conv
-        await self._save_conversation(branched_conv)
-        
+
+        self.writes.submit("conversation", branched_conv)
         return branched_conv
-    
-    async def get_all_conversations(self) -> List[Dict[str, Any]]:
-        """Get all conversations"""
-        return list(self.conversations.values())
-    
+
     async def delete_conversation(self, conversation_id: str) -> bool:
         """Delete a conversation"""
-        if conversation_id in self.conversations:
-            del self.conversations[conversation_id]
-            
-            # Delete file
-            file_path = self.conversations_dir / f"{conversation_id}.json"
-            if file_path.exists():
-                file_path.unlink()
-            
-            return True
-        return False
-    
-    async def _save_conversation(self, conversation: Dict[str, Any]):
-        """Save conversation to disk"""
-        file_path = self.conversations_dir / f"{conversation['id']}.json"
-        with open(file_path, 'w') as f:
-            json.dump(conversation, f, indent=2)
+        self.cache.pop(conversation_id, None)
+        return await self._read(self.store.delete_conversation, conversation_id)
@@ -0,0 +1,646 @@
+import base64
+import hashlib
+import html
+import json
+import re
+import sqlite3
+import threading
+import uuid
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from datetime import datetime
+from pathlib import Path
+
+SCHEMA_VERSION = 3
+
+# Conversations are heads into a shared message tree: every message points at
+# its parent, and a conversation (or branch) is just the id of its newest
+# message. Branching never copies messages.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id TEXT PRIMARY KEY,
+    title TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    parent_id TEXT,
+    branch_point INTEGER,
+    base_id TEXT,
+    head_id TEXT,
+    message_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    parent_id TEXT,
+    conversation_id TEXT NOT NULL,
+    depth INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    model TEXT,
+    prefix_hash TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS messages_by_owner ON messages (conversation_id);
+CREATE INDEX IF NOT EXISTS conversations_by_base ON conversations (base_id);
+CREATE INDEX IF NOT EXISTS conversations_by_updated ON conversations (updated_at, id);
+CREATE INDEX IF NOT EXISTS conversations_by_created ON conversations (created_at, id);
+CREATE INDEX IF NOT EXISTS conversations_by_title ON conversations (title, id);
+"""
+
+# Full-text index over message content. It is an external-content FTS5
+# table keyed by the messages rowid and kept current by triggers, so every
+# append updates the inverted index in the same transaction. VACUUM may
+# renumber rowids; run rebuild_search_index() after vacuuming.
+SEARCH_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5 (
+        content,
+        content = 'messages',
+        content_rowid = 'rowid',
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3 4 5 6'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.rowid, old.content);
+        INSERT INTO messages_fts (rowid, content) VALUES (new.rowid, new.content);
+    END
+    """,
+    "CREATE INDEX IF NOT EXISTS messages_by_created ON messages (created_at)",
+]
+
+STOP_WORDS = {
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "can", "do", "for", "from", "how",
+    "i", "if", "in", "is", "it", "me", "my", "of", "on", "or", "so", "that", "the", "this",
+    "to", "was", "we", "what", "when", "which", "with", "you", "your",
+}
+
+SORT_COLUMNS = {"updated_at", "created_at", "title"}
+
+SUMMARY_COLUMNS = "id, title, created_at, updated_at, parent_id, branch_point, head_id, message_count"
+MESSAGE_FIELDS = ["id", "parent_id", "conversation_id", "depth", "role", "content", "created_at", "model", "prefix_hash"]
+MESSAGE_COLUMNS = ", ".join(MESSAGE_FIELDS)
+
+
+def build_message(
+    conversation_id: str,
+    parent: Optional[Dict[str, Any]],
+    role: str,
+    content: str,
+    created_at: str,
+    model: Optional[str] = None,
+    message_id: Optional[str] = None
+) -> Dict[str, Any]:
+    """A message row placed under `parent` (None for the first message)"""
+    return {
+        "id": message_id or str(uuid.uuid4()),
+        "parent_id": parent["id"] if parent else None,
+        "conversation_id": conversation_id,
+        "depth": parent["depth"] + 1 if parent else 0,
+        "role": role,
+        "content": content,
+        "created_at": created_at,
+        "model": model,
+        "prefix_hash": message_prefix_hash(parent["prefix_hash"] if parent else None, role, content),
+    }
+
+
+def message_prefix_hash(parent_hash: Optional[str], role: str, content: str) -> str:
+    """Hash of a message and everything before it.
+
+    Two messages have the same prefix hash exactly when the conversations
+    leading up to them are identical, which makes it usable as a key for
+    the inference prefix (KV) cache.
+    """
+    digest = hashlib.sha256()
+    digest.update((parent_hash or "").encode())
+    digest.update(b"\x00")
+    digest.update(role.encode())
+    digest.update(b"\x00")
+    digest.update(content.encode("utf-8", "surrogatepass"))
+    return digest.hexdigest()[:32]
+
+
+class ConversationStore:
+    """SQLite-backed conversation store.
+
+    The database runs in WAL mode so appending a message is a single small
+    transaction (one WAL frame append, no file rewrite) and a crash can never
+    leave a half-written conversation behind.
+    """
+
+    def __init__(self, db_path: Path, synchronous: str = "NORMAL"):
+        self.db_path = Path(db_path)
+        self.synchronous = synchronous
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def open(self):
+        """Open the database and create or migrate the schema"""
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(
+            str(self.db_path),
+            isolation_level=None,
+            check_same_thread=False
+        )
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA synchronous={self.synchronous}")
+
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        with self._transaction() as conn:
+            if version < 2 and self._table_exists("messages"):
+                self._migrate_v1(conn)
+            for statement in SCHEMA.split(";"):
+                conn.execute(statement)
+            for statement in SEARCH_SCHEMA:
+                conn.execute(statement)
+            if version < 3:
+                # Index messages written before full-text search existed
+                conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+            conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        """Checkpoint the WAL and close the database"""
+        with self._lock:
+            if self._conn is not None:
+                self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                self._conn.close()
+                self._conn = None
+
+    def _transaction(self):
+        return _Transaction(self._conn, self._lock)
+
+    def _table_exists(self, name: str) -> bool:
+        row = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)
+        ).fetchone()
+        return row is not None
+
+    def _migrate_v1(self, conn: sqlite3.Connection):
+        """Convert flat per-conversation message lists into the message tree"""
+        conn.execute("ALTER TABLE messages RENAME TO messages_v1")
+        conn.execute("ALTER TABLE conversations RENAME TO conversations_v1")
+        for statement in SCHEMA.split(";"):
+            conn.execute(statement)
+        for conversation in conn.execute("SELECT * FROM conversations_v1").fetchall():
+            messages = conn.execute(
+                "SELECT role, content, created_at, model FROM messages_v1 "
+                "WHERE conversation_id = ? ORDER BY seq",
+                (conversation["id"],)
+            ).fetchall()
+            self._insert_chain(conn, dict(conversation), [dict(m) for m in messages])
+        conn.execute("DROP TABLE messages_v1")
+        conn.execute("DROP TABLE conversations_v1")
+
+    def get_conversation(self, conversation_id: str) -> Optional[Dict[str, Any]]:
+        """Read one conversation summary - message bodies are not touched"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {SUMMARY_COLUMNS} FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def count_conversations(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM conversations").fetchone()[0]
+
+    def list_conversations(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        sort: str = "updated_at",
+        descending: bool = True
+    ) -> Dict[str, Any]:
+        """One page of conversation summaries using keyset pagination.
+
+        The cursor encodes the (sort value, id) of the last row returned, so
+        each page is an index range scan regardless of how deep it is.
+        """
+        if sort not in SORT_COLUMNS:
+            raise ValueError(f"Unsupported sort column: {sort}")
+
+        direction = "DESC" if descending else "ASC"
+        query = f"SELECT {SUMMARY_COLUMNS} FROM conversations"
+        params: List[Any] = []
+        if cursor:
+            value, last_id = _decode_cursor(cursor)
+            query += f" WHERE ({sort}, id) {'<' if descending else '>'} (?, ?)"
+            params.extend([value, last_id])
+        query += f" ORDER BY {sort} {direction}, id {direction} LIMIT ?"
+        params.append(limit + 1)
+
+        with self._lock:
+            rows = [dict(row) for row in self._conn.execute(query, params).fetchall()]
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = _encode_cursor(rows[-1][sort], rows[-1]["id"])
+        return {"conversations": rows, "next_cursor": next_cursor}
+
+    def create_conversation(self, conversation: Dict[str, Any]):
+        """Insert a new conversation pointing at an existing head (or none)"""
+        with self._transaction() as conn:
+            self._write_conversation(conn, conversation)
+
+    def _write_conversation(self, conn: sqlite3.Connection, conversation: Dict[str, Any]):
+        conn.execute(
+            "INSERT INTO conversations "
+            "(id, title, created_at, updated_at, parent_id, branch_point, base_id, head_id, message_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                conversation["id"],
+                conversation["title"],
+                conversation["created_at"],
+                conversation.get("updated_at", conversation["created_at"]),
+                conversation.get("parent_id"),
+                conversation.get("branch_point"),
+                conversation.get("head_id"),
+                conversation.get("head_id"),
+                conversation.get("message_count", 0),
+            )
+        )
+
+    def _write_head(self, conn: sqlite3.Connection, conversation: Dict[str, Any]):
+        conn.execute(
+            "UPDATE conversations SET head_id = ?, message_count = ?, updated_at = ? WHERE id = ?",
+            (conversation["head_id"], conversation["message_count"], conversation["updated_at"], conversation["id"])
+        )
+
+    def apply(self, writes: List[Tuple[str, Dict[str, Any]]]):
+        """Apply a batch of writes in a single transaction.
+
+        Each write is ("conversation", summary) for a new conversation,
+        ("message", row) for a message made with build_message, or
+        ("head", summary) to advance a conversation's head.
+        """
+        with self._transaction() as conn:
+            for kind, payload in writes:
+                if kind == "message":
+                    self._write_message(conn, payload)
+                elif kind == "conversation":
+                    self._write_conversation(conn, payload)
+                elif kind == "head":
+                    self._write_head(conn, payload)
+                else:
+                    raise ValueError(f"Unknown write: {kind}")
+
+    def append_message(self, conversation_id: str, message: Dict[str, Any]) -> Dict[str, Any]:
+        """Append one message under the conversation's head and advance the head"""
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT head_id FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
+            if row is None:
+                raise KeyError(conversation_id)
+            stored = self._insert_message(conn, conversation_id, row["head_id"], message)
+            conn.execute(
+                "UPDATE conversations SET head_id = ?, message_count = ?, updated_at = ? WHERE id = ?",
+                (stored["id"], stored["depth"] + 1, stored["created_at"], conversation_id)
+            )
+        return stored
+
+    def _insert_message(
+        self,
+        conn: sqlite3.Connection,
+        conversation_id: str,
+        parent_id: Optional[str],
+        message: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        parent = None
+        if parent_id is not None:
+            parent = conn.execute(
+                "SELECT id, depth, prefix_hash FROM messages WHERE id = ?", (parent_id,)
+            ).fetchone()
+        stored = build_message(
+            conversation_id,
+            parent,
+            message["role"],
+            message["content"],
+            message["created_at"],
+            message.get("model"),
+            message_id=message.get("id")
+        )
+        self._write_message(conn, stored)
+        return stored
+
+    def _write_message(self, conn: sqlite3.Connection, message: Dict[str, Any]):
+        conn.execute(
+            f"INSERT INTO messages ({MESSAGE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            tuple(message.get(field) for field in MESSAGE_FIELDS)
+        )
+
+    def get_message(self, message_id: str) -> Optional[Dict[str, Any]]:
+        """Load a single message"""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {MESSAGE_COLUMNS} FROM messages WHERE id = ?", (message_id,)
+            ).fetchone()
+        return _message_from_row(row) if row else None
+
+    def iter_path(self, head_id: Optional[str], chunk_size: int = 256) -> Iterator[Dict[str, Any]]:
+        """Walk from a head towards the root, newest message first.
+
+        Rows are fetched `chunk_size` ancestors at a time so callers that only
+        need the tail of a long branch never read the shared prefix.
+        """
+        next_id = head_id
+        while next_id is not None:
+            with self._lock:
+                rows = self._conn.execute(
+                    f"""
+                    WITH RECURSIVE path (n, {MESSAGE_COLUMNS}) AS (
+                        SELECT 1, {MESSAGE_COLUMNS} FROM messages WHERE id = ?
+                        UNION ALL
+                        SELECT path.n + 1, {", ".join("m." + field for field in MESSAGE_FIELDS)}
+                        FROM messages m JOIN path ON m.id = path.parent_id
+                        WHERE path.n < ?
+                    )
+                    SELECT {MESSAGE_COLUMNS} FROM path ORDER BY n
+                    """,
+                    (next_id, chunk_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield _message_from_row(row)
+            next_id = rows[-1]["parent_id"]
+
+    def get_path(self, head_id: Optional[str]) -> List[Dict[str, Any]]:
+        """Materialize a branch, oldest message first"""
+        messages = list(self.iter_path(head_id))
+        messages.reverse()
+        return messages
+
+    def get_path_range(self, head_id: Optional[str], offset: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Messages with depth in [offset, offset + limit), oldest first"""
+        end = None if limit is None else offset + limit
+        messages = []
+        for message in self.iter_path(head_id):
+            if message["depth"] < offset:
+                break
+            if end is None or message["depth"] < end:
+                messages.append(message)
+        messages.reverse()
+        return messages
+
+    def ancestor_at(self, head_id: Optional[str], depth: int) -> Optional[str]:
+        """Id of the ancestor of `head_id` at the given depth (0 = root)"""
+        if depth < 0:
+            return None
+        for message in self.iter_path(head_id):
+            if message["depth"] == depth:
+                return message["id"]
+            if message["depth"] < depth:
+                break
+        return None
+
+    def search(
+        self,
+        query: str,
+        limit: int = 20,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        model: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        offset: int = 0,
+        recent: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """BM25-ranked full-text search over message content.
+
+        Terms are ANDed; a trailing `*` makes a term a prefix query.
+        `conversation_id` restricts results to the messages on that
+        conversation's branch, including the prefix it shares with others.
+        Results are the top matches across all messages, from `offset` on.
+
+        With `recent`, only the newest `recent` messages are ranked: cheaper
+        for very common terms, but older matches are missed however good.
+        """
+        match = build_match_query(query)
+        cte, where, params = "", ["messages_fts MATCH ?"], [match]
+        if conversation_id is not None:
+            cte = (
+                "WITH RECURSIVE branch (id, parent_id) AS ("
+                "SELECT id, parent_id FROM messages WHERE id = (SELECT head_id FROM conversations WHERE id = ?) "
+                "UNION ALL SELECT m.id, m.parent_id FROM messages m JOIN branch ON m.id = branch.parent_id) "
+            )
+            params.insert(0, conversation_id)
+            where.append("m.id IN (SELECT id FROM branch)")
+        if since is not None:
+            where.append("m.created_at >= ?")
+            params.append(since)
+        if until is not None:
+            where.append("m.created_at < ?")
+            params.append(until)
+        if model is not None:
+            where.append("m.model = ?")
+            params.append(model)
+
+        matches = (
+            cte + "SELECT messages_fts.rowid{columns} FROM messages_fts "
+            + ("JOIN messages m ON m.rowid = messages_fts.rowid " if len(where) > 1 else "")
+            + "WHERE " + " AND ".join(where)
+        )
+
+        with self._lock:
+            if recent is not None:
+                # FTS5 applies rowid ranges natively
+                newest = self._conn.execute("SELECT max(rowid) FROM messages").fetchone()[0] or 0
+                matches += " AND messages_fts.rowid > ?"
+                params.append(max(0, newest - recent))
+            ranked = self._conn.execute(
+                matches.format(columns=", bm25(messages_fts) AS score")
+                + " ORDER BY score, messages_fts.rowid DESC LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+
+            results = []
+            for rowid, score in ranked:
+                row = self._conn.execute(
+                    "SELECT m.id, m.conversation_id, m.role, m.content, m.created_at, m.model, c.title "
+                    "FROM messages m LEFT JOIN conversations c ON c.id = m.conversation_id "
+                    "WHERE m.rowid = ?",
+                    (rowid,)
+                ).fetchone()
+                result = dict(row)
+                result["snippet"] = make_snippet(result.pop("content"), query)
+                result["score"] = score
+                results.append(result)
+        return results
+
+    def rebuild_search_index(self):
+        """Re-index all messages from scratch"""
+        with self._transaction() as conn:
+            conn.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+    def delete_conversation(self, conversation_id: str) -> bool:
+        """Delete a conversation and the messages no other branch still uses"""
+        with self._transaction() as conn:
+            cursor = conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+            if cursor.rowcount == 0:
+                return False
+
+            # Branches created from this conversation keep their shared prefix
+            # alive; hand those messages over to the first such branch.
+            dependents = conn.execute(
+                "SELECT c.id, c.base_id FROM conversations c "
+                "JOIN messages m ON m.id = c.base_id WHERE m.conversation_id = ?",
+                (conversation_id,)
+            ).fetchall()
+            if dependents:
+                conn.execute(
+                    f"""
+                    WITH RECURSIVE keep (id, parent_id) AS (
+                        SELECT id, parent_id FROM messages
+                        WHERE id IN ({", ".join("?" * len(dependents))})
+                        UNION
+                        SELECT m.id, m.parent_id FROM messages m JOIN keep ON m.id = keep.parent_id
+                        WHERE m.conversation_id = ?
+                    )
+                    UPDATE messages SET conversation_id = ?
+                    WHERE conversation_id = ? AND id IN (SELECT id FROM keep)
+                    """,
+                    [row["base_id"] for row in dependents] + [conversation_id, dependents[0]["id"], conversation_id]
+                )
+            conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+        return True
+
+    def import_conversation(self, conversation: Dict[str, Any]):
+        """Import a conversation in the legacy one-JSON-file format"""
+        with self._transaction() as conn:
+            exists = conn.execute(
+                "SELECT 1 FROM conversations WHERE id = ?", (conversation["id"],)
+            ).fetchone()
+            if not exists:
+                self._insert_chain(conn, conversation, conversation.get("messages", []))
+
+    def _insert_chain(self, conn: sqlite3.Connection, conversation: Dict[str, Any], messages: List[Dict[str, Any]]):
+        created_at = conversation.get("created_at") or datetime.now().isoformat()
+        head_id = None
+        for message in messages:
+            head_id = self._insert_message(conn, conversation["id"], head_id, {
+                "role": message.get("role", "user"),
+                "content": message.get("content", ""),
+                "created_at": message.get("created_at", created_at),
+                "model": message.get("model"),
+            })["id"]
+        conn.execute(
+            "INSERT INTO conversations "
+            "(id, title, created_at, updated_at, parent_id, branch_point, base_id, head_id, message_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, NULL, ?, ?)",
+            (
+                conversation["id"],
+                conversation.get("title", "Conversation"),
+                created_at,
+                conversation.get("updated_at", created_at),
+                conversation.get("parent_id"),
+                conversation.get("branch_point"),
+                head_id,
+                len(messages),
+            )
+        )
+
+
+class _Transaction:
+    """BEGIN IMMEDIATE ... COMMIT, rolled back if the block raises"""
+
+    def __init__(self, conn: sqlite3.Connection, lock: threading.RLock):
+        self.conn = conn
+        self.lock = lock
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.lock.acquire()
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.execute("COMMIT")
+            else:
+                self.conn.execute("ROLLBACK")
+        finally:
+            self.lock.release()
+        return False
+
+
+def build_match_query(query: str) -> str:
+    """Turn free text into an FTS5 query of quoted (optionally prefix) terms.
+
+    Stop words are dropped unless the query consists of nothing else: they
+    match most messages, add almost nothing to BM25 and dominate its cost.
+    """
+    terms = re.findall(r"[\w']+\*?", query)
+    if not terms:
+        raise ValueError("Empty search query")
+    terms = [t for t in terms if t.lower() not in STOP_WORDS] or terms
+    quoted = []
+    for term in terms:
+        prefix = term.endswith("*")
+        term = term.rstrip("*").replace('"', '""')
+        quoted.append(f'"{term}"' + ("*" if prefix else ""))
+    return " ".join(quoted)
+
+
+def make_snippet(content: str, query: str, width: int = 16) -> str:
+    """Window of about `width` words around the first hit, hits wrapped in <mark>.
+
+    The text is HTML-escaped, so only the markers are markup. Built in Python rather than with FTS5's snippet(), which would re-run
+    the match for every returned row.
+    """
+    patterns = []
+    for term in re.findall(r"[\w']+\*?", query):
+        prefix = term.endswith("*")
+        patterns.append(r"\b" + re.escape(term.rstrip("*")) + (r"[\w']*" if prefix else r"\b"))
+    hit = re.compile("|".join(patterns), re.IGNORECASE)
+
+    words = content.split()
+    first = next((i for i, word in enumerate(words) if hit.search(word)), 0)
+    start = max(0, first - width // 4)
+    window = words[start:start + width]
+    text = " ".join(window)
+    # Escape around the hits rather than before matching: escaping turns
+    # apostrophes into entities the terms would no longer match
+    parts, end = [], 0
+    for match in hit.finditer(text):
+        parts.append(html.escape(text[end:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group(0))}</mark>")
+        end = match.end()
+    parts.append(html.escape(text[end:]))
+    text = "".join(parts)
+    if start > 0:
+        text = "…" + text
+    if start + width < len(words):
+        text += "…"
+    return text
+
+
+def _encode_cursor(value: Any, last_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, last_id]).encode()).decode()
+
+
+def _decode_cursor(cursor: str):
+    try:
+        value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return value, last_id
+
+
+def _message_from_row(row: sqlite3.Row) -> Dict[str, Any]:
+    message = dict(row)
+    if not message.get("model"):
+        message.pop("model", None)
+    return message
@@ -1,14 +1,91 @@
 import os
-import PyPDF2
-from PIL import Image
-import pytesseract
 from fastapi import UploadFile
+import hashlib
 import io
-from typing import List, Dict, Any
+import importlib.util
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
 import asyncio
 
+from .fingerprints import SegmentIndex, content_hash
+from .metrics import registry
+from .tracing import tracer
+
+EXTRACTION_SECONDS = registry.histogram(
+    "localai_document_extraction_seconds", "Time to extract text from an uploaded document", ["format"]
+)
+EXTRACTED_BYTES = registry.counter(
+    "localai_document_bytes_total", "Bytes of uploaded documents processed", ["format"]
+)
+DEDUP_RATIO = registry.histogram(
+    "localai_document_dedup_ratio", "Share of an upload's text already ingested from earlier uploads", ["format"],
+    buckets=(0.0, 0.1, 0.25, 0.5, 0.75, 0.9, 0.95, 0.99, 1.0)
+)
+SEGMENTS = registry.counter(
+    "localai_document_segments_total", "Ingested document segments (pages, paragraphs, images) by status", ["status"]
+)
+EXTRACTIONS_SKIPPED = registry.counter(
+    "localai_document_extractions_skipped_total", "Segments whose text was reused instead of extracted again", ["format"]
+)
+
+# Blank lines separate the paragraphs of a text file
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+async def _already_extracted(text: str) -> str:
+    return text
+
+def _hash_pdf_object(obj, digest, seen: set):
+    """Feed a PDF object, with everything it references resolved, into `digest`"""
+    from PyPDF2.generic import ArrayObject, DictionaryObject, IndirectObject, StreamObject
+    
+    if isinstance(obj, IndirectObject):
+        # Visited once each, which also stops reference cycles
+        if (obj.idnum, obj.generation) in seen:
+            return
+        seen.add((obj.idnum, obj.generation))
+        obj = obj.get_object()
+    if isinstance(obj, StreamObject):
+        digest.update(b"stream:" + obj.get_data())
+    if isinstance(obj, DictionaryObject):
+        for key in sorted(obj):
+            if key != "/Parent":
+                digest.update(f"{key}:".encode())
+                _hash_pdf_object(obj.raw_get(key), digest, seen)
+    elif isinstance(obj, ArrayObject):
+        for item in obj:
+            _hash_pdf_object(item, digest, seen)
+    elif not isinstance(obj, StreamObject):
+        digest.update(repr(obj).encode() + b";")
+
+def _pdf_page_key(page) -> bytes:
+    """What a page's extracted text depends on.
+
+    The content stream alone is not enough: the same bytes draw different
+    text under other fonts (encodings, ToUnicode maps, subset glyph codes)
+    or form XObjects, so the page's resolved /Resources are included.
+    """
+    digest = hashlib.sha256()
+    contents = page.get_contents()
+    digest.update(contents.get_data() if contents is not None else b"")
+    _hash_pdf_object(page.get("/Resources"), digest, set())
+    digest.update(repr(page.get("/Rotate", 0)).encode())
+    return digest.digest()
+
+# PyPDF2, PIL and pytesseract are imported on first use: they take longer to
+# import than the rest of the app, and most requests never need them
+
 class DocumentProcessor:
-    def __init__(self):
+    def __init__(self, documents_dir: Optional[Path] = None):
+        # Segment fingerprints of everything ingested, for incremental re-ingestion
+        self.documents_dir = Path(documents_dir or "documents")
+        self.index = SegmentIndex(
+            self.documents_dir / "fingerprints.db",
+            max_documents=int(os.environ.get("LOCALAI_FINGERPRINT_MAX_DOCUMENTS", "1000"))
+        )
         self.supported_formats = {
             'pdf': self._process_pdf,
             'txt': self._process_text,
@@ -20,12 +97,15 @@ class DocumentProcessor:
     async def initialize(self):
         """Initialize document processor"""
         print("📄 Initializing Document Processor...")
-        # Check if tesseract is available for OCR
-        try:
-            pytesseract.get_tesseract_version()
+        # Check if tesseract is available for OCR, without importing it yet
+        if importlib.util.find_spec("pytesseract") and shutil.which("tesseract"):
             print("✅ OCR support available")
-        except:
+        else:
             print("⚠️  OCR not available - install tesseract for image text extraction")
+        await asyncio.get_event_loop().run_in_executor(None, self.index.open)
+    
+    async def close(self):
+        self.index.close()
     
     async def process_file(self, file: UploadFile) -> str:
         """Process uploaded file and extract text"""
@@ -39,13 +119,92 @@ class DocumentProcessor:
         
         # Process based on file type
         processor = self.supported_formats[file_extension]
-        text_content = await processor(content)
+        start = time.perf_counter()
+        with tracer.span("documents.extract", format=file_extension, bytes=len(content)) as span:
+            text_content = await processor(content)
+            span.set(chars=len(text_content))
+        EXTRACTION_SECONDS.labels(file_extension).observe(time.perf_counter() - start)
+        EXTRACTED_BYTES.labels(file_extension).inc(len(content))
         
         return text_content
     
+    async def ingest(self, file: UploadFile) -> Dict[str, Any]:
+        """Extract text like process_file, reusing what earlier uploads already extracted.
+
+        The file is split into segments (PDF pages, text paragraphs, whole
+        images). A segment whose raw key was seen before gets its stored
+        text without being extracted again; every segment is then
+        fingerprinted (see SegmentIndex) and reported as unchanged,
+        near-duplicate or new, so downstream processing can be limited to
+        what changed. Returns the text and the report, with "dedup_ratio".
+        """
+        file_extension = file.filename.split('.')[-1].lower()
+        if file_extension not in self.supported_formats:
+            raise ValueError(f"Unsupported file format: {file_extension}")
+        content = await file.read()
+        loop = asyncio.get_event_loop()
+        
+        start = time.perf_counter()
+        with tracer.span("documents.ingest", format=file_extension, bytes=len(content)) as span:
+            # Parsing a PDF is CPU-bound: keep it off the event loop
+            segments, join = await loop.run_in_executor(None, self._split, file_extension, content)
+            raw_hashes = [content_hash(raw) for raw, _ in segments]
+            known = await loop.run_in_executor(None, self.index.known_sources, raw_hashes)
+            texts = []
+            for raw_hash, (_, extract) in zip(raw_hashes, segments):
+                texts.append(known[raw_hash] if raw_hash in known else await extract())
+            skipped = sum(raw_hash in known for raw_hash in raw_hashes)
+            
+            fingerprinted = [(raw_hash, text) for raw_hash, text in zip(raw_hashes, texts) if text.strip()]
+            report = await loop.run_in_executor(
+                None, self.index.add_document, str(uuid.uuid4()), file.filename, fingerprinted
+            )
+            report["extractions_skipped"] = skipped
+            span.set(segments=report["segments"], unchanged=report["unchanged"], dedup_ratio=report["dedup_ratio"])
+        
+        EXTRACTION_SECONDS.labels(file_extension).observe(time.perf_counter() - start)
+        EXTRACTED_BYTES.labels(file_extension).inc(len(content))
+        EXTRACTIONS_SKIPPED.labels(file_extension).inc(skipped)
+        DEDUP_RATIO.labels(file_extension).observe(report["dedup_ratio"])
+        for status in ("unchanged", "near_duplicate", "new"):
+            SEGMENTS.labels(status).inc(report[status])
+        return {"text": join(texts), "report": report}
+    
+    async def remove_document(self, document_id: str) -> bool:
+        """Forget an ingested document's fingerprints (and text no other document shares)"""
+        return await asyncio.get_event_loop().run_in_executor(None, self.index.remove_document, document_id)
+    
+    def _split(self, file_extension: str, content: bytes) -> Tuple[List[Tuple[bytes, Callable[[], Awaitable[str]]]], Callable[[List[str]], str]]:
+        """(raw key, extractor) per segment, and how to join the segments' text.
+
+        The raw key identifies everything a segment's text is extracted from:
+        its bytes, or for a PDF page, its content stream and resources.
+        """
+        if file_extension == 'pdf':
+            try:
+                import PyPDF2
+                pages = PyPDF2.PdfReader(io.BytesIO(content)).pages
+            except Exception as e:
+                raise Exception(f"PDF processing error: {str(e)}")
+            
+            def page_segment(page):
+                return _pdf_page_key(page), lambda: asyncio.get_event_loop().run_in_executor(None, page.extract_text)
+            
+            try:
+                return [page_segment(page) for page in pages], lambda texts: "\n".join(texts).strip()
+            except Exception as e:
+                raise Exception(f"PDF processing error: {str(e)}")
+        if file_extension == 'txt':
+            text = content.decode('utf-8')
+            parts = [part for part in _PARAGRAPH_BREAK.split(text) if part.strip()]
+            # The text itself is returned unchanged; paragraphs are only fingerprinted
+            return [(part.encode('utf-8'), lambda part=part: _already_extracted(part)) for part in parts], lambda texts: text
+        return [(content, lambda: self.supported_formats[file_extension](content))], lambda texts: texts[0]
+    
     async def _process_pdf(self, content: bytes) -> str:
         """Extract text from PDF"""
         try:
+            import PyPDF2
             pdf_file = io.BytesIO(content)
             pdf_reader = PyPDF2.PdfReader(pdf_file)
             
@@ -64,6 +223,8 @@ class DocumentProcessor:
     async def _process_image(self, content: bytes) -> str:
         """Extract text from image using OCR"""
         try:
+            from PIL import Image
+            import pytesseract
             image = Image.open(io.BytesIO(content))
             text = pytesseract.image_to_string(image)
             return text.strip()
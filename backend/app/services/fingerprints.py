@@ -0,0 +1,299 @@
+import hashlib
+import json
+import random
+import re
+import sqlite3
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+# MinHash signatures: NUM_PERM hash permutations, split into BANDS bands for
+# locality-sensitive hashing. Two segments share a band bucket (and become
+# candidates) with high probability once their Jaccard similarity passes
+# about (1 / BANDS) ** (1 / ROWS) ~ 0.5; candidates are then compared in full.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 3
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(0x5EED)
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+_WORD = re.compile(r"\w+")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    hash TEXT PRIMARY KEY,
+    text TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS sources (
+    raw_hash TEXT PRIMARY KEY,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS lsh (
+    band INTEGER NOT NULL,
+    bucket TEXT NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS lsh_bucket ON lsh (band, bucket);
+CREATE INDEX IF NOT EXISTS lsh_hash ON lsh (hash);
+CREATE INDEX IF NOT EXISTS sources_hash ON sources (hash);
+CREATE TABLE IF NOT EXISTS documents (
+    id TEXT PRIMARY KEY,
+    filename TEXT,
+    created_at REAL NOT NULL,
+    report TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS document_segments (
+    document_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    PRIMARY KEY (document_id, position)
+);
+CREATE INDEX IF NOT EXISTS document_segments_hash ON document_segments (hash)
+"""
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def text_hash(text: str) -> str:
+    """Hash of a segment's text, ignoring differences in whitespace"""
+    return content_hash(" ".join(text.split()).encode("utf-8"))
+
+
+def shingles(text: str, size: int = SHINGLE_WORDS) -> Set[str]:
+    """Overlapping runs of `size` words, lowercased"""
+    words = _WORD.findall(text.lower())
+    if len(words) <= size:
+        return {" ".join(words)} if words else set()
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+def minhash(text: str) -> Tuple[int, ...]:
+    """MinHash signature of the text's shingles"""
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles(text)]
+    if not hashes:
+        return (_PRIME,) * NUM_PERM
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(first: Tuple[int, ...], second: Tuple[int, ...]) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures"""
+    return sum(a == b for a, b in zip(first, second)) / NUM_PERM
+
+
+def lsh_buckets(signature: Tuple[int, ...]) -> List[Tuple[int, str]]:
+    return [
+        (band, hashlib.blake2b(struct.pack(f"<{ROWS}Q", *signature[band * ROWS:(band + 1) * ROWS]), digest_size=8).hexdigest())
+        for band in range(BANDS)
+    ]
+
+
+def _pack(signature: Tuple[int, ...]) -> bytes:
+    return struct.pack(f"<{NUM_PERM}Q", *signature)
+
+
+def _unpack(blob: bytes) -> Tuple[int, ...]:
+    return struct.unpack(f"<{NUM_PERM}Q", blob)
+
+
+class SegmentIndex:
+    """Fingerprints of every document segment (page, paragraph, image) ingested so far.
+
+    Segments are stored once per distinct text (by hash), with the text
+    itself, so a later upload containing the same segment reuses it.
+    `sources` maps the hash of a segment's raw bytes (a PDF page's content
+    stream, an image) to its text, which lets extraction be skipped
+    altogether. MinHash signatures in LSH buckets find segments that
+    changed only slightly.
+
+    Segments are kept while a document holding them is: remove_document()
+    drops a document and the segments only it held, and with
+    `max_documents` the oldest documents are dropped beyond that many.
+    """
+
+    def __init__(self, db_path: Path, near_duplicate_threshold: float = 0.8, max_documents: Optional[int] = None):
+        self.db_path = Path(db_path)
+        self.near_duplicate_threshold = near_duplicate_threshold
+        self.max_documents = max_documents
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.RLock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.db_path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(str(self.db_path), isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA.split(";"):
+                conn.execute(statement)
+            self._conn = conn
+        return self._conn
+
+    def open(self):
+        with self._lock:
+            self._connection()
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    def known_sources(self, raw_hashes: Iterable[str]) -> Dict[str, str]:
+        """Text already extracted from these raw segments, by raw hash"""
+        raw_hashes = list(set(raw_hashes))
+        known = {}
+        with self._lock:
+            conn = self._connection()
+            for i in range(0, len(raw_hashes), 500):
+                chunk = raw_hashes[i:i + 500]
+                rows = conn.execute(
+                    f"SELECT sources.raw_hash, segments.text FROM sources JOIN segments ON segments.hash = sources.hash "
+                    f"WHERE sources.raw_hash IN ({','.join('?' * len(chunk))})", chunk
+                ).fetchall()
+                known.update(rows)
+        return known
+
+    def add_document(self, document_id: str, filename: str, segments: List[Tuple[str, str]]) -> Dict[str, Any]:
+        """Record a document's (raw hash, text) segments and classify each one.
+
+        A segment is "unchanged" when a segment with the same text came
+        in an earlier document, "near_duplicate" when one from an earlier
+        document is at least `near_duplicate_threshold` similar, and "new"
+        otherwise. A segment repeated within the document gets the status
+        of its first occurrence.
+        """
+        details = []
+        related: Dict[str, int] = {}
+        # This document's segments so far, and those of them first stored by it
+        seen: Dict[str, Dict[str, Any]] = {}
+        added: Set[str] = set()
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN")
+            try:
+                for position, (raw_hash, text) in enumerate(segments):
+                    digest = text_hash(text)
+                    detail = {"hash": digest, "chars": len(text), "status": "new"}
+                    if digest in seen:
+                        detail.update({k: v for k, v in seen[digest].items() if k not in ("hash", "chars")})
+                    elif conn.execute("SELECT 1 FROM segments WHERE hash = ?", (digest,)).fetchone():
+                        detail["status"] = "unchanged"
+                        related[digest] = related.get(digest, 0) + 1
+                    else:
+                        signature = minhash(text)
+                        match, score = self._most_similar(conn, signature, added)
+                        if match is not None and score >= self.near_duplicate_threshold:
+                            detail.update(status="near_duplicate", similar_to=match, similarity=round(score, 3))
+                            related[match] = related.get(match, 0) + 1
+                        conn.execute(
+                            "INSERT INTO segments (hash, text, signature, created_at) VALUES (?, ?, ?, ?)",
+                            (digest, text, _pack(signature), time.time())
+                        )
+                        conn.executemany(
+                            "INSERT INTO lsh (band, bucket, hash) VALUES (?, ?, ?)",
+                            [(band, bucket, digest) for band, bucket in lsh_buckets(signature)]
+                        )
+                        added.add(digest)
+                    seen.setdefault(digest, detail)
+                    conn.execute("INSERT OR IGNORE INTO sources (raw_hash, hash) VALUES (?, ?)", (raw_hash, digest))
+                    conn.execute(
+                        "INSERT INTO document_segments (document_id, position, hash) VALUES (?, ?, ?)",
+                        (document_id, position, digest)
+                    )
+                    details.append(detail)
+
+                report = self._report(conn, document_id, details, related)
+                conn.execute(
+                    "INSERT INTO documents (id, filename, created_at, report) VALUES (?, ?, ?, ?)",
+                    (document_id, filename, time.time(), json.dumps(report))
+                )
+                if self.max_documents is not None:
+                    oldest = conn.execute(
+                        "SELECT id FROM documents ORDER BY created_at DESC, rowid DESC LIMIT -1 OFFSET ?",
+                        (self.max_documents,)
+                    ).fetchall()
+                    for (expired,) in oldest:
+                        self._remove(conn, expired)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return {**report, "segment_details": details}
+
+    def remove_document(self, document_id: str) -> bool:
+        """Forget a document, and the segments no other document holds"""
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN")
+            try:
+                removed = self._remove(conn, document_id)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return removed
+
+    def _remove(self, conn: sqlite3.Connection, document_id: str) -> bool:
+        hashes = [row[0] for row in conn.execute(
+            "SELECT DISTINCT hash FROM document_segments WHERE document_id = ?", (document_id,)
+        )]
+        conn.execute("DELETE FROM document_segments WHERE document_id = ?", (document_id,))
+        removed = conn.execute("DELETE FROM documents WHERE id = ?", (document_id,)).rowcount > 0
+        for digest in hashes:
+            if conn.execute("SELECT 1 FROM document_segments WHERE hash = ? LIMIT 1", (digest,)).fetchone():
+                continue
+            conn.execute("DELETE FROM segments WHERE hash = ?", (digest,))
+            conn.execute("DELETE FROM lsh WHERE hash = ?", (digest,))
+            conn.execute("DELETE FROM sources WHERE hash = ?", (digest,))
+        return removed
+
+    def _most_similar(
+        self, conn: sqlite3.Connection, signature: Tuple[int, ...], exclude: Set[str]
+    ) -> Tuple[Optional[str], float]:
+        candidates = set()
+        for band, bucket in lsh_buckets(signature):
+            candidates.update(row[0] for row in conn.execute("SELECT hash FROM lsh WHERE band = ? AND bucket = ?", (band, bucket)))
+        best, best_score = None, 0.0
+        for digest in candidates - exclude:
+            row = conn.execute("SELECT signature FROM segments WHERE hash = ?", (digest,)).fetchone()
+            score = similarity(signature, _unpack(row[0]))
+            if score > best_score:
+                best, best_score = digest, score
+        return best, best_score
+
+    def _report(self, conn: sqlite3.Connection, document_id: str, details: List[Dict[str, Any]], related: Dict[str, int]):
+        counts = {"unchanged": 0, "near_duplicate": 0, "new": 0}
+        for detail in details:
+            counts[detail["status"]] += 1
+        total_chars = sum(d["chars"] for d in details)
+        reused_chars = sum(d["chars"] for d in details if d["status"] == "unchanged")
+
+        # The earlier upload sharing the most segments: most likely a previous version
+        previous = None
+        if related:
+            hashes = list(related)[:500]
+            row = conn.execute(
+                f"SELECT document_id, COUNT(DISTINCT hash) AS shared FROM document_segments "
+                f"WHERE hash IN ({','.join('?' * len(hashes))}) AND document_id != ? "
+                f"GROUP BY document_id ORDER BY shared DESC, MAX(rowid) DESC LIMIT 1",
+                hashes + [document_id]
+            ).fetchone()
+            if row is not None:
+                filename = conn.execute("SELECT filename FROM documents WHERE id = ?", (row[0],)).fetchone()
+                previous = {"document_id": row[0], "filename": filename[0] if filename else None, "shared_segments": row[1]}
+        return {
+            "document_id": document_id,
+            "segments": len(details),
+            **counts,
+            # Share of the document's text that was already ingested
+            "dedup_ratio": round(reused_chars / total_chars, 4) if total_chars else 0.0,
+            "previous_version": previous
+        }
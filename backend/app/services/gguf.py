@@ -0,0 +1,112 @@
+import re
+import struct
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterable, Optional
+
+GGUF_MAGIC = b"GGUF"
+
+# Value types of GGUF metadata
+_UINT8, _INT8, _UINT16, _INT16, _UINT32, _INT32, _FLOAT32, _BOOL, _STRING, _ARRAY, _UINT64, _INT64, _FLOAT64 = range(13)
+_SCALARS = {
+    _UINT8: "<B", _INT8: "<b", _UINT16: "<H", _INT16: "<h", _UINT32: "<I", _INT32: "<i",
+    _FLOAT32: "<f", _BOOL: "<?", _UINT64: "<Q", _INT64: "<q", _FLOAT64: "<d",
+}
+
+# general.file_type (llama_ftype) -> (name, approximate bits per weight).
+# Bits per weight order the quantizations by quality.
+FILE_TYPES = {
+    0: ("F32", 32.0), 1: ("F16", 16.0), 2: ("Q4_0", 4.55), 3: ("Q4_1", 5.0),
+    7: ("Q8_0", 8.5), 8: ("Q5_0", 5.54), 9: ("Q5_1", 6.0), 10: ("Q2_K", 3.35),
+    11: ("Q3_K_S", 3.5), 12: ("Q3_K_M", 3.91), 13: ("Q3_K_L", 4.27), 14: ("Q4_K_S", 4.58),
+    15: ("Q4_K_M", 4.89), 16: ("Q5_K_S", 5.54), 17: ("Q5_K_M", 5.69), 18: ("Q6_K", 6.56),
+    19: ("IQ2_XXS", 2.06), 20: ("IQ2_XS", 2.31), 21: ("Q2_K_S", 2.97), 22: ("IQ3_XS", 3.3),
+    23: ("IQ3_XXS", 3.06), 24: ("IQ1_S", 1.56), 25: ("IQ4_NL", 4.5), 26: ("IQ3_S", 3.44),
+    27: ("IQ3_M", 3.66), 28: ("IQ2_S", 2.5), 29: ("IQ2_M", 2.7), 30: ("IQ4_XS", 4.25),
+    31: ("IQ1_M", 1.75), 32: ("BF16", 16.0),
+}
+_BITS_BY_NAME = {name: bits for name, bits in FILE_TYPES.values()}
+
+# Quantization names as they appear in file names (model-Q4_K_M.gguf, model.q8_0.gguf)
+_QUANT_IN_NAME = re.compile(
+    r"[-_.](" + "|".join(sorted((re.escape(name) for name in _BITS_BY_NAME), key=len, reverse=True)) + r")(?=[-_.]|$)",
+    re.IGNORECASE
+)
+
+
+class GGUFError(Exception):
+    """Not a GGUF file, or one this reader doesn't understand"""
+
+
+def _read(f: BinaryIO, fmt: str):
+    size = struct.calcsize(fmt)
+    data = f.read(size)
+    if len(data) != size:
+        raise GGUFError("Unexpected end of file")
+    return struct.unpack(fmt, data)[0]
+
+
+def _read_string(f: BinaryIO, length_fmt: str) -> str:
+    length = _read(f, length_fmt)
+    data = f.read(length)
+    if len(data) != length:
+        raise GGUFError("Unexpected end of file")
+    return data.decode("utf-8", errors="replace")
+
+
+def _read_value(f: BinaryIO, kind: int, length_fmt: str, arrays: bool):
+    if kind in _SCALARS:
+        return _read(f, _SCALARS[kind])
+    if kind == _STRING:
+        return _read_string(f, length_fmt)
+    if kind == _ARRAY:
+        item_kind = _read(f, "<I")
+        count = _read(f, length_fmt)
+        if arrays:
+            return [_read_value(f, item_kind, length_fmt, arrays) for _ in range(count)]
+        # Skip the contents (vocabularies run to 100k+ entries); keep the length
+        if item_kind in _SCALARS:
+            f.seek(count * struct.calcsize(_SCALARS[item_kind]), 1)
+        else:
+            for _ in range(count):
+                _read_value(f, item_kind, length_fmt, arrays)
+        return {"array_length": count}
+    raise GGUFError(f"Unknown metadata value type {kind}")
+
+
+def read_metadata(path: Path, keys: Optional[Iterable[str]] = None, arrays: bool = False) -> Dict[str, Any]:
+    """Key/value metadata from a GGUF file's header, without loading any tensors.
+
+    With `keys`, reading stops as soon as they have all been seen. Arrays
+    are returned as {"array_length": n} unless `arrays` is set.
+    """
+    wanted = set(keys) if keys is not None else None
+    with open(path, "rb") as f:
+        if f.read(4) != GGUF_MAGIC:
+            raise GGUFError(f"Not a GGUF file: {path}")
+        version = _read(f, "<I")
+        if version not in (1, 2, 3):
+            raise GGUFError(f"Unsupported GGUF version {version}")
+        # Version 1 used 32-bit counts and string lengths
+        length_fmt = "<I" if version == 1 else "<Q"
+        tensor_count = _read(f, length_fmt)
+        kv_count = _read(f, length_fmt)
+
+        metadata: Dict[str, Any] = {"gguf.version": version, "gguf.tensor_count": tensor_count}
+        for _ in range(kv_count):
+            key = _read_string(f, length_fmt)
+            metadata[key] = _read_value(f, _read(f, "<I"), length_fmt, arrays)
+            if wanted is not None and wanted.issubset(metadata):
+                break
+        return metadata
+
+
+def quantization_from_name(filename: str) -> Optional[str]:
+    """The quantization named in a file name (model-Q4_K_M.gguf -> Q4_K_M), if any"""
+    match = None
+    for match in _QUANT_IN_NAME.finditer(Path(filename).stem):
+        pass
+    return match.group(1).upper() if match else None
+
+
+def bits_per_weight(quantization: Optional[str]) -> Optional[float]:
+    return _BITS_BY_NAME.get((quantization or "").upper())
@@ -0,0 +1,270 @@
+import bisect
+import math
+import os
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from a cache hit to a long generation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Value:
+    """One labelled series of a counter or gauge"""
+
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class _HistogramValue:
+    """One labelled series of a histogram"""
+
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # One count per bucket plus the +Inf overflow, not yet cumulative
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: Any):
+        """The series for these label values, created on first use"""
+        # Label values are usually strings already: look them up as given first
+        series = self._series.get(values)
+        if series is None:
+            key = tuple(map(str, values))
+            series = self._series.get(key)
+        if series is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {key}")
+            with self._lock:
+                series = self._series.setdefault(key, self._new_series())
+        return series
+
+    def _new_series(self):
+        return _Value()
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted(self._series.items())
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, series in self._snapshot():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(series.value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_series(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, series in self._snapshot():
+            with series._lock:
+                counts, total = list(series.counts), series.sum
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = 'le="' + _format_value(bound) + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+# What a collector returns: (name, type, help, [(labels, value), ...]) per metric
+Sample = Tuple[str, str, str, List[Tuple[Dict[str, Any], float]]]
+
+
+class Registry:
+    """Metrics of this process, rendered in the Prometheus text format.
+
+    Counters, gauges and histograms are updated where things happen; each
+    series holds its own lock, taken only around the arithmetic, so
+    updating one costs well under a microsecond and never waits on a
+    scrape. Collectors are callables run at scrape time, for values that
+    already live elsewhere (queue depth, cache counters, memory).
+    """
+
+    def __init__(self):
+        self.metrics: Dict[str, _Metric] = {}
+        self.collectors: List[Callable[[], Iterable[Sample]]] = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric_class, name: str, *args, **kwargs):
+        with self._lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(name, *args, **kwargs)
+            return self.metrics[name]
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter, name, documentation, labelnames)
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram, name, documentation, labelnames, buckets)
+
+    def register_collector(self, collector: Callable[[], Iterable[Sample]]):
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            try:
+                samples = list(collector())
+            except Exception as e:
+                print(f"⚠️  Metrics collector failed: {e}")
+                continue
+            for name, kind, documentation, values in samples:
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in values:
+                    lines.append(f"{name}{_format_labels(list(labels), list(labels.values()))} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def resident_memory_bytes() -> Optional[int]:
+    """Current resident set size of this process"""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        # No /proc (macOS): fall back to the peak, in bytes on macOS and KiB elsewhere
+        try:
+            import resource
+        except ImportError:  # Windows
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+_started = time.time()
+
+
+def process_collector() -> Iterable[Sample]:
+    rss = resident_memory_bytes()
+    if rss is not None:
+        yield ("process_resident_memory_bytes", "gauge", "Resident memory size in bytes", [({}, rss)])
+    yield ("process_start_time_seconds", "gauge", "Start time of the process since the epoch, in seconds", [({}, _started)])
+
+
+registry = Registry()
+registry.register_collector(process_collector)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each HTTP request by route template and status"""
+
+    def __init__(self, app, registry: Registry = registry):
+        self.app = app
+        self.latency = registry.histogram(
+            "localai_http_request_duration_seconds",
+            "Time to serve an HTTP request, to the end of the response body",
+            ["method", "route", "status"]
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        status = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = scope.get("route")
+            # Unmatched paths share one label so scanners can't grow the series without bound
+            path = getattr(route, "path", None) or "unmatched"
+            self.latency.labels(scope["method"], path, status[0]).observe(time.perf_counter() - start)
@@ -3,22 +3,110 @@ import asyncio
 import json
 from typing import List, Optional, Dict, Any, AsyncGenerator
 from pathlib import Path
+import gc
 import glob
 import subprocess
 import threading
+import time
 from datetime import datetime
 import uuid
 
+from .context_shift import CONTEXT_SHIFTS, MESSAGE_OVERHEAD, ContextShifter, ContextShiftPolicy
+from .admission import AdmissionController
+from .conversation_store import message_prefix_hash
+from .streaming import iterate_in_thread
+from .metrics import registry
+from .remote_backend import RemotePool
+from .variants import BenchmarkStore, VariantSelector, benchmark_variant, describe_variant, group_variants, host_id
+from .tracing import tracer
+
+TIME_TO_FIRST_TOKEN = registry.histogram(
+    "localai_time_to_first_token_seconds", "Time from a streamed request to its first token", ["model"]
+)
+TOKENS_PER_SECOND = registry.histogram(
+    "localai_tokens_per_second", "Decode speed of streamed generations", ["model"],
+    buckets=(1, 2, 5, 10, 15, 20, 30, 40, 50, 75, 100, 150, 200, 300)
+)
+GENERATION_SECONDS = registry.histogram(
+    "localai_generation_seconds", "Time to generate a complete reply", ["model", "mode"]
+)
+GENERATED_TOKENS = registry.counter("localai_generated_tokens_total", "Tokens generated", ["model"])
+PREFIX_CACHE = registry.counter(
+    "localai_prefix_cache_total", "Generations by whether the KV cache already held the conversation", ["result"]
+)
+MODEL_LOADS = registry.counter("localai_model_loads_total", "Model load attempts", ["model", "result"])
+MODEL_LOAD_SECONDS = registry.histogram(
+    "localai_model_load_seconds", "Time to load a model", ["model"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+)
+MODEL_EVICTIONS = registry.counter(
+    "localai_model_evictions_total", "Models unloaded because another model was loaded", ["model"]
+)
+VARIANT_SWITCHES = registry.counter(
+    "localai_variant_switches_total", "Switches to another quantization of the loaded model to meet the latency SLO", ["model"]
+)
+
+def _n_threads() -> int:
+    return int(os.environ.get("LOCALAI_N_THREADS", "8"))
+
+def _env_float(name: str) -> Optional[float]:
+    value = os.environ.get(name)
+    return float(value) if value else None
+
 class ModelManager:
-    def __init__(self):
+    def __init__(self, admission: Optional[AdmissionController] = None):
         self.models_dir = Path("../models")
         self.loaded_models = {}
         self.current_model = None
         self.current_model_name = None
         self.model_process = None
+        # Prefix hash (see conversation_store) of the conversation path whose
+        # tokens are currently held in the model's KV cache
+        self.kv_prefix_key = None
+        # The model serves one generation at a time; generations run on
+        # worker threads so the event loop stays free
+        self.generation_lock = threading.Lock()
+        # Generations started and not yet finished (running or waiting for the lock)
+        self.active_generations = 0
+        # The model interactive requests are served with; batch jobs may load
+        # another between their requests (see use_default_model)
+        self.default_model_name: Optional[str] = None
+        # Admission control in front of the model; its queue is the load the
+        # variant selector plans for
+        self.admission = admission
+        # Which turns are sent once a conversation outgrows the context window
+        self.context_policy = ContextShiftPolicy.from_env()
+        self.context_shifter: Optional[ContextShifter] = None
+        # Index of the oldest unpinned message sent for the cached conversation
+        self.context_start = 0
+        # Quantizations of one model: described from GGUF metadata (cached by
+        # path, size and mtime), benchmarked on demand, selected per request
+        # against a latency SLO (LOCALAI_LATENCY_SLO_MS, or the request's own)
+        self._variant_info: Dict[str, Any] = {}
+        self._benchmarks: Optional[BenchmarkStore] = None
+        self.variant_selector = VariantSelector(min_dwell=float(os.environ.get("LOCALAI_VARIANT_MIN_DWELL", "30")))
+        self.latency_slo_ms = _env_float("LOCALAI_LATENCY_SLO_MS")
+        # Remote llama.cpp servers (LOCALAI_REMOTE_BACKENDS), if configured
+        self.remote: Optional[RemotePool] = None
+        try:
+            self.remote = RemotePool.from_env()
+        except ImportError as e:
+            print(f"❌ {e}")
         
     async def initialize(self):
-        """Initialize model manager"""
+        """Initialize model manager (a no-op if a model was preloaded)"""
+        if self.remote is not None:
+            # Connections and probes are per worker, so this runs even after preload
+            await self.remote.start()
+            healthy = sum(node.healthy for node in self.remote.nodes)
+            print(f"🌐 Remote backends: {healthy}/{len(self.remote.nodes)} healthy, capacity {self.remote.capacity()}")
+            served = self.remote.models()
+            if self.current_model is None and served:
+                self.current_model = self.remote
+                self.current_model_name = served[0]["id"]
+        if self.current_model is not None:
+            print(f"✅ Using preloaded model: {self.current_model_name}")
+            return
         print("📁 Initializing Model Manager...")
         
         # Create models directory if it doesn't exist
@@ -37,21 +125,155 @@ class ModelManager:
         """Discover GGUF models in local directory"""
         models = []
         gguf_files = glob.glob(str(self.models_dir / "*.gguf"))
+        index = self._read_model_index()
         
         for file_path in gguf_files:
             filename = Path(file_path).name
             file_size = os.path.getsize(file_path) / (1024 * 1024 * 1024)  # GB
+            entry = index.get(filename) or {}
             
             models.append({
                 "filename": filename,
                 "path": file_path,
                 "size_gb": round(file_size, 2),
                 "local": True,
-                "description": self._infer_model_info(filename)
+                "description": self._infer_model_info(filename),
+                "name": entry.get("name", filename),
+                # Checksum verified by download_models.py, if it fetched this file
+                "sha256": entry.get("sha256"),
+                **self._describe_variant(Path(file_path)),
+                "benchmark": self.benchmarks.get(Path(file_path))
             })
         
         return models
     
+    def _describe_variant(self, path: Path) -> Dict[str, Any]:
+        stat = path.stat()
+        stamp = (stat.st_size, stat.st_mtime)
+        cached = self._variant_info.get(str(path))
+        if cached is None or cached[0] != stamp:
+            cached = self._variant_info[str(path)] = (stamp, describe_variant(path))
+        return cached[1]
+    
+    @property
+    def benchmarks(self) -> BenchmarkStore:
+        if self._benchmarks is None:
+            self._benchmarks = BenchmarkStore(self.models_dir / "benchmarks.json", host_id(_n_threads()))
+        return self._benchmarks
+    
+    def get_variant_groups(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Local models grouped by base model, highest quality quantization first"""
+        return group_variants(self._discover_local_models())
+    
+    async def benchmark_variants(self, base_model: Optional[str] = None, force: bool = False, factory=None) -> List[Dict[str, Any]]:
+        """Measure prefill/decode speed of each quantization on this host.
+
+        Only base models with several variants are benchmarked (or just
+        `base_model`); results are kept in models/benchmarks.json until the
+        file changes. Generation is paused meanwhile, so the timings aren't
+        disturbed.
+        """
+        results = []
+        for base, variants in self.get_variant_groups().items():
+            if (base_model is None and len(variants) < 2) or base_model not in (None, base):
+                continue
+            for variant in variants:
+                if variant["benchmark"] is not None and not force:
+                    results.append(variant)
+                    continue
+                print(f"⏱️  Benchmarking {variant['filename']}...")
+                try:
+                    measured = await self._run_locked(benchmark_variant, Path(variant["path"]), _n_threads(), factory=factory)
+                except Exception as e:
+                    print(f"❌ Benchmark failed for {variant['filename']}: {e}")
+                    continue
+                self.benchmarks.put(Path(variant["path"]), measured)
+                print(f"✅ {variant['filename']}: prefill {measured['prefill_tokens_per_second']} tok/s, "
+                      f"decode {measured['decode_tokens_per_second']} tok/s")
+                results.append({**variant, "benchmark": self.benchmarks.get(Path(variant["path"]))})
+        return results
+    
+    async def _select_variant(
+        self,
+        latency_slo_ms: Optional[float],
+        message: str,
+        documents: Optional[List[str]],
+        history: Optional[List[Dict[str, Any]]],
+        max_tokens: int
+    ):
+        """Switch to another quantization of the loaded model if it better fits the latency SLO"""
+        slo_ms = latency_slo_ms or self.latency_slo_ms
+        current = self.current_model_name
+        if not slo_ms or current is None or isinstance(self.current_model, RemotePool):
+            return
+        groups = self.get_variant_groups()
+        variants = next((v for v in groups.values() if any(m["filename"] == current for m in v)), [])
+        variants = [v for v in variants if v["benchmark"] is not None]
+        if len(variants) < 2:
+            return
+        
+        # About four characters per token
+        prompt_tokens = (len(message) + sum(len(d) for d in documents or []) +
+                         sum(len(m["content"]) for m in history or [])) // 4 + 1
+        chosen = self.variant_selector.choose(
+            variants, current, slo_ms / 1000, prompt_tokens, max_tokens, ahead=self._requests_ahead()
+        )
+        if chosen is None or chosen["filename"] == current:
+            return
+        print(f"🔀 Switching {current} -> {chosen['filename']} for a {slo_ms:.0f} ms latency SLO")
+        loop = asyncio.get_event_loop()
+        # Wait for the running generation to finish; none starts while switching
+        acquired = loop.run_in_executor(None, self.generation_lock.acquire)
+        try:
+            await asyncio.shield(acquired)
+        except asyncio.CancelledError:
+            # The worker thread still takes the lock: give it back once it has
+            acquired.add_done_callback(lambda _: self.generation_lock.release())
+            raise
+        try:
+            with tracer.span("model.variant_switch", previous=current, model=chosen["filename"]) as span:
+                # Free the loaded weights first: two copies of the model may not fit in memory
+                self._unload_model()
+                self.kv_prefix_key = None
+                switched = await self.load_model(chosen["filename"])
+                span.set(switched=switched)
+                if switched:
+                    self.variant_selector.switched()
+                    VARIANT_SWITCHES.labels(chosen["filename"]).inc()
+                else:
+                    print(f"❌ Could not switch to {chosen['filename']}; reloading {current}")
+                    await self.load_model(current)
+        finally:
+            self.generation_lock.release()
+    
+    def _unload_model(self):
+        """Drop the loaded model and release its memory now, not at the next collection"""
+        model, self.current_model = self.current_model, None
+        self.context_shifter = None
+        close = getattr(model, "close", None)
+        if close is not None:
+            close()
+        del model
+        gc.collect()
+    
+    def _requests_ahead(self) -> int:
+        """Other interactive requests running or queued for the model.
+
+        Called from inside the caller's own admission slot, which isn't
+        counted. Without admission control, the generations in progress.
+        """
+        if self.admission is None:
+            return self.active_generations
+        return max(0, self.admission.pending("interactive") - 1)
+    
+    def _read_model_index(self) -> Dict[str, Dict[str, Any]]:
+        """Models registered by download_models.py (models/index.json), by filename"""
+        try:
+            with open(self.models_dir / "index.json", 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+    
     def _infer_model_info(self, filename: str) -> str:
         """Infer model information from filename"""
         name_lower = filename.lower()
@@ -71,13 +293,63 @@ class ModelManager:
     
     async def get_available_models(self) -> List[Dict[str, Any]]:
         """Get list of available models"""
-        return self._discover_local_models()
+        models = self._discover_local_models()
+        if self.remote is not None:
+            for model in self.remote.models():
+                models.append({
+                    "filename": model["id"],
+                    "size_gb": round(model["size"] / (1024 ** 3), 2),
+                    "local": False,
+                    "description": f"Served by {len(model['nodes'])} remote node(s)",
+                    "name": model["id"],
+                    "nodes": model["nodes"]
+                })
+        return models
+    
+    async def close(self):
+        """Close connections to remote backends"""
+        if self.remote is not None:
+            await self.remote.close()
     
-    async def load_model(self, model_name: str) -> bool:
-        """Load a model using llama.cpp executable"""
+    async def use_default_model(self) -> bool:
+        """Load the default model again if a batch job left another one loaded"""
+        if self.default_model_name is None or self.default_model_name == self.current_model_name:
+            return True
+        print(f"🔁 Restoring {self.default_model_name} for interactive requests")
+        return await self.load_model(self.default_model_name)
+    
+    async def load_model(self, model_name: str, default: bool = True) -> bool:
+        """Load a model using llama.cpp executable.
+
+        With `default` off (batch jobs), the model serves only the caller:
+        use_default_model() puts the default one back.
+        """
+        previous = self.current_model_name
+        if not default and self.default_model_name is None:
+            self.default_model_name = previous
+        start = time.perf_counter()
+        with tracer.span("model.load", model=model_name) as span:
+            loaded = await self._load_model(model_name)
+            span.set(loaded=loaded)
+        MODEL_LOAD_SECONDS.labels(model_name).observe(time.perf_counter() - start)
+        MODEL_LOADS.labels(model_name, "success" if loaded else "failure").inc()
+        if loaded and previous and previous != model_name:
+            MODEL_EVICTIONS.labels(previous).inc()
+        if loaded and default:
+            self.default_model_name = model_name
+        return loaded
+
+    async def _load_model(self, model_name: str) -> bool:
         try:
             model_path = self.models_dir / model_name
             
+            if self.remote is not None and any(m["id"] == model_name for m in self.remote.models()):
+                # Nothing to load here: requests are routed to the nodes serving it
+                self.current_model = self.remote
+                self.current_model_name = model_name
+                print(f"✅ Using remote model: {model_name}")
+                return True
+            
             if not model_path.exists():
                 print(f"❌ Model not found: {model_path}")
                 return False
@@ -86,6 +358,7 @@ class ModelManager:
             if self.model_process:
                 self.model_process.terminate()
                 self.model_process = None
+            self.context_shifter = None
             
             print(f"🔄 Loading model: {model_name}")
             
@@ -100,7 +373,7 @@ class ModelManager:
             
             # Start llama.cpp process
             self.model_process = subprocess.Popen(
-                [llama_path, "-m", str(model_path), "--ctx-size", "4096"],
+                [llama_path, "-m", str(model_path), "--ctx-size", str(self.context_policy.n_ctx)],
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
@@ -122,13 +395,17 @@ class ModelManager:
         try:
             from llama_cpp import Llama
             
-            self.current_model = Llama(
+            # Reading the weights takes seconds: keep the event loop free meanwhile
+            self.current_model = await asyncio.get_event_loop().run_in_executor(None, lambda: Llama(
                 model_path=str(model_path),
-                n_ctx=4096,
-                n_threads=8,
+                n_ctx=self.context_policy.n_ctx,
+                n_threads=_n_threads(),
                 verbose=False
-            )
+            ))
             self.current_model_name = model_path.name
+            self.context_shifter = ContextShifter.attach(self.current_model, self.context_policy)
+            if self.context_policy.enabled and not self.context_shifter.supported:
+                print("⚠️  This llama-cpp-python has no KV cache shift; long conversations are re-evaluated when trimmed")
             print(f"✅ Model loaded via llama-cpp-python: {model_path.name}")
             return True
         except ImportError:
@@ -144,49 +421,270 @@ class ModelManager:
         conversation_id: Optional[str] = None,
         documents: List[str] = None,
         json_schema: Optional[Dict] = None,
-        max_tokens: int = 2048
+        max_tokens: int = 2048,
+        history: Optional[List[Dict[str, Any]]] = None,
+        latency_slo_ms: Optional[float] = None
     ) -> Dict[str, Any]:
-        """Generate response from the model"""
+        """Generate response from the model.
+
+        `history` is the conversation so far (oldest first, without `message`).
+        `latency_slo_ms` is a time-to-first-token target that may switch to
+        a smaller quantization of the loaded model (see VariantSelector).
+        """
+        await self._select_variant(latency_slo_ms, message, documents, history, max_tokens)
+        self.active_generations += 1
+        started = time.perf_counter()
         try:
-            # Build context from documents
-            context = ""
-            if documents:
-                context = "\n".join([f"Document: {doc}" for doc in documents])
+            with tracer.span("model.prompt", documents=len(documents or []), history=len(history or [])):
+                context, prompt, history, prefix_key = self._prepare_generation(message, documents, history)
+            prefix_cache_hit = prefix_key is not None and prefix_key == self.kv_prefix_key
             
-            prompt = self._build_prompt(context, message)
+            with tracer.span("model.generate", model=self.current_model_name, prefix_cache_hit=prefix_cache_hit) as span:
+                if isinstance(self.current_model, RemotePool):
+                    content = await self.current_model.complete(
+                        self._build_messages(history, prompt if context else message),
+                        self.current_model_name,
+                        self._completion_kwargs(max_tokens, json_schema)
+                    )
+                elif hasattr(self.current_model, 'create_chat_completion'):
+                    # Using llama-cpp-python
+                    messages = self._build_messages(history, prompt if context else message)
+                    response = await self._run_locked(
+                        lambda: self.current_model.create_chat_completion(
+                            messages=self._fit_context(messages, max_tokens, prefix_cache_hit),
+                            stream=False,
+                            **self._completion_kwargs(max_tokens, json_schema)
+                        )
+                    )
+                    content = response['choices'][0]['message']['content']
+                else:
+                    # Using llama.cpp executable
+                    content = await self._generate_with_process(self._build_history_prompt(history) + prompt, max_tokens)
+                span.set(tokens=len(content.split()))
             
-            if hasattr(self.current_model, 'create_chat_completion'):
-                # Using llama-cpp-python
-                response = self.current_model.create_chat_completion(
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=max_tokens,
-                    temperature=0.7,
-                    stop=["</s>", "###"],
-                    stream=False
-                )
-                content = response['choices'][0]['message']['content']
-            else:
-                # Using llama.cpp executable
-                content = await self._generate_with_process(prompt, max_tokens)
+            self._remember_prefix(prefix_key, message, content, context)
+            PREFIX_CACHE.labels("hit" if prefix_cache_hit else "miss").inc()
+            GENERATION_SECONDS.labels(self.current_model_name, "complete").observe(time.perf_counter() - started)
+            GENERATED_TOKENS.labels(self.current_model_name).inc(len(content.split()))
             
             return {
                 "response": content,
                 "conversation_id": conversation_id or str(uuid.uuid4()),
                 "timestamp": datetime.now().isoformat(),
                 "model": self.current_model_name,
-                "tokens_used": len(content.split())  # Approximate
+                "tokens_used": len(content.split()),  # Approximate
+                "prefix_cache_hit": prefix_cache_hit
             }
             
         except Exception as e:
+            # The KV cache may hold part of a failed generation
+            self.kv_prefix_key = None
             return {
                 "response": f"Error generating response: {str(e)}",
                 "conversation_id": conversation_id,
                 "timestamp": datetime.now().isoformat(),
                 "error": True
             }
+        finally:
+            self.active_generations -= 1
+    
+    async def stream_generate(
+        self,
+        message: str,
+        conversation_id: Optional[str] = None,
+        documents: List[str] = None,
+        json_schema: Optional[Dict] = None,
+        max_tokens: int = 2048,
+        history: Optional[List[Dict[str, Any]]] = None,
+        latency_slo_ms: Optional[float] = None
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """Generate a response incrementally.
+
+        Takes the same arguments as generate_response. Yields {"delta": text}
+        as text is produced, then one final frame with the fields
+        generate_response returns plus "usage" and "timing". Closing the
+        generator early stops the generation.
+        """
+        started = time.perf_counter()
+        first_token_at = None
+        pieces = []
+        finished = False
+        await self._select_variant(latency_slo_ms, message, documents, history, max_tokens)
+        self.active_generations += 1
+        try:
+            context, prompt, history, prefix_key = self._prepare_generation(message, documents, history)
+            prefix_cache_hit = prefix_key is not None and prefix_key == self.kv_prefix_key
+            prepared = time.perf_counter()
+            tracer.record("model.prompt", started, prepared, documents=len(documents or []), history=len(history))
+            
+            if isinstance(self.current_model, RemotePool):
+                # Remote nodes run concurrently; no generation lock
+                stream = self.current_model.stream(
+                    self._build_messages(history, prompt if context else message),
+                    self.current_model_name,
+                    self._completion_kwargs(max_tokens, json_schema)
+                )
+            else:
+                if hasattr(self.current_model, 'create_chat_completion'):
+                    deltas = self._chat_deltas(
+                        self._build_messages(history, prompt if context else message),
+                        self._completion_kwargs(max_tokens, json_schema),
+                        prefix_cache_hit
+                    )
+                elif self.model_process:
+                    deltas = self._process_deltas(self._build_history_prompt(history) + prompt, max_tokens)
+                else:
+                    raise Exception("No model loaded")
+                stream = iterate_in_thread(lambda: deltas, self.generation_lock)
+            try:
+                async for delta in stream:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    pieces.append(delta)
+                    yield {"delta": delta}
+            finally:
+                await stream.aclose()
+            
+            content = "".join(pieces)
+            self._remember_prefix(prefix_key, message, content, context)
+            finished = True
+        except Exception as e:
+            finished = True
+            self.kv_prefix_key = None
+            yield {
+                "response": f"Error generating response: {str(e)}",
+                "conversation_id": conversation_id,
+                "timestamp": datetime.now().isoformat(),
+                "error": True
+            }
+            return
+        finally:
+            self.active_generations -= 1
+            if not finished:
+                # Abandoned mid-generation; the KV cache holds a partial reply
+                self.kv_prefix_key = None
+        
+        ended = time.perf_counter()
+        generating = ended - (first_token_at or ended)
+        # Prefill (prompt evaluation, including any wait for the model) up to the first token, then decode
+        tracer.record("model.prefill", prepared, first_token_at or ended, model=self.current_model_name, prefix_cache_hit=prefix_cache_hit)
+        tracer.record("model.decode", first_token_at or ended, ended, tokens=len(pieces))
+        model = self.current_model_name
+        PREFIX_CACHE.labels("hit" if prefix_cache_hit else "miss").inc()
+        GENERATION_SECONDS.labels(model, "stream").observe(ended - started)
+        GENERATED_TOKENS.labels(model).inc(len(pieces))
+        if first_token_at is not None:
+            TIME_TO_FIRST_TOKEN.labels(model).observe(first_token_at - started)
+        if generating > 0:
+            TOKENS_PER_SECOND.labels(model).observe(len(pieces) / generating)
+        yield {
+            "response": content,
+            "conversation_id": conversation_id or str(uuid.uuid4()),
+            "timestamp": datetime.now().isoformat(),
+            "model": self.current_model_name,
+            "tokens_used": len(content.split()),  # Approximate
+            "prefix_cache_hit": prefix_cache_hit,
+            "usage": {"completion_tokens": len(pieces)},
+            "timing": {
+                "ttft_ms": round(((first_token_at or ended) - started) * 1000, 1),
+                "total_ms": round((ended - started) * 1000, 1),
+                "tokens_per_second": round(len(pieces) / generating, 1) if generating > 0 else None
+            }
+        }
+    
+    def _prepare_generation(
+        self,
+        message: str,
+        documents: Optional[List[str]],
+        history: Optional[List[Dict[str, Any]]]
+    ):
+        """Document context, prompt, history and KV prefix key for a request"""
+        context = ""
+        if documents:
+            context = "\n".join([f"Document: {doc}" for doc in documents])
+        
+        prompt = self._build_prompt(context, message)
+        history = history or []
+        prefix_key = history[-1].get("prefix_hash") if history else None
+        return context, prompt, history, prefix_key
+    
+    def _completion_kwargs(self, max_tokens: int, json_schema: Optional[Dict]) -> Dict[str, Any]:
+        kwargs = {
+            "max_tokens": max_tokens,
+            "temperature": 0.7,
+            "stop": ["</s>", "###"]
+        }
+        if json_schema:
+            # llama-cpp-python turns the schema into a grammar that constrains sampling
+            kwargs["response_format"] = {"type": "json_object", "schema": json_schema}
+        return kwargs
+    
+    def _remember_prefix(self, prefix_key: Optional[str], message: str, content: str, context: str):
+        # Same key the conversation tree will assign to this reply, so the
+        # next turn on this branch is recognised as a KV prefix hit
+        self.kv_prefix_key = None if context else message_prefix_hash(
+            message_prefix_hash(prefix_key, "user", message), "assistant", content
+        )
+    
+    async def _run_locked(self, fn, *args, **kwargs):
+        """Run a blocking model call on a worker thread, one at a time"""
+        def call():
+            with self.generation_lock:
+                return fn(*args, **kwargs)
+        return await asyncio.get_event_loop().run_in_executor(None, call)
+    
+    def _fit_context(self, messages: List[Dict[str, str]], max_tokens: int, continuing: bool) -> List[Dict[str, str]]:
+        """The messages to send: the oldest turns are dropped once they no longer fit n_ctx.
+
+        `continuing` is whether the KV cache holds this conversation up to
+        its previous turn, whose window is then kept or moved forward.
+        Runs on the generation thread, as it uses the model's tokenizer.
+        """
+        policy = self.context_policy
+        tokenize = getattr(self.current_model, "tokenize", None)
+        previous = self.context_start if continuing else 0
+        self.context_start = 0
+        if not policy.enabled or tokenize is None:
+            return messages
+        
+        def count_tokens(m):
+            return len(tokenize(m["content"].encode("utf-8"), add_bos=False)) + MESSAGE_OVERHEAD
+        
+        start = policy.window(messages, count_tokens, max_tokens, previous)
+        pinned = policy.pinned(messages)
+        self.context_start = start
+        if start > max(previous, pinned):
+            if self.context_shifter is not None:
+                self.context_shifter.expect(start - max(previous, pinned))
+            else:
+                CONTEXT_SHIFTS.labels("reprefill").inc()
+        return messages[:pinned] + messages[start:] if start > pinned else messages
+    
+    def _chat_deltas(self, messages: List[Dict[str, str]], kwargs: Dict[str, Any], continuing: bool = False):
+        """Text deltas from a streaming llama-cpp-python completion"""
+        messages = self._fit_context(messages, kwargs["max_tokens"], continuing)
+        chunks = self.current_model.create_chat_completion(messages=messages, stream=True, **kwargs)
+        try:
+            for chunk in chunks:
+                content = chunk['choices'][0]['delta'].get('content')
+                if content:
+                    yield content
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()
+    
+    def _process_deltas(self, prompt: str, max_tokens: int):
+        """Text deltas (one per output line) from the llama.cpp process"""
+        for i, line in enumerate(self._process_lines(prompt, max_tokens)):
+            yield "\n" + line if i else line
     
     async def _generate_with_process(self, prompt: str, max_tokens: int) -> str:
         """Generate response using llama.cpp process"""
+        return await self._run_locked(lambda: "\n".join(self._process_lines(prompt, max_tokens)))
+    
+    def _process_lines(self, prompt: str, max_tokens: int):
+        """Send a prompt to the llama.cpp process and yield its reply line by line"""
         if not self.model_process:
             raise Exception("No model process available")
         
@@ -195,46 +693,27 @@ class ModelManager:
         self.model_process.stdin.flush()
         
         # Read response
-        response_lines = []
-        while True:
-            line = self.model_process.stdout.readline().strip()
-            if not line or line == "###":
-                break
-            response_lines.append(line)
-            
-            # Safety break
-            if len(response_lines) > max_tokens:
-                break
-        
-        return "\n".join(response_lines)
-    
-    async def stream_response(
-        self, 
-        message: str, 
-        conversation_id: Optional[str] = None
-    ) -> AsyncGenerator[str, None]:
-        """Stream response tokens one by one"""
-        prompt = self._build_prompt("", message)
-        
-        if hasattr(self.current_model, 'create_chat_completion'):
-            # Streaming with llama-cpp-python
-            response = self.current_model.create_chat_completion(
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=2048,
-                temperature=0.7,
-                stop=["</s>", "###"],
-                stream=True
-            )
-            
-            for chunk in response:
-                if 'content' in chunk['choices'][0]['delta']:
-                    yield chunk['choices'][0]['delta']['content']
-        else:
-            # Fallback non-streaming
-            response = await self.generate_response(message, conversation_id)
-            for word in response["response"].split():
-                yield word + " "
-                await asyncio.sleep(0.01)  # Simulate streaming
+        count = 0
+        complete = False
+        try:
+            while True:
+                line = self.model_process.stdout.readline().strip()
+                if not line or line == "###":
+                    complete = True
+                    break
+                count += 1
+                yield line
+                
+                # Safety break
+                if count > max_tokens:
+                    break
+        finally:
+            if not complete and count <= max_tokens:
+                # Stopped early: drain the rest so the next prompt starts clean
+                while True:
+                    line = self.model_process.stdout.readline().strip()
+                    if not line or line == "###":
+                        break
     
     def _build_prompt(self, context: str, message: str) -> str:
         """Build the prompt for the model"""
@@ -248,13 +727,27 @@ Please provide a helpful response based on the context and your knowledge:"""
         else:
             return f"User: {message}\nAssistant:"
     
+    def _build_messages(self, history: List[Dict[str, Any]], content: str) -> List[Dict[str, str]]:
+        """Chat messages for the conversation so far plus the new user turn"""
+        messages = [{"role": m["role"], "content": m["content"]} for m in history]
+        messages.append({"role": "user", "content": content})
+        return messages
+    
+    def _build_history_prompt(self, history: List[Dict[str, Any]]) -> str:
+        """Plain-text transcript of earlier turns for the llama.cpp executable"""
+        lines = []
+        for m in history:
+            speaker = "User" if m["role"] == "user" else "Assistant"
+            lines.append(f"{speaker}: {m['content']}")
+        return "\n".join(lines) + "\n" if lines else ""
+    
     def get_model_info(self) -> Dict[str, Any]:
         """Get information about currently loaded model"""
         if not self.current_model:
             return {}
         
         return {
-            "context_size": getattr(self.current_model, 'n_ctx', 4096),
+            "context_size": self.context_policy.n_ctx,
             "parameters": "Unknown",  # Would need model metadata
             "format": "GGUF"
         }
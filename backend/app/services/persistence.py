@@ -0,0 +1,197 @@
+import asyncio
+import os
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Hashable, List, Optional, Tuple, Union
+
+# fsync policy -> SQLite synchronous level.
+#   always: every committed batch is fsynced before it is acknowledged
+#   batch:  WAL is fsynced at checkpoints; a power loss may drop the last batches
+#   off:    leave flushing to the OS
+FSYNC_POLICIES = {"always": "FULL", "batch": "NORMAL", "off": "OFF"}
+
+
+def sqlite_synchronous(policy: str) -> str:
+    """SQLite `synchronous` setting for an fsync policy name"""
+    try:
+        return FSYNC_POLICIES[policy]
+    except KeyError:
+        raise ValueError(f"Unknown fsync policy: {policy} (expected one of {', '.join(FSYNC_POLICIES)})")
+
+
+def atomic_write(path: Path, data: Union[str, bytes], fsync: bool = True):
+    """Replace `path` with `data` so readers see either the old or the new file.
+
+    The data goes to a temporary file in the same directory, which is then
+    renamed over `path`. With `fsync` the file and directory are flushed to
+    disk first, so the new content also survives a power loss.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data.encode() if isinstance(data, str) else data)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    if fsync and hasattr(os, "O_DIRECTORY"):
+        fd = os.open(path.parent, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class WriteBehindError(Exception):
+    """Writes that could not be applied; `failures` holds ((kind, payload), error) pairs"""
+
+    def __init__(self, failures: List[Tuple[Tuple[str, Any], BaseException]]):
+        super().__init__(f"{len(failures)} write(s) failed, first: {failures[0][1]!r}")
+        self.failures = failures
+
+
+class WriteBehindQueue:
+    """Buffers writes and applies them in batches on a background thread.
+
+    Writes are keyed; submitting a write whose key is already pending replaces
+    the pending one, so a burst of updates to the same record within `window`
+    seconds costs a single write. Writes with a key of None are never
+    coalesced. Batches are handed to `apply_batch` on a single worker thread,
+    so they reach disk in submission order and never block the event loop.
+
+    If a batch fails (`apply_batch` must then leave nothing applied), its
+    writes are retried a unit at a time, so one bad write doesn't take the
+    rest down. `unit_of(write)` names the unit a write belongs to: writes
+    that depend on each other (a record and the writes attached to it)
+    share a unit and land together or not at all. Without it, each write
+    is its own unit. Writes that fail are kept in `failed`, reported to
+    `on_failure(write, error)` and raised by the next flush().
+    """
+
+    def __init__(
+        self,
+        apply_batch: Callable[[List[Tuple[str, Any]]], None],
+        window: float = 0.05,
+        max_batch: int = 256,
+        on_failure: Optional[Callable[[Tuple[str, Any], BaseException], None]] = None,
+        unit_of: Optional[Callable[[Tuple[str, Any]], Hashable]] = None
+    ):
+        self.apply_batch = apply_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.on_failure = on_failure
+        self.unit_of = unit_of
+        self.failed: List[Tuple[Tuple[str, Any], BaseException]] = []
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write-behind")
+        self.pending: "OrderedDict[Hashable, Tuple[str, Any]]" = OrderedDict()
+        self.submitted = 0
+        self.coalesced = 0
+        self.batches = 0
+        self._sequence = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Future] = None
+
+    def start(self):
+        """Start the background flusher on the running event loop"""
+        self._wakeup = asyncio.Event()
+        self._worker = asyncio.ensure_future(self._run())
+
+    def submit(self, kind: str, payload: Any, key: Optional[Hashable] = None):
+        """Queue a write; a pending write with the same key is replaced"""
+        self.submitted += 1
+        if key is None:
+            self._sequence += 1
+            slot = (kind, None, self._sequence)
+        else:
+            slot = (kind, key)
+        if slot in self.pending:
+            # The newest value must land after everything submitted before it
+            self.coalesced += 1
+            self.pending.move_to_end(slot)
+        self.pending[slot] = (kind, payload)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def run(self, fn: Callable, *args) -> Any:
+        """Run `fn` on the writer thread, after every write applied so far"""
+        return await asyncio.get_event_loop().run_in_executor(self.executor, fn, *args)
+
+    async def flush(self, check: bool = True):
+        """Apply everything submitted so far and wait until it is committed.
+
+        Raises WriteBehindError for the writes that failed since the last
+        check, unless `check` is false.
+        """
+        while self.pending:
+            await self._apply_pending()
+        if self._inflight is not None:
+            await asyncio.shield(self._inflight)
+        if check and self.failed:
+            failures, self.failed = self.failed, []
+            raise WriteBehindError(failures)
+
+    async def close(self):
+        """Stop the background flusher, flush and release the writer thread"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        try:
+            await self.flush()
+        finally:
+            self.executor.shutdown(wait=True)
+
+    def _apply(self, batch: List[Tuple[str, Any]]) -> List[Tuple[Tuple[str, Any], BaseException]]:
+        """Apply a batch on the writer thread; the writes that failed, with their errors"""
+        try:
+            self.apply_batch(batch)
+            return []
+        except Exception as e:
+            if len(batch) == 1:
+                return [(batch[0], e)]
+        units: "OrderedDict[Hashable, List[Tuple[str, Any]]]" = OrderedDict()
+        for index, write in enumerate(batch):
+            units.setdefault(self.unit_of(write) if self.unit_of is not None else index, []).append(write)
+        failures = []
+        for writes in units.values():
+            try:
+                self.apply_batch(writes)
+            except Exception as e:
+                failures.extend((write, e) for write in writes)
+        return failures
+
+    def _record_failures(self, future: asyncio.Future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        for write, error in future.result():
+            print(f"❌ Write-behind {write[0]} write failed: {error}")
+            self.failed.append((write, error))
+            if self.on_failure is not None:
+                self.on_failure(write, error)
+
+    async def _apply_pending(self):
+        batch = []
+        while self.pending and len(batch) < self.max_batch:
+            batch.append(self.pending.popitem(last=False)[1])
+        self.batches += 1
+        self._inflight = asyncio.get_event_loop().run_in_executor(self.executor, self._apply, batch)
+        self._inflight.add_done_callback(self._record_failures)
+        try:
+            await asyncio.shield(self._inflight)
+        finally:
+            if self._inflight is not None and self._inflight.done():
+                self._inflight = None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Let more writes to the same records arrive before flushing
+            await asyncio.sleep(self.window)
+            self._wakeup.clear()
+            # Failed writes are kept for the next caller's flush()
+            await self.flush(check=False)
@@ -0,0 +1,58 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict
+
+
+class SamplingProfiler:
+    """Samples the call stacks of every thread at a fixed interval.
+
+    Sampling is done from a thread of its own, so it sees the event loop,
+    the generation threads and the writer thread as they are, without
+    instrumenting anything. The result is in the collapsed stack format
+    ("thread;outer;...;inner count" per line) read by flamegraph.pl,
+    speedscope and most other flame graph tools.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._lock.locked()
+
+    def run(self, seconds: float) -> Dict[str, int]:
+        """Sample for `seconds` (blocking) and return stack counts"""
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            own = threading.get_ident()
+            counts = Counter()
+            deadline = time.perf_counter() + seconds
+            while time.perf_counter() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        stack.append(self._label(frame.f_code))
+                        frame = frame.f_back
+                    stack.append(names.get(ident, f"thread-{ident}"))
+                    counts[";".join(reversed(stack))] += 1
+                time.sleep(self.interval)
+            return dict(counts)
+        finally:
+            self._lock.release()
+
+    @staticmethod
+    def collapsed(counts: Dict[str, int]) -> str:
+        """Stack counts as collapsed-stack text"""
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(counts.items()))
+
+    @staticmethod
+    def _label(code) -> str:
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
@@ -0,0 +1,331 @@
+import asyncio
+import json
+import os
+import time
+from typing import Any, AsyncGenerator, Dict, List, Optional, Sequence
+
+try:
+    import httpx
+except ImportError:  # Optional: pip install httpx (only needed for remote backends)
+    httpx = None
+
+from .metrics import registry
+from .tracing import tracer
+
+REMOTE_REQUESTS = registry.counter(
+    "localai_remote_requests_total", "Generations sent to remote backends, by node and outcome", ["node", "result"]
+)
+REMOTE_FAILOVERS = registry.counter(
+    "localai_remote_failovers_total", "Generations retried on another node after a node error"
+)
+
+
+class RemoteUnavailable(Exception):
+    """No remote node could serve the request"""
+
+
+class _NodeError(Exception):
+    """A node failed in a way another node might not (connection, 5xx)"""
+
+
+class RemoteNode:
+    """One llama.cpp-compatible server, as last seen by the health probe"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.healthy = False
+        # Model ids from /v1/models; empty means unknown (serves whatever it has)
+        self.models: List[str] = []
+        self.model_sizes: Dict[str, int] = {}
+        # Parallel slots (/props total_slots) and how many the server reports busy
+        self.slots = 1
+        self.busy = 0
+        # Requests this process has on the node right now
+        self.in_flight = 0
+        self.failures = 0
+        self.served = 0
+        # Moving average of the probe round trip, in seconds
+        self.latency: Optional[float] = None
+        self.checked_at: Optional[float] = None
+
+    def serves(self, model: Optional[str]) -> bool:
+        return model is None or not self.models or model in self.models
+
+    def load(self) -> float:
+        """Share of the node's slots in use, by us or anyone else"""
+        return max(self.in_flight, self.busy) / max(self.slots, 1)
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "models": self.models,
+            "slots": self.slots,
+            "busy": self.busy,
+            "in_flight": self.in_flight,
+            "served": self.served,
+            "failures": self.failures,
+            "latency_ms": round(self.latency * 1000, 1) if self.latency is not None else None
+        }
+
+
+class RemotePool:
+    """Generation forwarded to a set of remote llama.cpp servers.
+
+    Each node is probed every `probe_interval` seconds (/health, /v1/models,
+    /props) for health, the models it serves and its slot count. A request
+    goes to the least loaded healthy node serving its model; if that node
+    fails before anything has been streamed back, the next one is tried.
+    A failed node is left out until a probe finds it healthy again.
+    Connections are kept alive and reused across requests.
+    """
+
+    def __init__(
+        self,
+        urls: Sequence[str],
+        probe_interval: float = 5.0,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 300.0
+    ):
+        if httpx is None:
+            raise ImportError("Remote backends need httpx: pip install httpx")
+        self.nodes = [RemoteNode(url) for url in urls]
+        self.probe_interval = probe_interval
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.client: Optional["httpx.AsyncClient"] = None
+        self._probe_task: Optional[asyncio.Task] = None
+        self._loop = None
+
+    @classmethod
+    def from_env(cls) -> Optional["RemotePool"]:
+        """The pool configured by LOCALAI_REMOTE_BACKENDS (comma-separated URLs), if any"""
+        urls = [url.strip() for url in os.environ.get("LOCALAI_REMOTE_BACKENDS", "").split(",") if url.strip()]
+        if not urls:
+            return None
+        return cls(
+            urls,
+            probe_interval=float(os.environ.get("LOCALAI_REMOTE_PROBE_INTERVAL", "5")),
+            connect_timeout=float(os.environ.get("LOCALAI_REMOTE_CONNECT_TIMEOUT", "5")),
+            read_timeout=float(os.environ.get("LOCALAI_REMOTE_READ_TIMEOUT", "300"))
+        )
+
+    async def start(self):
+        """Open the connection pool, probe every node, then keep probing in the background.
+
+        Connections and the probe task belong to one event loop, so a
+        forked worker (or a loop started after preload) opens its own.
+        """
+        loop = asyncio.get_event_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        if self.client is not None:
+            # Left over from a loop that ended without close(): don't leak its pool
+            await self._close_stale()
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(self.read_timeout, connect=self.connect_timeout),
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=16 * len(self.nodes), keepalive_expiry=60)
+        )
+        await self.probe_all()
+        self._probe_task = asyncio.ensure_future(self._probe_loop())
+
+    async def close(self):
+        if self._loop is not asyncio.get_event_loop():
+            if self.client is not None:
+                await self._close_stale()
+            self._loop = None
+            return
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            try:
+                await self._probe_task
+            except asyncio.CancelledError:
+                pass
+            self._probe_task = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+        self._loop = None
+
+    async def _close_stale(self):
+        if self._probe_task is not None and not self._probe_task.done():
+            # Its loop has stopped; cancelling just drops it
+            self._probe_task.cancel()
+        self._probe_task = None
+        client, self.client = self.client, None
+        try:
+            await client.aclose()
+        except RuntimeError:
+            # Its loop is closed: the sockets are freed when the client is collected
+            pass
+
+    async def _probe_loop(self):
+        while True:
+            await asyncio.sleep(self.probe_interval)
+            await self.probe_all()
+
+    async def probe_all(self):
+        await asyncio.gather(*(self.probe(node) for node in self.nodes))
+
+    async def probe(self, node: RemoteNode):
+        """Refresh one node's health, models and capacity"""
+        started = time.perf_counter()
+        timeout = min(self.connect_timeout, max(self.probe_interval, 1.0))
+        try:
+            health = await self.client.get(node.url + "/health", timeout=timeout)
+            elapsed = time.perf_counter() - started
+            # 503 while the server is still loading its model
+            if health.status_code != 200:
+                node.healthy = False
+                return
+            status = _json(health)
+            models = await self.client.get(node.url + "/v1/models", timeout=timeout)
+            if models.status_code == 200:
+                data = _json(models).get("data") or []
+                node.models = [m["id"] for m in data if "id" in m]
+                node.model_sizes = {m["id"]: (m.get("meta") or {}).get("size", 0) for m in data if "id" in m}
+            props = await self.client.get(node.url + "/props", timeout=timeout)
+            if props.status_code == 200:
+                node.slots = int(_json(props).get("total_slots") or node.slots)
+            # Older servers report slot usage in /health
+            node.busy = int(status.get("slots_processing") or 0)
+        except (httpx.HTTPError, ValueError, KeyError, TypeError):
+            if node.healthy:
+                print(f"⚠️  Remote backend unreachable: {node.url}")
+            node.healthy = False
+            node.failures += 1
+            return
+        finally:
+            node.checked_at = time.time()
+        if not node.healthy:
+            print(f"🌐 Remote backend up: {node.url} ({', '.join(node.models) or 'unknown models'}, {node.slots} slots)")
+        node.healthy = True
+        node.latency = elapsed if node.latency is None else 0.8 * node.latency + 0.2 * elapsed
+
+    def models(self) -> List[Dict[str, Any]]:
+        """Models served by healthy nodes, with the nodes serving each"""
+        served: Dict[str, List[RemoteNode]] = {}
+        for node in self.nodes:
+            if node.healthy:
+                for model in node.models:
+                    served.setdefault(model, []).append(node)
+        return [
+            {"id": model, "nodes": [node.url for node in nodes], "size": max(node.model_sizes.get(model, 0) for node in nodes)}
+            for model, nodes in served.items()
+        ]
+
+    def capacity(self) -> int:
+        """Generations the healthy nodes can run at once"""
+        return sum(node.slots for node in self.nodes if node.healthy) or len(self.nodes)
+
+    def stats(self) -> Dict[str, Any]:
+        return {"capacity": self.capacity(), "nodes": [node.info() for node in self.nodes]}
+
+    def route(self, model: Optional[str], exclude: Sequence[RemoteNode] = ()) -> Optional[RemoteNode]:
+        """The node for the next request: healthy and least loaded among those serving `model`.
+
+        Nodes marked unhealthy are a last resort rather than skipped, as
+        they may have recovered since the last probe.
+        """
+        candidates = [node for node in self.nodes if node.serves(model) and node not in exclude]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda node: (not node.healthy, node.load(), node.latency or 0.0))
+
+    def _request(self, messages: List[Dict[str, str]], model: Optional[str], options: Dict[str, Any], stream: bool):
+        body = {"messages": messages, "stream": stream, "cache_prompt": True, **options}
+        if model:
+            body["model"] = model
+        return body
+
+    def _failed(self, node: RemoteNode, error: Exception):
+        print(f"⚠️  Remote backend {node.url} failed: {error}")
+        node.healthy = False
+        node.failures += 1
+        REMOTE_REQUESTS.labels(node.url, "error").inc()
+
+    async def complete(self, messages: List[Dict[str, str]], model: Optional[str], options: Dict[str, Any]) -> str:
+        """The full reply to a chat completion"""
+        body = self._request(messages, model, options, stream=False)
+        tried: List[RemoteNode] = []
+        while True:
+            node = self.route(model, tried)
+            if node is None:
+                raise RemoteUnavailable(f"No remote backend available for {model or 'the request'}")
+            if tried:
+                REMOTE_FAILOVERS.inc()
+            tried.append(node)
+            node.in_flight += 1
+            try:
+                with tracer.span("remote.complete", node=node.url, attempt=len(tried)):
+                    response = await self.client.post(node.url + "/v1/chat/completions", json=body)
+                    _check(response)
+                    content = _json(response)["choices"][0]["message"]["content"]
+            except (httpx.TransportError, _NodeError) as e:
+                self._failed(node, e)
+                continue
+            finally:
+                node.in_flight -= 1
+            node.served += 1
+            REMOTE_REQUESTS.labels(node.url, "success").inc()
+            return content
+
+    async def stream(
+        self, messages: List[Dict[str, str]], model: Optional[str], options: Dict[str, Any]
+    ) -> AsyncGenerator[str, None]:
+        """Text deltas of a streamed chat completion, passed through as they arrive.
+
+        A node that fails before its first delta is replaced by the next;
+        once text has been passed on, a failure ends the stream. Closing
+        the generator closes the connection, which stops the remote
+        generation.
+        """
+        body = self._request(messages, model, options, stream=True)
+        tried: List[RemoteNode] = []
+        while True:
+            node = self.route(model, tried)
+            if node is None:
+                raise RemoteUnavailable(f"No remote backend available for {model or 'the request'}")
+            if tried:
+                REMOTE_FAILOVERS.inc()
+            tried.append(node)
+            node.in_flight += 1
+            streamed = False
+            try:
+                async with self.client.stream("POST", node.url + "/v1/chat/completions", json=body) as response:
+                    _check(response)
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        content = json.loads(data)["choices"][0]["delta"].get("content")
+                        if content:
+                            streamed = True
+                            yield content
+            except (httpx.TransportError, _NodeError) as e:
+                self._failed(node, e)
+                if streamed:
+                    raise RemoteUnavailable(f"Remote backend {node.url} failed mid-stream") from e
+                continue
+            finally:
+                node.in_flight -= 1
+            node.served += 1
+            REMOTE_REQUESTS.labels(node.url, "success").inc()
+            return
+
+
+def _check(response: "httpx.Response"):
+    """Raise _NodeError for failures worth retrying elsewhere, HTTPStatusError for the request's own"""
+    if response.status_code >= 500 or response.status_code == 429:
+        raise _NodeError(f"HTTP {response.status_code}")
+    response.raise_for_status()
+
+
+def _json(response: "httpx.Response") -> Dict[str, Any]:
+    try:
+        return response.json()
+    except ValueError:
+        return {}
@@ -0,0 +1,141 @@
+import asyncio
+import gzip
+import hashlib
+import mimetypes
+import re
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Tuple
+
+try:
+    import brotli
+except ImportError:  # Optional: pip install brotli
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+# Preferred first when the client accepts several
+ENCODINGS = (["br"] if brotli is not None else []) + ["gzip"]
+
+COMPRESSIBLE = ("text/", "application/javascript", "application/json", "image/svg+xml")
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+# index.html and unfingerprinted names: cache, but check back every time
+REVALIDATE = "no-cache"
+
+# href="..." and src="..." attributes, for rewriting asset references in HTML
+_REFERENCE = re.compile(r'(\b(?:href|src)=")([^"]+)(")')
+
+
+class Asset:
+    """One file held in memory, with its precompressed variants"""
+
+    def __init__(self, body: bytes, content_type: str, cache_control: str):
+        self.content_type = content_type
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()
+        tag = self.digest[:16]
+        # encoding -> (body, ETag); every variant has its own validator
+        self.variants: Dict[str, Tuple[bytes, str]] = {"identity": (body, f'"{tag}"')}
+        if content_type.startswith(COMPRESSIBLE):
+            candidates = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                candidates["br"] = brotli.compress(body, quality=11)
+            for encoding, compressed in candidates.items():
+                if len(compressed) < len(body):
+                    self.variants[encoding] = (compressed, f'"{tag}-{encoding}"')
+
+    def select(self, accept_encoding: str) -> str:
+        """Best encoding of this asset the client accepts"""
+        accepted = _accepted_encodings(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in self.variants and encoding in accepted:
+                return encoding
+        return "identity"
+
+    def matches(self, if_none_match: Optional[str]) -> bool:
+        """Whether the client's cached copy (any encoding) is current"""
+        if not if_none_match:
+            return False
+        tags = {tag.strip() for tag in if_none_match.split(",")}
+        if "*" in tags:
+            return True
+        tags |= {tag[2:] for tag in tags if tag.startswith("W/")}
+        return any(etag in tags for _, etag in self.variants.values())
+
+
+def _accepted_encodings(header: str) -> set:
+    accepted = set()
+    for part in (header or "").split(","):
+        name, _, params = part.strip().partition(";")
+        quality = re.search(r"q=([0-9.]+)", params)
+        if name and not (quality and float(quality.group(1)) == 0):
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+class StaticAssets:
+    """The frontend, fingerprinted and precompressed in memory at startup.
+
+    Every file under `root` is served from /static both under its own name
+    and under a fingerprinted one (css/style.3f9a1c2b7d4e.css). Fingerprinted
+    names change whenever the content does, so they are cached as immutable;
+    index.html is rewritten to reference them and is itself revalidated on
+    each load (a 304 when nothing changed). Nothing is read from disk after
+    initialize().
+    """
+
+    def __init__(self, root: Path, prefix: str = "/static/", index: str = "index.html"):
+        self.root = Path(root)
+        self.prefix = prefix
+        self.index_name = index
+        self.assets: Dict[str, Asset] = {}
+        self.fingerprinted: Dict[str, str] = {}
+        self.index: Optional[Asset] = None
+
+    async def initialize(self):
+        """Read, fingerprint and compress the frontend"""
+        await asyncio.get_event_loop().run_in_executor(None, self.build)
+        size = sum(len(asset.variants["identity"][0]) for asset in self.assets.values())
+        print(f"🗜️  Frontend: {len(self.assets)} assets ({size // 1024} KB), encodings: {', '.join(ENCODINGS)}")
+
+    def build(self):
+        assets, fingerprinted = {}, {}
+        for path in sorted(self.root.rglob("*")):
+            if not path.is_file() or path.name.startswith(".") or path == self.root / self.index_name:
+                continue
+            name = path.relative_to(self.root).as_posix()
+            content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+            if content_type.startswith("text/") or content_type == "application/javascript":
+                content_type += "; charset=utf-8"
+            body = path.read_bytes()
+            assets[name] = Asset(body, content_type, REVALIDATE)
+            stem, dot, suffix = name.rpartition(".")
+            hashed = f"{stem}.{assets[name].digest[:12]}.{suffix}" if dot else f"{name}.{assets[name].digest[:12]}"
+            fingerprinted[name] = hashed
+            assets[hashed] = Asset(body, content_type, IMMUTABLE)
+
+        index_path = self.root / self.index_name
+        index = None
+        if index_path.exists():
+            html = index_path.read_text(encoding="utf-8")
+            html = _REFERENCE.sub(lambda m: m.group(1) + self._rewrite(m.group(2), fingerprinted) + m.group(3), html)
+            index = Asset(html.encode("utf-8"), "text/html; charset=utf-8", REVALIDATE)
+        self.assets, self.fingerprinted, self.index = assets, fingerprinted, index
+
+    def _rewrite(self, reference: str, fingerprinted: Mapping[str, str]) -> str:
+        name = reference
+        for prefix in ("./", self.prefix, self.prefix.lstrip("/")):
+            if name.startswith(prefix):
+                name = name[len(prefix):]
+                break
+        if name in fingerprinted:
+            return self.prefix + fingerprinted[name]
+        return reference
+
+    def url(self, name: str) -> str:
+        """Public URL of an asset, fingerprinted when known"""
+        return self.prefix + self.fingerprinted.get(name, name)
+
+    def get(self, name: str) -> Optional[Asset]:
+        return self.assets.get(name)
@@ -0,0 +1,104 @@
+import asyncio
+import json
+import threading
+from typing import Any, AsyncGenerator, AsyncIterator, Callable, Iterable, Optional
+
+# Sent as an SSE comment so proxies don't time out an idle stream during prefill
+SSE_KEEPALIVE = ": keep-alive\n\n"
+
+
+def sse_event(event: str, data: Any) -> str:
+    """One Server-Sent Events frame with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def with_keepalive(events: AsyncIterator[Any], interval: float) -> AsyncGenerator[Optional[Any], None]:
+    """Re-yield `events`, yielding None whenever nothing arrived for `interval` seconds.
+
+    Closing the returned generator cancels `events`.
+    """
+    queue = asyncio.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for event in events:
+                queue.put_nowait(event)
+        finally:
+            queue.put_nowait(done)
+
+    task = asyncio.ensure_future(pump())
+    try:
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), interval)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            if event is done:
+                break
+            yield event
+        # Re-raise anything the source failed with
+        await task
+    finally:
+        task.cancel()
+
+
+async def iterate_in_thread(
+    produce: Callable[[], Iterable[Any]],
+    lock: Optional[threading.Lock] = None
+) -> AsyncGenerator[Any, None]:
+    """Iterate a blocking iterable on a worker thread without blocking the loop.
+
+    `produce` is called on the thread (holding `lock`, if given). Closing the
+    returned generator stops the iteration at the next item, so an abandoned
+    generation frees the model instead of running to max_tokens.
+    """
+    loop = asyncio.get_event_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        try:
+            loop.call_soon_threadsafe(queue.put_nowait, item)
+        except RuntimeError:
+            # The loop is gone; nobody is listening any more
+            stop.set()
+
+    def run():
+        try:
+            if lock is not None:
+                lock.acquire()
+            try:
+                if stop.is_set():
+                    return
+                iterator = iter(produce())
+                try:
+                    for item in iterator:
+                        put(item)
+                        if stop.is_set():
+                            break
+                finally:
+                    close = getattr(iterator, "close", None)
+                    if close is not None:
+                        close()
+            finally:
+                if lock is not None:
+                    lock.release()
+        except Exception as e:
+            put(e)
+        finally:
+            put(done)
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
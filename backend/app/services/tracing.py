@@ -0,0 +1,165 @@
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+# The span new spans are children of, per task (and thread)
+_current_span: "ContextVar[Optional[Span]]" = ContextVar("current_span", default=None)
+
+
+def _new_id(size: int = 8) -> str:
+    return os.urandom(size).hex()
+
+
+class Span:
+    """A timed operation; use as a context manager (see Tracer.span)"""
+
+    __slots__ = ("tracer", "name", "attributes", "trace_id", "span_id", "parent_id", "start_time", "_start", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any], parent: Optional["Span"]):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.trace_id = parent.trace_id if parent is not None else _new_id(16)
+        self.span_id = _new_id()
+        self.parent_id = parent.span_id if parent is not None else None
+        self.start_time = 0.0
+        self._start = 0.0
+        self._token = None
+
+    def set(self, **attributes):
+        """Add attributes, e.g. results known only at the end"""
+        self.attributes.update(attributes)
+
+    def __enter__(self):
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        end = time.perf_counter()
+        _current_span.reset(self._token)
+        if exc is not None:
+            self.attributes["error"] = f"{exc_type.__name__}: {exc}"
+        self.tracer._export(self._record(self._start, end, self.start_time))
+        return False
+
+    def _record(self, start: float, end: float, start_time: float) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": start_time,
+            "duration_ms": round((end - start) * 1000, 3),
+            "thread": threading.current_thread().name,
+            "attributes": self.attributes
+        }
+
+
+class _NoopSpan:
+    """What Tracer.span returns while tracing is disabled"""
+
+    __slots__ = ()
+
+    def set(self, **attributes):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class RingBufferExporter:
+    """Keeps the most recent finished spans in memory"""
+
+    def __init__(self, capacity: int = 4096):
+        self.spans = deque(maxlen=capacity)
+
+    def export(self, span: Dict[str, Any]):
+        self.spans.append(span)
+
+    def dump(self, trace_id: Optional[str] = None, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Finished spans, oldest first; the last `limit` of them, or those of one trace"""
+        spans = [span for span in list(self.spans) if trace_id is None or span["trace_id"] == trace_id]
+        return spans[-limit:] if limit else spans
+
+    def clear(self):
+        self.spans.clear()
+
+
+class Tracer:
+    """Records spans: named, timed operations forming a tree per request.
+
+    A span started while another is open (in the same task, or the thread
+    running it) becomes its child, so one request's spans share a trace id.
+    Finished spans are passed to every exporter, anything with an
+    `export(span_dict)` method. While disabled, span() returns a shared no-op
+    object and record() returns at once, so instrumentation costs a
+    function call and an attribute check.
+    """
+
+    def __init__(self, enabled: bool = False, exporters: Optional[List[Any]] = None):
+        self.enabled = enabled
+        self.exporters = list(exporters or [])
+
+    def span(self, name: str, **attributes):
+        """Context manager timing the enclosed block"""
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes, _current_span.get())
+
+    def record(self, name: str, start: float, end: float, **attributes):
+        """Record a span measured by the caller with time.perf_counter().
+
+        For code that can't hold a context manager open, like async
+        generators, whose steps may run in different contexts.
+        """
+        if not self.enabled:
+            return
+        span = Span(self, name, attributes, _current_span.get())
+        self._export(span._record(start, end, time.time() - (time.perf_counter() - start)))
+
+    def _export(self, record: Dict[str, Any]):
+        for exporter in self.exporters:
+            try:
+                exporter.export(record)
+            except Exception as e:
+                print(f"⚠️  Span exporter failed: {e}")
+
+
+class TracingMiddleware:
+    """ASGI middleware wrapping each HTTP request in a root span"""
+
+    def __init__(self, app, tracer: Tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                span.set(status=message["status"])
+            await send(message)
+
+        with self.tracer.span(f"{scope['method']} {scope['path']}", path=scope["path"]) as span:
+            await self.app(scope, receive, send_with_status)
+            route = scope.get("route")
+            if getattr(route, "path", None):
+                # Name by route template, so requests for different ids group together
+                span.name = f"{scope['method']} {route.path}"
+
+
+ring_buffer = RingBufferExporter(int(os.environ.get("LOCALAI_TRACE_BUFFER", "4096")))
+tracer = Tracer(enabled=os.environ.get("LOCALAI_TRACING", "0") == "1", exporters=[ring_buffer])
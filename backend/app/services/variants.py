@@ -0,0 +1,211 @@
+import json
+import os
+import platform
+import re
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .gguf import FILE_TYPES, GGUFError, bits_per_weight, quantization_from_name, read_metadata
+
+_METADATA_KEYS = ("general.architecture", "general.name", "general.basename", "general.size_label", "general.file_type")
+
+# Replies are assumed this long (or max_tokens, if shorter) when estimating
+# how long the requests ahead in the queue will take
+REPLY_ESTIMATE = 256
+
+
+def _slug(text: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")
+
+
+def describe_variant(path: Path) -> Dict[str, Any]:
+    """Base model and quantization of a GGUF file, from its metadata (or its name, failing that)"""
+    path = Path(path)
+    try:
+        metadata = read_metadata(path, _METADATA_KEYS)
+    except (OSError, GGUFError):
+        metadata = {}
+
+    quantization = quantization_from_name(path.name)
+    file_type = metadata.get("general.file_type")
+    if file_type in FILE_TYPES:
+        quantization = FILE_TYPES[file_type][0]
+
+    if metadata.get("general.basename"):
+        base = " ".join(filter(None, [metadata["general.basename"], metadata.get("general.size_label")]))
+    elif metadata.get("general.name"):
+        base = metadata["general.name"]
+    else:
+        base = path.stem
+    if quantization:
+        # Some converters put the quantization in general.name too
+        base = re.sub(re.escape(quantization), "", base, flags=re.IGNORECASE)
+    architecture = metadata.get("general.architecture")
+    return {
+        "base_model": ":".join(filter(None, [architecture, _slug(base)])),
+        "architecture": architecture,
+        "quantization": quantization,
+        "bits_per_weight": bits_per_weight(quantization)
+    }
+
+
+def group_variants(models: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    """Models by base model, highest quality (most bits per weight) first"""
+    groups: Dict[str, List[Dict[str, Any]]] = {}
+    for model in models:
+        groups.setdefault(model["base_model"], []).append(model)
+    for variants in groups.values():
+        variants.sort(key=lambda m: -(m.get("bits_per_weight") or 0))
+    return groups
+
+
+def host_id(n_threads: int) -> str:
+    """Benchmarks are only valid on the host (and thread count) that ran them"""
+    return f"{platform.machine()}-{os.cpu_count()}cpu-{n_threads}t"
+
+
+class BenchmarkStore:
+    """Prefill/decode speed per model file on this host (models/benchmarks.json).
+
+    A result is dropped once its file changes (size or mtime) or when read
+    on a different host.
+    """
+
+    def __init__(self, path: Path, host: str):
+        self.path = Path(path)
+        self.host = host
+        self.results: Dict[str, Dict[str, Any]] = {}
+        try:
+            with open(self.path, 'r') as f:
+                self.results = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _stamp(model_path: Path) -> Dict[str, Any]:
+        stat = os.stat(model_path)
+        return {"size": stat.st_size, "mtime": int(stat.st_mtime)}
+
+    def get(self, model_path: Path) -> Optional[Dict[str, Any]]:
+        result = self.results.get(Path(model_path).name)
+        if result is None or result.get("host") != self.host:
+            return None
+        try:
+            stamp = self._stamp(model_path)
+        except OSError:
+            return None
+        if any(result.get(key) != value for key, value in stamp.items()):
+            return None
+        return result
+
+    def put(self, model_path: Path, result: Dict[str, Any]):
+        self.results[Path(model_path).name] = {**result, **self._stamp(model_path), "host": self.host, "measured_at": time.time()}
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, 'w') as f:
+            json.dump(self.results, f, indent=2)
+        os.replace(tmp, self.path)
+
+
+def benchmark_variant(
+    model_path: Path,
+    n_threads: int,
+    prompt_tokens: int = 256,
+    decode_tokens: int = 32,
+    factory: Optional[Callable[..., Any]] = None
+) -> Dict[str, Any]:
+    """Load a model and time prompt evaluation and decoding (blocking).
+
+    `factory` builds the model (llama_cpp.Llama by default).
+    """
+    if factory is None:
+        from llama_cpp import Llama as factory
+    started = time.perf_counter()
+    model = factory(model_path=str(model_path), n_ctx=prompt_tokens + decode_tokens + 64, n_threads=n_threads, verbose=False)
+    loaded = time.perf_counter()
+    try:
+        tokens = model.tokenize(b" the" * prompt_tokens, add_bos=True)[:prompt_tokens]
+        first = None
+        produced = 0
+        begin = time.perf_counter()
+        for _ in model.create_completion(tokens, max_tokens=decode_tokens, temperature=0.0, stream=True):
+            produced += 1
+            if first is None:
+                first = time.perf_counter()
+        end = time.perf_counter()
+    finally:
+        close = getattr(model, "close", None)
+        if close is not None:
+            close()
+        del model
+    first = first or end
+    return {
+        "load_seconds": round(loaded - started, 3),
+        "prefill_tokens_per_second": round(len(tokens) / max(first - begin, 1e-6), 1),
+        "decode_tokens_per_second": round((produced - 1) / (end - first), 1) if produced > 1 and end > first else None
+    }
+
+
+class VariantSelector:
+    """Picks which quantization of a model serves the next request.
+
+    The predicted time to first token of a variant is the time to finish
+    the requests ahead of it, plus its own prompt evaluation, plus loading
+    it if it isn't the one loaded. The highest-quality variant predicted to
+    meet the latency SLO wins; if none does, the fastest. So under load the
+    selection falls back to smaller quantizations, and moves back up once
+    the queue drains. Moving up to a better variant must leave `headroom`
+    of the SLO spare and waits `min_dwell` seconds after the previous
+    switch (recorded with switched() once a switch succeeds), so it
+    doesn't flap.
+    """
+
+    def __init__(self, min_dwell: float = 30.0, headroom: float = 0.2):
+        self.min_dwell = min_dwell
+        self.headroom = headroom
+        self.switched_at: Optional[float] = None
+
+    @staticmethod
+    def predicted_ttft(
+        variant: Dict[str, Any], current: Optional[str], prompt_tokens: int, reply_tokens: int, ahead: int
+    ) -> float:
+        """Seconds until the first token of a request if `variant` serves it"""
+        benchmark = variant["benchmark"]
+        prefill = benchmark["prefill_tokens_per_second"]
+        decode = benchmark.get("decode_tokens_per_second") or prefill
+        service = prompt_tokens / prefill + reply_tokens / decode
+        load = 0.0 if variant["filename"] == current else benchmark.get("load_seconds", 0.0)
+        return load + ahead * service + prompt_tokens / prefill
+
+    def choose(
+        self,
+        variants: List[Dict[str, Any]],
+        current: Optional[str],
+        slo_seconds: float,
+        prompt_tokens: int,
+        max_tokens: int,
+        ahead: int,
+        now: Optional[float] = None
+    ) -> Optional[Dict[str, Any]]:
+        """The variant to serve with; `variants` are the benchmarked ones, best quality first"""
+        if not variants:
+            return None
+        now = time.monotonic() if now is None else now
+        reply_tokens = min(max_tokens, REPLY_ESTIMATE)
+        predictions = [(self.predicted_ttft(v, current, prompt_tokens, reply_tokens, ahead), v) for v in variants]
+        rank = {v["filename"]: index for index, v in enumerate(variants)}
+
+        chosen = next((v for predicted, v in predictions if predicted <= slo_seconds), None)
+        if chosen is None:
+            chosen = min(predictions, key=lambda item: item[0])[1]
+        if current in rank and chosen["filename"] != current and rank[chosen["filename"]] < rank[current]:
+            # An upgrade: only with room to spare, and not straight after a switch
+            predicted = next(p for p, v in predictions if v is chosen)
+            settled = self.switched_at is None or now - self.switched_at >= self.min_dwell
+            if not settled or predicted > slo_seconds * (1 - self.headroom):
+                return variants[rank[current]]
+        return chosen
+
+    def switched(self, now: Optional[float] = None):
+        """Record that the chosen variant is now loaded, starting the dwell time"""
+        self.switched_at = time.monotonic() if now is None else now
@@ -0,0 +1,200 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+PROTOCOL_VERSION = 1
+ENCODINGS = ["json", "msgpack"] if msgpack is not None else ["json"]
+
+# start_chat(payload) -> (conversation_id, frames), where frames yields
+# {"delta": text} items and then one final frame (see ModelManager.stream_generate)
+StartChat = Callable[[Dict[str, Any]], Awaitable[Tuple[str, AsyncIterator[Dict[str, Any]]]]]
+
+
+class ChatSocket:
+    """One chat WebSocket connection.
+
+    Protocol version 1 multiplexes generations over the socket. Client frames:
+
+        {"type": "hello", "version": 1, "encoding": "json" | "msgpack"}
+        {"type": "generate", "id": ..., "message": ..., <other ChatRequest fields>}
+        {"type": "cancel", "id": ...}
+        {"type": "ping", ...}
+
+    Server frames are "hello", "pong" (echoing the ping) and, per request id,
+    "start" (with the conversation id), "delta" (text), then one of "done"
+    (the final frame), "cancelled" or "error". Deltas are coalesced: text is
+    held for up to `coalesce_ms` or until `coalesce_bytes` have accumulated.
+    With the msgpack encoding frames are binary messages; the client may send
+    either encoding.
+
+    Frames without a "type" use the original protocol: {"message": ...} in,
+    one {"chunk": text} frame per token out, one generation at a time.
+    """
+
+    def __init__(
+        self,
+        websocket,
+        start_chat: StartChat,
+        legacy_chat: Optional[Callable[[Dict[str, Any]], AsyncIterator[Dict[str, Any]]]] = None,
+        coalesce_ms: float = 20,
+        coalesce_bytes: int = 512,
+        max_inflight: int = 8
+    ):
+        self.websocket = websocket
+        self.start_chat = start_chat
+        self.legacy_chat = legacy_chat
+        self.window = coalesce_ms / 1000
+        self.max_bytes = coalesce_bytes
+        self.max_inflight = max_inflight
+        self.encoding = "json"
+        self.tasks: Dict[Any, asyncio.Task] = {}
+        self.frames_sent = 0
+        self.bytes_sent = 0
+        self._send_lock = asyncio.Lock()
+        self._closed = False
+
+    async def serve(self):
+        """Handle frames until the client disconnects"""
+        try:
+            while True:
+                message = await self.websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                try:
+                    frame = self._decode(message)
+                except Exception as e:
+                    await self.send({"type": "error", "detail": f"Invalid frame: {e}"})
+                    continue
+                await self.handle(frame)
+        finally:
+            self._closed = True
+            for task in list(self.tasks.values()):
+                task.cancel()
+
+    async def handle(self, frame: Dict[str, Any]):
+        kind = frame.get("type")
+        if kind is None and self.legacy_chat is not None:
+            await self._legacy(frame)
+        elif kind == "hello":
+            await self._hello(frame)
+        elif kind == "ping":
+            await self.send({**frame, "type": "pong"})
+        elif kind == "generate":
+            request_id = frame.get("id")
+            if request_id is None or request_id in self.tasks:
+                await self.send({"type": "error", "id": request_id, "detail": "A unique request id is required"})
+            elif len(self.tasks) >= self.max_inflight:
+                await self.send({"type": "error", "id": request_id, "detail": "Too many generations in flight"})
+            else:
+                task = asyncio.ensure_future(self._generate(request_id, frame))
+                self.tasks[request_id] = task
+                task.add_done_callback(lambda task: self._finished(request_id, task))
+        elif kind == "cancel":
+            task = self.tasks.get(frame.get("id"))
+            if task is not None:
+                task.cancel()
+        else:
+            await self.send({"type": "error", "id": frame.get("id"), "detail": f"Unknown frame type: {kind}"})
+
+    async def send(self, frame: Dict[str, Any]):
+        if self._closed:
+            return
+        if self.encoding == "msgpack":
+            data = msgpack.packb(frame, use_bin_type=True)
+            async with self._send_lock:
+                await self.websocket.send_bytes(data)
+        else:
+            data = json.dumps(frame)
+            async with self._send_lock:
+                await self.websocket.send_text(data)
+        self.frames_sent += 1
+        self.bytes_sent += len(data)
+
+    def _decode(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        if message.get("bytes") is not None:
+            if msgpack is None:
+                raise ValueError("binary frames need msgpack")
+            frame = msgpack.unpackb(message["bytes"], raw=False)
+        else:
+            frame = json.loads(message["text"])
+        if not isinstance(frame, dict):
+            raise ValueError("expected an object")
+        return frame
+
+    async def _hello(self, frame: Dict[str, Any]):
+        if frame.get("version", PROTOCOL_VERSION) != PROTOCOL_VERSION:
+            await self.send({"type": "error", "detail": f"Unsupported protocol version {frame.get('version')}"})
+            return
+        encoding = frame.get("encoding", "json")
+        if encoding not in ENCODINGS:
+            await self.send({"type": "error", "detail": f"Unsupported encoding {encoding}"})
+            return
+        # The reply already uses the negotiated encoding
+        self.encoding = encoding
+        await self.send({
+            "type": "hello",
+            "version": PROTOCOL_VERSION,
+            "encoding": encoding,
+            "encodings": ENCODINGS,
+            "coalesce_ms": self.window * 1000,
+            "coalesce_bytes": self.max_bytes,
+            "max_inflight": self.max_inflight
+        })
+
+    async def _generate(self, request_id: Any, payload: Dict[str, Any]):
+        loop = asyncio.get_event_loop()
+        buffer = []
+        size = 0
+        timer = None
+
+        async def flush():
+            nonlocal buffer, size, timer
+            if timer is not None:
+                timer.cancel()
+                timer = None
+            if buffer:
+                text, buffer, size = "".join(buffer), [], 0
+                await self.send({"type": "delta", "id": request_id, "text": text})
+
+        try:
+            conversation_id, frames = await self.start_chat(payload)
+            await self.send({"type": "start", "id": request_id, "conversation_id": conversation_id})
+            async for frame in frames:
+                if "delta" not in frame:
+                    await flush()
+                    await self.send({**frame, "type": "done", "id": request_id})
+                    continue
+                buffer.append(frame["delta"])
+                size += len(frame["delta"])
+                if size >= self.max_bytes:
+                    await flush()
+                elif timer is None:
+                    # Send whatever has accumulated once the window expires
+                    timer = loop.call_later(self.window, lambda: asyncio.ensure_future(flush()))
+        except Exception as e:
+            error = {"type": "error", "id": request_id, "detail": str(e)}
+            if getattr(e, "retry_after", None) is not None:
+                error["retry_after"] = e.retry_after
+            await self.send(error)
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+    def _finished(self, request_id: Any, task: asyncio.Task):
+        self.tasks.pop(request_id, None)
+        if task.cancelled():
+            # Also covers generations cancelled before they started running
+            asyncio.ensure_future(self.send({"type": "cancelled", "id": request_id}))
+
+    async def _legacy(self, frame: Dict[str, Any]):
+        try:
+            async for item in self.legacy_chat(frame):
+                if "delta" in item:
+                    await self.send({"chunk": item["delta"]})
+        except Exception as e:
+            await self.send({"error": str(e)})
@@ -1,54 +1,89 @@
-#!/usr/bin/env python3
-"""
-Startup script for LocalAI Chat application
-"""
-import os
-import sys
-import webbrowser
-import threading
-import time
-from pathlib import Path
-
-def check_dependencies():
-    """Check if required dependencies are installed"""
-    try:
-        import fastapi
-        import uvicorn
-        print("✅ All core dependencies found")
-    except ImportError as e:
-        print(f"❌ Missing dependency: {e}")
-        print("Please install requirements: pip install -r requirements.txt")
-        return False
-    return True
-
-def start_server():
-    """Start the FastAPI server"""
-    os.chdir(Path(__file__).parent)
-    os.system("uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload")
-
-def open_browser():
-    """Open browser after server starts"""
-    time.sleep(3)  # Wait for server to start
-    webbrowser.open("http://localhost:8000")
-
-def main():
-    print("🚀 Starting LocalAI Chat...")
-    print("📋 Checking dependencies...")
-    
-    if not check_dependencies():
-        sys.exit(1)
-    
-    print("🌐 Starting web server...")
-    print("📖 Open http://localhost:8000 in your browser")
-    print("⏹️  Press Ctrl+C to stop the server")
-    
-    # Start browser in background
-    browser_thread = threading.Thread(target=open_browser)
-    browser_thread.daemon = True
-    browser_thread.start()
-    
-    # Start server
-    start_server()
-
-if __name__ == "__main__":
-    main()
+#!/usr/bin/env python3
+"""
+Startup script for LocalAI Chat application
+
+    python start.py                      # production: preloaded model, graceful shutdown
+    python start.py --workers 4          # four forked workers sharing the preloaded model
+    python start.py --dev                # autoreload and open the browser
+    python start.py --profile-startup    # report import and service startup times, then exit
+"""
+import argparse
+import os
+import sys
+import webbrowser
+import threading
+import time
+from pathlib import Path
+
+def check_dependencies():
+    """Check if required dependencies are installed"""
+    try:
+        import fastapi
+        import uvicorn
+        print("✅ All core dependencies found")
+    except ImportError as e:
+        print(f"❌ Missing dependency: {e}")
+        print("Please install requirements: pip install -r requirements.txt")
+        return False
+    return True
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Start the LocalAI Chat server")
+    parser.add_argument("--host", default=os.environ.get("LOCALAI_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("LOCALAI_PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("LOCALAI_WORKERS", "1")),
+                        help="Worker processes forked after the model is loaded")
+    parser.add_argument("--graceful-timeout", type=float, default=30.0,
+                        help="Seconds to let in-flight requests finish on shutdown")
+    parser.add_argument("--no-preload", action="store_true",
+                        help="Load the model in each worker instead of once before forking")
+    parser.add_argument("--dev", action="store_true",
+                        help="Development profile: autoreload on code changes and open the browser")
+    parser.add_argument("--profile-startup", action="store_true",
+                        help="Report import time per module and init time per service, then exit")
+    parser.add_argument("--log-level", default="info")
+    return parser.parse_args()
+
+def open_browser(port: int):
+    """Open browser after server starts"""
+    time.sleep(3)  # Wait for server to start
+    webbrowser.open(f"http://localhost:{port}")
+
+def main():
+    args = parse_args()
+    print("🚀 Starting LocalAI Chat...")
+    print("📋 Checking dependencies...")
+
+    if not check_dependencies():
+        sys.exit(1)
+
+    os.chdir(Path(__file__).parent)
+    sys.path.insert(0, str(Path(__file__).parent))
+    from app.launcher import profile_startup, serve
+
+    if args.profile_startup:
+        profile_startup("app.main:app")
+        return
+
+    print(f"📖 Open http://localhost:{args.port} in your browser")
+    print("⏹️  Press Ctrl+C to stop the server")
+
+    if args.dev:
+        # Start browser in background
+        browser_thread = threading.Thread(target=open_browser, args=(args.port,))
+        browser_thread.daemon = True
+        browser_thread.start()
+
+    serve(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        profile="development" if args.dev else "production",
+        preload=not args.no_preload,
+        graceful_timeout=args.graceful_timeout,
+        log_level=args.log_level
+    )
+
+if __name__ == "__main__":
+    main()
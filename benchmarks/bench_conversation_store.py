@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark startup time and per-message write latency of the conversation store
+
+    python -m benchmarks.bench_conversation_store --conversations 100000
+"""
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from backend.app.services.conversation_manager import ConversationManager
+from backend.app.services.conversation_store import ConversationStore
+
+def populate(db_path: Path, conversations: int, messages_per_conversation: int):
+    """Fill the store with synthetic conversations"""
+    store = ConversationStore(db_path, synchronous="OFF")
+    store.open()
+    now = datetime.now().isoformat()
+    batch = []
+    for i in range(conversations):
+        batch.append({
+            "id": str(uuid.uuid4()),
+            "title": f"Conversation {i}",
+            "created_at": now,
+            "messages": [
+                {"role": "user" if m % 2 == 0 else "assistant", "content": f"message {m} " * 20, "created_at": now}
+                for m in range(messages_per_conversation)
+            ]
+        })
+        if len(batch) == 1000:
+            for conversation in batch:
+                store.import_conversation(conversation)
+            batch = []
+    for conversation in batch:
+        store.import_conversation(conversation)
+    store.close()
+
+async def measure(conversations_dir: Path, appends: int, fsync_policy: str):
+    start = time.perf_counter()
+    manager = ConversationManager(conversations_dir, fsync_policy=fsync_policy)
+    await manager.initialize()
+    startup = time.perf_counter() - start
+    print(f"Startup ({manager.store.count_conversations()} conversations): {startup * 1000:.1f} ms")
+
+    start = time.perf_counter()
+    page = await manager.list_conversations(limit=50)
+    print(f"First page of 50 summaries: {(time.perf_counter() - start) * 1000:.2f} ms")
+
+    conversation_id = page["conversations"][0]["id"]
+    latencies = []
+    for i in range(appends):
+        start = time.perf_counter()
+        await manager.add_message(conversation_id, "user", f"benchmark message {i}")
+        latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    await manager.flush()
+    flush = time.perf_counter() - start
+    writes = manager.writes
+    print(f"Final flush: {flush * 1000:.1f} ms  "
+          f"({writes.submitted} writes, {writes.coalesced} coalesced, {writes.batches} batches, fsync={fsync_policy})")
+    await manager.close()
+
+    latencies.sort()
+    print(f"Append latency over {appends} messages: "
+          f"p50={statistics.median(latencies) * 1e6:.0f} us  "
+          f"p99={latencies[int(len(latencies) * 0.99) - 1] * 1e6:.0f} us  "
+          f"max={latencies[-1] * 1e6:.0f} us")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--conversations", type=int, default=100000)
+    parser.add_argument("--messages", type=int, default=4, help="Messages per conversation")
+    parser.add_argument("--appends", type=int, default=2000)
+    parser.add_argument("--fsync", default="batch", choices=["always", "batch", "off"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        conversations_dir = Path(tmp)
+        start = time.perf_counter()
+        populate(conversations_dir / "conversations.db", args.conversations, args.messages)
+        print(f"Populated {args.conversations} conversations in {time.perf_counter() - start:.1f} s")
+        asyncio.run(measure(conversations_dir, args.appends, args.fsync))
+
+if __name__ == "__main__":
+    main()
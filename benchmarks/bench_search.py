@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark incremental full-text index build and query latency
+
+    python -m benchmarks.bench_search --messages 1000000
+"""
+import argparse
+import itertools
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from backend.app.services.conversation_store import ConversationStore
+
+QUERIES = ["python", "error message", "pasta recipe", "deploy*", "graph neural", "conf*", "the model", "the"]
+
+def make_vocabulary(size: int, rng: random.Random):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    words = {"".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)}
+    vocabulary = sorted(words)
+    # "the" is the most frequent word; query terms are spread over the
+    # head of the Zipf distribution so they match 0.5-20% of messages
+    vocabulary.insert(0, "the")
+    for rank, word in enumerate(["model", "error", "message", "python", "config", "configuration",
+                                 "deploy", "deployment", "pasta", "recipe", "graph", "neural"]):
+        vocabulary.insert(8 + rank * 25, word)
+    return vocabulary
+
+def populate(store: ConversationStore, messages: int, per_conversation: int, rng: random.Random):
+    vocabulary = make_vocabulary(20000, rng)
+    # Zipf-like skew so some words are common and most are rare
+    cum_weights = list(itertools.accumulate(1.0 / (rank + 1) for rank in range(len(vocabulary))))
+    start_date = datetime(2024, 1, 1)
+    written = 0
+    while written < messages:
+        count = min(per_conversation, messages - written)
+        created = (start_date + timedelta(minutes=written)).isoformat()
+        store.import_conversation({
+            "id": str(uuid.uuid4()),
+            "title": "Benchmark",
+            "created_at": created,
+            "messages": [
+                {
+                    "role": "user" if i % 2 == 0 else "assistant",
+                    "content": " ".join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(8, 60))),
+                    "created_at": created,
+                    "model": "bench.gguf" if i % 2 else None,
+                }
+                for i in range(count)
+            ]
+        })
+        written += count
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=1000000)
+    parser.add_argument("--per-conversation", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20, help="Runs per query")
+    args = parser.parse_args()
+    rng = random.Random(42)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        store = ConversationStore(Path(tmp) / "conversations.db", synchronous="OFF")
+        store.open()
+
+        start = time.perf_counter()
+        populate(store, args.messages, args.per_conversation, rng)
+        elapsed = time.perf_counter() - start
+        print(f"Indexed {args.messages} messages incrementally in {elapsed:.1f} s "
+              f"({args.messages / elapsed:.0f} messages/s)")
+
+        filters = [{}, {"model": "bench.gguf"}, {"since": "2024-06-01"}]
+        all_latencies = []
+        for query in QUERIES:
+            for extra in filters:
+                latencies = []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    results = store.search(query, limit=20, **extra)
+                    latencies.append(time.perf_counter() - start)
+                all_latencies.extend(latencies)
+                print(f"{query!r:18} {str(extra):28} hits={len(results):2}  "
+                      f"p50={statistics.median(latencies) * 1000:.2f} ms  max={max(latencies) * 1000:.2f} ms")
+
+        all_latencies.sort()
+        print(f"Overall: {len(all_latencies) / sum(all_latencies):.0f} queries/s, "
+              f"p99={all_latencies[int(len(all_latencies) * 0.99) - 1] * 1000:.2f} ms")
+        store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Cost of span instrumentation, disabled and enabled
+
+    python -m benchmarks.bench_tracing --spans 200000
+"""
+import argparse
+import time
+
+from backend.app.services.tracing import RingBufferExporter, Tracer
+
+def run(tracer: Tracer, spans: int) -> float:
+    start = time.perf_counter()
+    for _ in range(spans):
+        with tracer.span("bench", attribute=1):
+            pass
+    return (time.perf_counter() - start) / spans
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--spans", type=int, default=200000)
+    args = parser.parse_args()
+
+    baseline_start = time.perf_counter()
+    for _ in range(args.spans):
+        pass
+    baseline = (time.perf_counter() - baseline_start) / args.spans
+
+    for enabled in (False, True):
+        tracer = Tracer(enabled=enabled, exporters=[RingBufferExporter()])
+        per_span = run(tracer, args.spans) - baseline
+        print(f"{'enabled' if enabled else 'disabled':8s} {per_span * 1e9:8.0f} ns/span")
+
+if __name__ == "__main__":
+    main()
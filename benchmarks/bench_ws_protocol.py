@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Compare the original one-frame-per-token WebSocket protocol with the
+multiplexed, coalescing protocol (JSON and msgpack)
+
+    python -m benchmarks.bench_ws_protocol --tokens 20000 --streams 4 --rate 2000
+
+Frames are sent to an in-memory socket, so the numbers are the server's
+framing cost (encoding, frame count and bytes) without network effects.
+"""
+import argparse
+import asyncio
+import json
+import time
+
+from backend.app.services.ws_protocol import ENCODINGS, ChatSocket
+
+class CountingWebSocket:
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+        self.frames = 0
+        self.bytes = 0
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_text(self, data):
+        self.frames += 1
+        self.bytes += len(data)
+
+    async def send_bytes(self, data):
+        self.frames += 1
+        self.bytes += len(data)
+
+def token_source(tokens: int, rate: float, completed: list):
+    """Frames shaped like ModelManager.stream_generate, `rate` tokens/s (0 = unthrottled)"""
+    async def frames():
+        start = time.perf_counter()
+        for i in range(tokens):
+            if rate and i % 16 == 0:
+                # Sleep in small batches so the source keeps up with high rates
+                delay = start + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            yield {"delta": f" tok{i % 1000}"}
+        yield {"response": "...", "model": "bench"}
+        # Resumed only once the final frame has been sent
+        completed.append(1)
+    return frames
+
+async def run(mode: str, tokens: int, streams: int, rate: float):
+    websocket = CountingWebSocket()
+    completed = []
+    source = token_source(tokens, rate, completed)
+
+    async def start_chat(payload):
+        return "bench", source()
+
+    socket = ChatSocket(websocket, start_chat, legacy_chat=lambda payload: source())
+    server = asyncio.ensure_future(socket.serve())
+    wall, cpu = time.perf_counter(), time.process_time()
+
+    def send(frame):
+        websocket.incoming.put_nowait({"type": "websocket.receive", "text": json.dumps(frame)})
+
+    if mode == "legacy":
+        # The original protocol runs one generation at a time per socket
+        for _ in range(streams):
+            send({"message": "bench"})
+    else:
+        send({"type": "hello", "version": 1, "encoding": mode})
+        for i in range(streams):
+            send({"type": "generate", "id": i, "message": "bench"})
+    while len(completed) < streams:
+        await asyncio.sleep(0.01)
+
+    wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    websocket.incoming.put_nowait({"type": "websocket.disconnect"})
+    await server
+    total = tokens * streams
+    print(f"{mode:8s} frames={websocket.frames:7d}  frames/s={websocket.frames / wall:9.0f}  "
+          f"bytes/token={websocket.bytes / total:5.1f}  cpu/token={cpu / total * 1e6:6.1f} us  "
+          f"wall={wall:.2f} s")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--tokens", type=int, default=20000, help="Tokens per stream")
+    parser.add_argument("--streams", type=int, default=4, help="Generations per socket")
+    parser.add_argument("--rate", type=float, default=0, help="Tokens/s per stream (0 = as fast as possible)")
+    args = parser.parse_args()
+
+    for mode in ["legacy"] + ENCODINGS:
+        asyncio.run(run(mode, args.tokens, args.streams, args.rate))
+
+if __name__ == "__main__":
+    main()
@@ -4,6 +4,7 @@ class LocalAIChat {
         this.uploadedDocuments = [];
         this.currentJsonSchema = null;
         this.isGenerating = false;
+        this.conversationsCursor = null;
         
         this.initializeApp();
     }
@@ -12,6 +13,7 @@ class LocalAIChat {
         this.bindEvents();
         await this.loadModels();
         await this.checkServerStatus();
+        await this.loadConversations();
         
         // Auto-load first model if available
         setTimeout(() => this.autoLoadModel(), 1000);
@@ -218,7 +220,10 @@ class LocalAIChat {
             this.addMessage('assistant', data.response, data.model);
             
             // Update conversation
-            this.currentConversation = data.conversation_id;
+            if (this.currentConversation !== data.conversation_id) {
+                this.currentConversation = data.conversation_id;
+                await this.loadConversations();
+            }
             
         } catch (error) {
             this.removeTypingIndicator();
@@ -404,6 +409,61 @@ class LocalAIChat {
         this.closeJsonModal();
     }
 
+    async loadConversations(append = false) {
+        try {
+            const params = new URLSearchParams({ limit: 50 });
+            if (append && this.conversationsCursor) {
+                params.set('cursor', this.conversationsCursor);
+            }
+            const response = await fetch(`/api/conversations?${params}`);
+            const page = await response.json();
+            
+            const container = document.getElementById('conversations-container');
+            if (!append) {
+                container.innerHTML = '';
+            }
+            container.querySelector('.load-more')?.remove();
+            
+            page.conversations.forEach(conversation => {
+                const item = document.createElement('div');
+                item.className = 'conversation-item';
+                item.textContent = conversation.title;
+                item.title = `${conversation.message_count} messages`;
+                item.addEventListener('click', () => this.openConversation(conversation.id, conversation.title));
+                container.appendChild(item);
+            });
+            
+            this.conversationsCursor = page.next_cursor;
+            if (page.next_cursor) {
+                const more = document.createElement('button');
+                more.className = 'btn btn-outline load-more';
+                more.textContent = 'Load more';
+                more.addEventListener('click', () => this.loadConversations(true));
+                container.appendChild(more);
+            }
+        } catch (error) {
+            console.error('Error loading conversations:', error);
+        }
+    }
+
+    async openConversation(conversationId, title) {
+        try {
+            const response = await fetch(`/api/conversations/${encodeURIComponent(conversationId)}`);
+            const conversation = await response.json();
+            
+            if (!response.ok) {
+                throw new Error(conversation.detail || 'Failed to load conversation');
+            }
+            
+            this.startNewChat();
+            this.currentConversation = conversation.id;
+            document.getElementById('chat-title').textContent = title;
+            conversation.messages.forEach(message => this.addMessage(message.role, message.content, message.model));
+        } catch (error) {
+            this.showError(`Error loading conversation: ${error.message}`);
+        }
+    }
+
     startNewChat() {
         this.currentConversation = null;
         document.getElementById('chat-messages').innerHTML = `
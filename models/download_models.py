@@ -1,72 +1,437 @@
 #!/usr/bin/env python3
 """
 Script to download GGUF models for offline use
+
+    python download_models.py                          # pick a model interactively
+    python download_models.py --all                    # download every model, no prompts
+    python download_models.py --model phi-2.q4_K_M.gguf --workers 8
+    python download_models.py --manifest site.json --all --models-dir /srv/models
+
+Files are fetched in parallel ranges into models/.partial and resume from
+there after an interrupted run. They are checked against the manifest's
+sha256 and only then moved into place and registered in models/index.json.
 """
+import argparse
+import hashlib
+import json
 import os
-import requests
+import re
+import sys
+import threading
+import time
+import urllib.error
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from pathlib import Path
-import sys
+from typing import Any, Dict, List, Optional
+
+MODELS_DIR = Path(__file__).resolve().parent
+INDEX_FILE = "index.json"
+PARTIAL_DIR = ".partial"
+
+# List of recommended small models for testing. A manifest file (--manifest)
+# has the same shape; add "sha256" to have downloads verified against it
+DEFAULT_MANIFEST = [
+    {
+        "name": "TinyLlama 1.1B",
+        "url": "https://huggingface.co/TheBloke/TinyLlama-1.1B-Chat-v1.0-GGUF/resolve/main/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf",
+        "filename": "tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf",
+        "size": "0.8GB"
+    },
+    {
+        "name": "Phi-2 3B",
+        "url": "https://huggingface.co/TheBloke/phi-2-GGUF/resolve/main/phi-2.q4_K_M.gguf",
+        "filename": "phi-2.q4_K_M.gguf",
+        "size": "1.8GB"
+    }
+]
+
+CHUNK_SIZE = 16 * 1024 * 1024
+READ_SIZE = 1024 * 1024
+RETRIES = 4
+USER_AGENT = "localai-chat-downloader/1.0"
+
+
+class DownloadError(Exception):
+    """A model could not be downloaded or failed verification"""
+
+
+def load_manifest(path: Optional[Path]) -> List[Dict[str, Any]]:
+    """Models from a JSON manifest (a list, or {"models": [...]}), else the built-in list"""
+    if path is None:
+        return DEFAULT_MANIFEST
+    with open(path, 'r') as f:
+        manifest = json.load(f)
+    models = manifest["models"] if isinstance(manifest, dict) else manifest
+    for model in models:
+        missing = {"url", "filename"} - set(model)
+        if missing:
+            raise ValueError(f"Manifest entry {model.get('name', model)} lacks {', '.join(sorted(missing))}")
+        model.setdefault("name", model["filename"])
+    return models
+
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(READ_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _write_json(path: Path, data: Any):
+    """Replace a small JSON file atomically"""
+    tmp = path.with_name(f".{path.name}.tmp")
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def _fsync_dir(path: Path):
+    if os.name == "nt":
+        return
+    fd = os.open(str(path), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def read_index(models_dir: Path) -> Dict[str, Dict[str, Any]]:
+    """Registered models by filename"""
+    try:
+        with open(models_dir / INDEX_FILE, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def register_model(models_dir: Path, model: Dict[str, Any], sha256: Optional[str]):
+    """Record a verified model file in the model index"""
+    path = models_dir / model["filename"]
+    stat = path.stat()
+    index = read_index(models_dir)
+    index[model["filename"]] = {
+        "name": model.get("name", model["filename"]),
+        "filename": model["filename"],
+        "url": model.get("url"),
+        "sha256": sha256,
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "downloaded_at": datetime.now().isoformat()
+    }
+    _write_json(models_dir / INDEX_FILE, index)
+
+
+def _request(url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 30):
+    return urllib.request.urlopen(
+        urllib.request.Request(url, headers={"User-Agent": USER_AGENT, **(headers or {})}),
+        timeout=timeout
+    )
+
+
+def probe(url: str) -> Dict[str, Any]:
+    """Size of the file at `url`, whether ranges are served, and any validators"""
+    with _request(url, {"Range": "bytes=0-0"}) as response:
+        headers = response.headers
+        if response.status == 206:
+            match = re.match(r"bytes 0-0/(\d+)", headers.get("Content-Range", ""))
+            size = int(match.group(1)) if match else None
+            ranges = size is not None
+        else:
+            length = headers.get("Content-Length")
+            size = int(length) if length else None
+            ranges = False
+    # Hugging Face reports the sha256 of LFS files as their linked ETag
+    linked = (headers.get("X-Linked-ETag") or "").strip('"')
+    return {
+        "size": size,
+        "ranges": ranges,
+        "etag": headers.get("ETag"),
+        "sha256": linked.lower() if re.fullmatch(r"[0-9a-fA-F]{64}", linked) else None
+    }
+
+
+class Download:
+    """One file fetched into its `part` file, resumable from a state file.
+
+    With range support the file is split into chunks fetched by `workers`
+    threads; each finished chunk is recorded in <file>.part.json, so a
+    later run fetches only the chunks still missing. The state is thrown
+    away if the remote file changed (size or ETag) in between.
+    """
+
+    def __init__(self, url: str, part: Path, info: Dict[str, Any], workers: int = 4,
+                 chunk_size: int = CHUNK_SIZE, progress=None):
+        self.url = url
+        self.part = part
+        self.state_path = part.with_name(part.name + ".json")
+        self.info = info
+        self.workers = max(1, workers)
+        self.chunk_size = chunk_size
+        self.progress = progress
+        self.done = set()
+        self.received = 0
+        self._lock = threading.Lock()
+
+    def run(self):
+        size = self.info["size"]
+        if not self.info["ranges"] or not size:
+            self._fetch_whole()
+            return
+
+        chunks = (size + self.chunk_size - 1) // self.chunk_size
+        self._load_state(size)
+        if not self.part.exists() or self.part.stat().st_size != size:
+            with open(self.part, "wb") as f:
+                f.truncate(size)
+            self.done.clear()
+        self.received = sum(self._chunk_length(i, size) for i in self.done)
+        self._report(size)
+
+        missing = [i for i in range(chunks) if i not in self.done]
+        with ThreadPoolExecutor(max_workers=min(self.workers, len(missing) or 1)) as pool:
+            futures = [pool.submit(self._fetch_chunk, i, size) for i in missing]
+        # Every chunk has been tried (and the good ones recorded) before a failure is raised
+        for future in futures:
+            future.result()
+
+    def _chunk_length(self, index: int, size: int) -> int:
+        return min(self.chunk_size, size - index * self.chunk_size)
+
+    def _load_state(self, size: int):
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (state.get("url"), state.get("size"), state.get("etag"), state.get("chunk_size")) == \
+                (self.url, size, self.info["etag"], self.chunk_size):
+            self.done = set(state["done"])
+
+    def _save_state(self):
+        _write_json(self.state_path, {
+            "url": self.url,
+            "size": self.info["size"],
+            "etag": self.info["etag"],
+            "chunk_size": self.chunk_size,
+            "done": sorted(self.done)
+        })
+
+    def _fetch_chunk(self, index: int, size: int):
+        start = index * self.chunk_size
+        end = start + self._chunk_length(index, size) - 1
+        for attempt in range(RETRIES):
+            written = 0
+            try:
+                with _request(self.url, {"Range": f"bytes={start}-{end}"}) as response, open(self.part, "r+b") as f:
+                    if response.status != 206:
+                        raise DownloadError(f"Server ignored the range request (HTTP {response.status})")
+                    f.seek(start)
+                    while written < end - start + 1:
+                        block = response.read(min(READ_SIZE, end - start + 1 - written))
+                        if not block:
+                            raise DownloadError(f"Connection closed {end - start + 1 - written} bytes short")
+                        f.write(block)
+                        written += len(block)
+                        self._received(len(block), size)
+                    f.flush()
+                    os.fsync(f.fileno())
+                with self._lock:
+                    self.done.add(index)
+                    self._save_state()
+                return
+            except (OSError, DownloadError) as e:
+                self._received(-written, size)
+                if attempt == RETRIES - 1:
+                    raise DownloadError(f"Range {start}-{end} failed after {RETRIES} attempts: {e}")
+                time.sleep(min(2 ** attempt * 0.5, 10))
+
+    def _fetch_whole(self):
+        """Single stream, for servers without range support (restarts from zero)"""
+        for attempt in range(RETRIES):
+            self.received = 0
+            try:
+                with _request(self.url) as response, open(self.part, "wb") as f:
+                    for block in iter(lambda: response.read(READ_SIZE), b""):
+                        f.write(block)
+                        self._received(len(block), self.info["size"])
+                    f.flush()
+                    os.fsync(f.fileno())
+                if self.info["size"] and self.part.stat().st_size != self.info["size"]:
+                    raise DownloadError("Connection closed before the end of the file")
+                return
+            except (OSError, DownloadError) as e:
+                if attempt == RETRIES - 1:
+                    raise DownloadError(f"Download failed after {RETRIES} attempts: {e}")
+                time.sleep(min(2 ** attempt * 0.5, 10))
+
+    def _received(self, count: int, size: Optional[int]):
+        with self._lock:
+            self.received += count
+        self._report(size)
+
+    def _report(self, size: Optional[int]):
+        if self.progress is not None:
+            self.progress(self.received, size)
+
+
+def _progress_printer(filename: str):
+    last = [0.0]
+
+    def report(received: int, total: Optional[int]):
+        now = time.monotonic()
+        if now - last[0] < 0.5 and (total is None or received < total):
+            return
+        last[0] = now
+        if total:
+            print(f"\rDownloading {filename}: {int(received * 100 / total)}%", end='', flush=True)
+        else:
+            print(f"\rDownloading {filename}: {received // (1024 * 1024)} MB", end='', flush=True)
+    return report
+
+
+def download_model(model: Dict[str, Any], models_dir: Path, workers: int = 4,
+                   chunk_size: int = CHUNK_SIZE, quiet: bool = False) -> Path:
+    """Download, verify, move into place and register one model; returns its path.
+
+    An existing file is kept if it matches the manifest checksum (or, without
+    one, the index entry written when it was downloaded); otherwise it is
+    downloaded again.
+    """
+    models_dir.mkdir(parents=True, exist_ok=True)
+    file_path = models_dir / model["filename"]
+    expected = (model.get("sha256") or "").lower() or None
+
+    if file_path.exists() and _is_complete(file_path, model, models_dir, expected):
+        if not quiet:
+            print(f"✅ {model['name']} already exists")
+        return file_path
+
+    info = probe(model["url"])
+    expected = expected or info["sha256"]
+    partial_dir = models_dir / PARTIAL_DIR
+    partial_dir.mkdir(exist_ok=True)
+    part = partial_dir / (model["filename"] + ".part")
+
+    if not quiet:
+        print(f"⬇️  Downloading {model['name']}...")
+    download = Download(model["url"], part, info, workers, chunk_size,
+                        progress=None if quiet else _progress_printer(model["filename"]))
+    download.run()
+    if not quiet:
+        print()  # New line after download
+
+    actual = file_sha256(part)
+    if expected and actual != expected:
+        part.unlink()
+        # Single-stream downloads (no range support) have no state file
+        download.state_path.unlink(missing_ok=True)
+        raise DownloadError(f"Checksum mismatch for {model['filename']}: expected {expected}, got {actual}")
+    if not expected and not quiet:
+        print(f"⚠️  No checksum known for {model['filename']}; recorded sha256 {actual}")
+
+    os.replace(part, file_path)
+    _fsync_dir(models_dir)
+    download.state_path.unlink(missing_ok=True)
+    register_model(models_dir, model, actual)
+    if not quiet:
+        print(f"✅ Successfully downloaded {model['filename']}")
+    return file_path
+
+
+def _is_complete(path: Path, model: Dict[str, Any], models_dir: Path, expected: Optional[str]) -> bool:
+    entry = read_index(models_dir).get(model["filename"])
+    stat = path.stat()
+    if entry and entry.get("size") == stat.st_size and entry.get("mtime") == stat.st_mtime:
+        # Unchanged since it was verified; skip rehashing gigabytes
+        return expected is None or entry.get("sha256") == expected
+    if expected is None:
+        # No checksum and not downloaded by us: trust it only if the size matches the
+        # server's. A file that can't be checked (server unreachable, or no size
+        # reported) may be a leftover of an interrupted run: not complete.
+        try:
+            size = probe(model["url"])["size"]
+        except (OSError, urllib.error.URLError):
+            return False
+        complete = size is not None and size == stat.st_size
+    else:
+        complete = file_sha256(path) == expected
+    if complete:
+        register_model(models_dir, model, expected or file_sha256(path))
+    return complete
+
+
+def download_all(models: List[Dict[str, Any]], models_dir: Path, workers: int = 4,
+                 chunk_size: int = CHUNK_SIZE, quiet: bool = False) -> List[str]:
+    """Download each model; returns the filenames that failed"""
+    failed = []
+    for model in models:
+        try:
+            download_model(model, models_dir, workers, chunk_size, quiet)
+        except Exception as e:
+            print(f"❌ Error downloading {model['name']}: {e}")
+            failed.append(model["filename"])
+    return failed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Download GGUF models for offline use")
+    parser.add_argument("--manifest", type=Path, help="JSON list of {name, url, filename, sha256}")
+    parser.add_argument("--models-dir", type=Path, default=MODELS_DIR)
+    parser.add_argument("--all", action="store_true", help="Download every model in the manifest")
+    parser.add_argument("--model", action="append", default=[],
+                        help="Name or filename of a model to download (repeatable)")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel range requests per file")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE // (1024 * 1024), help="Range size in MB")
+    parser.add_argument("--list", action="store_true", help="List the manifest and exit")
+    parser.add_argument("--quiet", action="store_true", help="No progress output")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    models = load_manifest(args.manifest)
+    chunk_size = args.chunk_size * 1024 * 1024
+
+    if args.list:
+        for model in models:
+            print(f"{model['name']} ({model.get('size', '?')}) - {model['filename']}")
+        return 0
+
+    if args.all or args.model:
+        # Batch mode, for provisioning: no prompts, non-zero exit on any failure
+        wanted = set(args.model)
+        selected = models if args.all else [m for m in models if m["name"] in wanted or m["filename"] in wanted]
+        unknown = wanted - {m["name"] for m in selected} - {m["filename"] for m in selected}
+        if unknown:
+            print(f"❌ Not in the manifest: {', '.join(sorted(unknown))}")
+            return 2
+        return 1 if download_all(selected, args.models_dir, args.workers, chunk_size, args.quiet) else 0
+
+    if not sys.stdin.isatty():
+        print("❌ No model selected; pass --all or --model in non-interactive use")
+        return 2
 
-def download_file(url, filename):
-    """Download a file with progress bar"""
-    def progress_hook(count, block_size, total_size):
-        percent = int(count * block_size * 100 / total_size)
-        print(f"\rDownloading {filename}: {percent}%", end='', flush=True)
-    
-    urllib.request.urlretrieve(url, filename, progress_hook)
-    print()  # New line after download
-
-def main():
-    models_dir = Path("models")
-    models_dir.mkdir(exist_ok=True)
-    
-    # List of recommended small models for testing
-    models = [
-        {
-            "name": "TinyLlama 1.1B",
-            "url": "https://huggingface.co/TheBloke/TinyLlama-1.1B-Chat-v1.0-GGUF/resolve/main/tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf",
-            "filename": "tinyllama-1.1b-chat-v1.0.Q4_K_M.gguf",
-            "size": "0.8GB"
-        },
-        {
-            "name": "Phi-2 3B",
-            "url": "https://huggingface.co/TheBloke/phi-2-GGUF/resolve/main/phi-2.q4_K_M.gguf",
-            "filename": "phi-2.q4_K_M.gguf", 
-            "size": "1.8GB"
-        }
-    ]
-    
     print("🔍 Available models for download:")
     for i, model in enumerate(models, 1):
-        print(f"{i}. {model['name']} ({model['size']}) - {model['filename']}")
-    
+        print(f"{i}. {model['name']} ({model.get('size', '?')}) - {model['filename']}")
+
     choice = input("\nEnter model number to download (or 'a' for all): ").strip()
-    
+
     if choice.lower() == 'a':
         # Download all models
-        for model in models:
-            download_model(model, models_dir)
+        selected = models
     elif choice.isdigit() and 1 <= int(choice) <= len(models):
         # Download selected model
-        download_model(models[int(choice) - 1], models_dir)
+        selected = [models[int(choice) - 1]]
     else:
         print("Invalid choice")
-
-def download_model(model, models_dir):
-    """Download a single model"""
-    file_path = models_dir / model["filename"]
-    
-    if file_path.exists():
-        print(f"✅ {model['name']} already exists")
-        return
-    
-    print(f"⬇️  Downloading {model['name']}...")
-    try:
-        download_file(model["url"], file_path)
-        print(f"✅ Successfully downloaded {model['filename']}")
-    except Exception as e:
-        print(f"❌ Error downloading {model['name']}: {e}")
+        return 2
+    return 1 if download_all(selected, args.models_dir, args.workers, chunk_size) else 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,76 @@
+import asyncio
+import pytest
+from backend.app.services.admission import AdmissionController, Overloaded
+
+@pytest.mark.asyncio
+async def test_priority_order():
+    """Test that queued interactive requests are served before uploads and batch work"""
+    admission = AdmissionController(max_concurrent=1)
+    running = await admission.acquire("batch")
+    order = []
+
+    async def request(priority):
+        async with admission.slot(priority):
+            order.append(priority)
+
+    waiters = [asyncio.ensure_future(request(p)) for p in ("batch", "upload", "interactive")]
+    await asyncio.sleep(0.01)
+    assert admission.stats()["queue_depth"] == {"interactive": 1, "upload": 1, "batch": 1}
+
+    admission.release(running)
+    await asyncio.gather(*waiters)
+    assert order == ["interactive", "upload", "batch"]
+    assert admission.stats()["in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_per_client_limit():
+    """Test that one client cannot take more than its share"""
+    admission = AdmissionController(max_concurrent=4, max_per_client=2)
+    first = await admission.acquire(client="a")
+    second = await admission.acquire(client="a")
+    with pytest.raises(Overloaded) as error:
+        await admission.acquire(client="a")
+    assert error.value.status_code == 429
+    other = await admission.acquire(client="b")
+
+    admission.release(first)
+    third = await admission.acquire(client="a")
+    for ticket in (second, other, third):
+        admission.release(ticket)
+
+@pytest.mark.asyncio
+async def test_deadline_rejects_and_sheds():
+    """Test 503 for requests that can't start in time, and shedding of expired waiters"""
+    admission = AdmissionController(max_concurrent=1, deadlines={"interactive": 0.5})
+    # Teach the controller that a slot is held for about a second
+    ticket = await admission.acquire()
+    admission.service_time = 1.0
+
+    with pytest.raises(Overloaded) as error:
+        await admission.acquire()
+    assert error.value.status_code == 503
+    assert error.value.retry_after >= 1
+
+    # Expected to start in time, but the slot is never released
+    admission.service_time = 0.04
+    with pytest.raises(Overloaded):
+        await admission.acquire(deadline=0.05)
+    stats = admission.stats()
+    assert stats["rejected"]["interactive"] == 1
+    assert stats["shed"]["interactive"] == 1
+    assert stats["queue_depth"]["interactive"] == 0
+    admission.release(ticket)
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_queue():
+    """Test that a client going away while queued frees its place"""
+    admission = AdmissionController(max_concurrent=1)
+    ticket = await admission.acquire(client="a")
+    waiter = asyncio.ensure_future(admission.acquire(client="a"))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    await asyncio.sleep(0.01)
+    assert not admission.queue
+    assert admission.per_client["a"] == 1
+    admission.release(ticket)
+    assert admission.in_flight == 0
@@ -0,0 +1,195 @@
+import asyncio
+import json
+import threading
+import pytest
+import pytest_asyncio
+from backend.app.services.batch_manager import BatchManager, parse_batch_requests, schedule
+from backend.app.services.model_manager import ModelManager
+
+class _EchoLlama:
+    def __init__(self):
+        self.prompts = []
+
+    def create_chat_completion(self, messages, **kwargs):
+        self.prompts.append(messages[-1]["content"])
+        return {"choices": [{"message": {"content": "echo: " + messages[-1]["content"]}}]}
+
+@pytest.fixture
+def model_manager():
+    manager = ModelManager()
+    manager.current_model = _EchoLlama()
+    manager.current_model_name = "tiny.gguf"
+    return manager
+
+async def _wait_for(job, status="completed"):
+    for _ in range(500):
+        if job["status"] == status:
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError(job)
+
+def test_schedule_groups_models_and_prefixes():
+    """Test that the loaded model runs first and shared prefixes run back to back"""
+    requests = [
+        {"message": "Classify: b", "model": "other.gguf"},
+        {"message": "Summarize: x"},
+        {"message": "Classify: a"},
+        {"message": "Classify: c", "model": "tiny.gguf"},
+    ]
+    assert schedule(requests, "tiny.gguf") == [2, 3, 1, 0]
+
+def test_parse_batch_requests():
+    """Test JSON array and JSONL input, and validation errors"""
+    assert parse_batch_requests(b'[{"message": "a"}]') == [{"message": "a"}]
+    assert len(parse_batch_requests(b'{"message": "a"}\n\n{"message": "b", "custom_id": "2"}\n')) == 2
+    with pytest.raises(ValueError):
+        parse_batch_requests(b'{"mesage": "typo"}')
+    with pytest.raises(ValueError):
+        parse_batch_requests(b'{"message": "a"}\n{broken')
+
+@pytest.mark.asyncio
+async def test_batch_runs_and_streams_results(tmp_path, model_manager):
+    """Test that a job completes and its results stream back as JSONL"""
+    batches = BatchManager(model_manager, tmp_path / "batches")
+    await batches.initialize()
+    job = await batches.create_job([{"message": f"item {i}", "custom_id": str(i)} for i in range(5)])
+
+    lines = [line async for line in batches.iter_results(job["id"])]
+    results = [json.loads(line) for line in lines]
+    assert job["status"] == "completed" and job["done"] == 5
+    assert sorted(r["custom_id"] for r in results) == ["0", "1", "2", "3", "4"]
+    assert all(r["response"] == f"echo: item {r['index']}" for r in results)
+    await batches.close()
+
+@pytest.mark.asyncio
+async def test_job_ids_cannot_escape_batches_dir(tmp_path, model_manager):
+    """Test that ids other than job UUIDs (e.g. "..") are unknown jobs, not paths"""
+    (tmp_path / "job.json").write_text(json.dumps({"id": "..", "status": "completed", "created_at": ""}))
+    (tmp_path / "results.jsonl").write_text('{"secret": true}\n')
+    batches = BatchManager(model_manager, tmp_path / "batches")
+    await batches.initialize()
+    for job_id in ("..", "../batches", "not-a-uuid"):
+        assert await batches.get_job(job_id) is None
+        assert await batches.cancel_job(job_id) is False
+        assert [line async for line in batches.iter_results(job_id)] == []
+    await batches.close()
+
+@pytest.mark.asyncio
+async def test_batch_resumes_after_restart(tmp_path, model_manager):
+    """Test that a restarted job only runs requests without a result"""
+    batches = BatchManager(model_manager, tmp_path / "batches")
+    batches.batches_dir.mkdir()
+    batches.queue = asyncio.Queue()
+    job = await batches.create_job([{"message": f"item {i}"} for i in range(4)])
+    job_dir = batches.batches_dir / job["id"]
+    # Two results made it to disk, the third was cut off mid-write
+    (job_dir / "results.jsonl").write_text(
+        json.dumps({"index": 0, "response": "old", "error": False}) + "\n" +
+        json.dumps({"index": 1, "response": "old", "error": False}) + "\n" +
+        '{"index": 2, "resp'
+    )
+    # The process died, which releases its lock on the job
+    batches._release(job["id"])
+
+    restarted = BatchManager(model_manager, tmp_path / "batches")
+    await restarted.initialize()
+    resumed = await restarted.get_job(job["id"])
+    await _wait_for(resumed)
+    results = [json.loads(line) for line in (job_dir / "results.jsonl").read_text().splitlines()]
+    assert sorted(r["index"] for r in results) == [0, 1, 2, 3]
+    assert model_manager.current_model.prompts == ["item 2", "item 3"]
+    await restarted.close()
+
+@pytest.mark.asyncio
+async def test_batch_waits_for_interactive_traffic(tmp_path, model_manager):
+    """Test that batch work does not start while an interactive request holds the model"""
+    batches = BatchManager(model_manager, tmp_path / "batches")
+    await batches.initialize()
+    interactive = await batches.admission.acquire("interactive")
+    job = await batches.create_job([{"message": "nightly"}])
+    await asyncio.sleep(0.2)
+    assert job["done"] == 0
+    assert batches.admission.stats()["queue_depth"]["batch"] == 1
+
+    batches.admission.release(interactive)
+    await _wait_for(job)
+    await batches.close()
+
+@pytest.mark.asyncio
+async def test_interactive_requests_between_batch_requests_get_the_default_model(tmp_path, model_manager, monkeypatch):
+    """Test that a batch's model is swapped out for interactive requests admitted between its requests"""
+    async def load_model(name, default=True):
+        if not default and model_manager.default_model_name is None:
+            model_manager.default_model_name = model_manager.current_model_name
+        model_manager.current_model_name = name
+        if default:
+            model_manager.default_model_name = name
+        return True
+
+    monkeypatch.setattr(model_manager, "load_model", load_model)
+    batches = BatchManager(model_manager, tmp_path / "batches")
+    await batches.initialize()
+    served = []
+
+    async def interactive():
+        async with batches.admission.slot("interactive"):
+            await model_manager.use_default_model()
+            served.append(model_manager.current_model_name)
+
+    generate = model_manager.generate_response
+
+    async def generate_response(**kwargs):
+        if not served and len(model_manager.current_model.prompts) == 0:
+            # Arrives while the batch's first request holds the model
+            pending.append(asyncio.ensure_future(interactive()))
+        return await generate(**kwargs)
+
+    pending = []
+    monkeypatch.setattr(model_manager, "generate_response", generate_response)
+    job = await batches.create_job([{"message": f"item {i}", "model": "other.gguf"} for i in range(2)])
+    await _wait_for(job)
+    await asyncio.gather(*pending)
+    assert served == ["tiny.gguf"]
+    assert [r["model"] for r in map(json.loads, [line async for line in batches.iter_results(job["id"])])] == ["other.gguf"] * 2
+    assert model_manager.current_model_name == "tiny.gguf"
+    await batches.close()
+
+@pytest.mark.asyncio
+async def test_results_of_unknown_job(tmp_path, model_manager):
+    """Test that streaming results of a job that doesn't exist ends instead of failing"""
+    batches = BatchManager(model_manager, tmp_path / "batches")
+    await batches.initialize()
+    assert [line async for line in batches.iter_results("00000000-0000-4000-8000-000000000000")] == []
+    await batches.close()
+
+@pytest.mark.asyncio
+async def test_batch_runs_in_one_worker_only(tmp_path, model_manager):
+    """Test that workers sharing a batches directory don't run the same job twice"""
+    release = threading.Event()
+
+    class _BlockingLlama(_EchoLlama):
+        def create_chat_completion(self, messages, **kwargs):
+            release.wait(5)
+            return super().create_chat_completion(messages, **kwargs)
+
+    model_manager.current_model = _BlockingLlama()
+    owner = BatchManager(model_manager, tmp_path / "batches")
+    await owner.initialize()
+    job = await owner.create_job([{"message": f"item {i}"} for i in range(3)])
+
+    other_model = ModelManager()
+    other_model.current_model = _EchoLlama()
+    other = BatchManager(other_model, tmp_path / "batches")
+    await other.initialize()
+    await asyncio.sleep(0.1)
+    # Seen from the other worker, but not resumed there
+    assert (await other.get_job(job["id"]))["status"] == "running"
+    assert [j["id"] for j in await other.list_jobs()] == [job["id"]]
+
+    assert await other.cancel_job(job["id"])
+    release.set()
+    await _wait_for(job, "cancelled")
+    assert job["done"] == 1
+    assert other_model.current_model.prompts == []
+    await owner.close()
+    await other.close()
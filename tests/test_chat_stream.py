@@ -0,0 +1,99 @@
+import asyncio
+import json
+import httpx
+import pytest
+import pytest_asyncio
+from backend.app import main
+from backend.app.services.conversation_manager import ConversationManager
+from backend.app.services.streaming import with_keepalive
+from tests.test_model_manager import _StreamingLlama
+
+@pytest_asyncio.fixture
+async def client(tmp_path, monkeypatch):
+    manager = ConversationManager(tmp_path / "conversations")
+    await manager.initialize()
+    # Services created here are put back to what they were after the test
+    for name in main.SERVICE_FACTORIES:
+        monkeypatch.setattr(main, name, getattr(main, name))
+    monkeypatch.setattr(main, "conversation_manager", manager)
+    main.create_services()
+    monkeypatch.setattr(main.model_manager, "current_model", _StreamingLlama(["Stream", "ed", " reply"]))
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        yield client
+    await manager.close()
+
+def parse_events(body: str):
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n") if not line.startswith(":"))
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+@pytest.mark.asyncio
+async def test_chat_stream_sse(client):
+    """Test that stream: true returns start, delta and done events and saves the reply"""
+    response = await client.post("/api/chat", json={"message": "hello", "stream": True})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = parse_events(response.text)
+    assert [name for name, _ in events] == ["start", "delta", "delta", "delta", "done"]
+    conversation_id = events[0][1]["conversation_id"]
+    done = events[-1][1]
+    assert done["response"] == "Streamed reply"
+    assert "ttft_ms" in done["timing"]
+
+    conversation = (await client.get(f"/api/conversations/{conversation_id}")).json()
+    assert [m["content"] for m in conversation["messages"]] == ["hello", "Streamed reply"]
+
+@pytest.mark.asyncio
+async def test_keepalive_during_silence():
+    """Test that a slow source is padded with keep-alives"""
+    async def slow():
+        await asyncio.sleep(0.25)
+        yield "token"
+
+    frames = [frame async for frame in with_keepalive(slow(), 0.05)]
+    assert frames[-1] == "token"
+    assert frames.count(None) >= 2
+
+@pytest.mark.asyncio
+async def test_chat_overloaded_returns_503(client, monkeypatch):
+    """Test that a request that can't start before its deadline gets 503 + Retry-After"""
+    from backend.app.services.admission import AdmissionController
+
+    admission = AdmissionController(max_concurrent=1)
+    monkeypatch.setattr(main, "admission", admission)
+    busy = await admission.acquire("batch")
+    admission.service_time = 45.0
+
+    response = await client.post("/api/chat", json={"message": "hello"})
+    assert response.status_code == 503
+    assert int(response.headers["retry-after"]) >= 45
+    assert (await client.get("/api/conversations")).json()["conversations"] == []
+    admission.release(busy)
+
+@pytest.mark.asyncio
+async def test_shed_or_failed_request_leaves_no_user_turn(client, monkeypatch):
+    """Test that a turn is only recorded with its reply, so shed or failed requests can be retried cleanly"""
+    from backend.app.services.admission import AdmissionController
+
+    first = (await client.post("/api/chat", json={"message": "hello"})).json()
+    conversation_id = first["conversation_id"]
+
+    admission = AdmissionController(max_concurrent=1, deadlines={"interactive": 0.1})
+    monkeypatch.setattr(main, "admission", admission)
+    busy = await admission.acquire("batch")
+    shed = await client.post("/api/chat", json={"message": "again", "conversation_id": conversation_id})
+    assert shed.status_code == 503
+    admission.release(busy)
+
+    def fail(*args, **kwargs):
+        raise RuntimeError("model crashed")
+    monkeypatch.setattr(main.model_manager.current_model, "create_chat_completion", fail)
+    failed = (await client.post("/api/chat", json={"message": "again", "conversation_id": conversation_id})).json()
+    assert failed["error"] is True
+
+    conversation = (await client.get(f"/api/conversations/{conversation_id}")).json()
+    assert [m["content"] for m in conversation["messages"]] == ["hello", "Streamed reply"]
+    assert len((await client.get("/api/conversations")).json()["conversations"]) == 1
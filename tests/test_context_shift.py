@@ -0,0 +1,114 @@
+import pytest
+from backend.app.services.context_shift import CONTEXT_SHIFT_SAVED_TOKENS, ContextShifter, ContextShiftPolicy
+from backend.app.services.conversation_store import message_prefix_hash
+from backend.app.services.model_manager import ModelManager
+
+def _turns(count, words=10):
+    messages = [{"role": "system", "content": "be brief"}]
+    for i in range(count):
+        messages.append({"role": "user", "content": " ".join([f"q{i}"] * words)})
+        messages.append({"role": "assistant", "content": " ".join([f"a{i}"] * words)})
+    return messages
+
+def _words(message):
+    return len(message["content"].split())
+
+def test_window_keeps_pinned_and_drops_whole_turns():
+    """Test that the oldest turns go first, at user-message boundaries, with room to spare"""
+    policy = ContextShiftPolicy(n_ctx=100, discard=0.5, reserve=10)
+    messages = _turns(6) + [{"role": "user", "content": "new"}]
+    # 1 (system) + 12 * 10 + 1 (new) words, budget 100 - 10 - 1 = 89, target 44.5
+    start = policy.window(messages, _words, max_tokens=64)
+    assert messages[start]["role"] == "user"
+    assert sum(_words(m) for m in messages[start:]) <= 44.5
+    assert start == 9
+
+    # Everything fits: nothing dropped, and a previous window is kept as is
+    assert policy.window(_turns(2) + [{"role": "user", "content": "new"}], _words, 64) == 1
+    assert policy.window(messages[:5] + messages[-1:], _words, 64, start=3) == 3
+
+    # keep_messages pins the first turns as well as the system message
+    pinned = ContextShiftPolicy(n_ctx=100, keep_messages=2, reserve=10)
+    assert pinned.pinned(messages) == 3
+    assert pinned.window(messages, _words, 64) >= 3
+
+def test_plan_finds_where_the_prompt_resumes():
+    """Test the shift that turns the trimmed prompt back into a prefix match"""
+    policy = ContextShiftPolicy(min_reuse=4)
+    cached = [1, 2, 3] + [10, 11, 12, 13] + list(range(20, 40)) + [99]
+    prompt = [1, 2, 3] + list(range(20, 40)) + [50, 51]
+    shift = policy.plan(cached, prompt)
+    assert (shift.keep, shift.discard, shift.reused) == (3, 4, 20)
+
+    assert policy.plan(cached, [1, 2, 3, 70, 71, 72, 73]) is None
+    assert policy.plan(cached, [1, 2, 3, 20]) is None
+
+class _KVLlama:
+    """Stands in for llama_cpp.Llama: tokens in a KV cache, prefix reuse and the sequence operations"""
+
+    def __init__(self, n_ctx):
+        self.input_ids = [0] * n_ctx
+        self.n_tokens = 0
+        self.n_ctx = n_ctx
+        self.evaluated = []
+        self.operations = []
+        self.vocab = {}
+        self._ctx = self
+
+    def kv_cache_seq_rm(self, seq_id, p0, p1):
+        self.operations.append(("rm", p0, p1))
+
+    def kv_cache_seq_shift(self, seq_id, p0, p1, delta):
+        self.operations.append(("add", p0, p1, delta))
+
+    def tokenize(self, text, add_bos=True, special=False):
+        return [self.vocab.setdefault(word, len(self.vocab) + 1) for word in text.decode().split()]
+
+    def generate(self, tokens, reset=True):
+        # Reuse the longest cached prefix, as llama-cpp-python does
+        prefix = 0
+        for cached, token in zip(self.input_ids[:self.n_tokens], tokens[:-1]):
+            if cached != token:
+                break
+            prefix += 1
+        self.evaluated.append(len(tokens) - prefix)
+        self.input_ids[:len(tokens)] = tokens
+        self.n_tokens = len(tokens)
+        for token in self.tokenize(b"fine thanks"):
+            self.input_ids[self.n_tokens] = token
+            self.n_tokens += 1
+            yield token
+
+    def create_chat_completion(self, messages, stream=False, max_tokens=16, **kwargs):
+        text = " ".join(f"<{m['role']}> {m['content']}" for m in messages) + " <assistant>"
+        tokens = self.tokenize(text.encode())
+        assert len(tokens) + max_tokens <= self.n_ctx, "context window exceeded"
+        self.sent = messages
+        list(self.generate(tokens))
+        return {"choices": [{"message": {"content": "fine thanks"}}]}
+
+@pytest.mark.asyncio
+async def test_long_conversation_shifts_instead_of_prefilling():
+    """Test that a conversation past n_ctx keeps its pinned prefix and only evaluates the new turn"""
+    manager = ModelManager()
+    manager.context_policy = ContextShiftPolicy(n_ctx=400, discard=0.5, reserve=16)
+    model = manager.current_model = _KVLlama(400)
+    manager.context_shifter = ContextShifter.attach(model, manager.context_policy)
+    saved = CONTEXT_SHIFT_SAVED_TOKENS.labels().value
+
+    history, key = [{"role": "system", "content": "pinned instructions"}], None
+    for turn in range(30):
+        message = " ".join([f"w{turn}"] * 20)
+        result = await manager.generate_response(message, history=history, max_tokens=16)
+        assert not result.get("error"), result
+        for role, content in (("user", message), ("assistant", result["response"])):
+            key = message_prefix_hash(key, role, content)
+            history = history + [{"role": role, "content": content, "prefix_hash": key}]
+
+    shifts = [op for op in model.operations if op[0] == "rm"]
+    assert shifts, "the conversation never outgrew the window"
+    assert all(op[1] == 4 for op in shifts)  # "<system> pinned instructions <user>" stays in place
+    assert model.sent[0]["content"] == "pinned instructions"
+    # Every turn, including the ones that shifted, evaluated only its new tokens
+    assert max(model.evaluated[1:]) <= 25
+    assert CONTEXT_SHIFT_SAVED_TOKENS.labels().value > saved
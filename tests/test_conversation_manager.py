@@ -0,0 +1,339 @@
+import json
+import sqlite3
+import pytest
+import pytest_asyncio
+from backend.app.services.conversation_manager import ConversationManager
+from backend.app.services.conversation_store import make_snippet
+from backend.app.services.persistence import WriteBehindError
+
+@pytest_asyncio.fixture
+async def conversation_manager(tmp_path):
+    manager = ConversationManager(tmp_path / "conversations")
+    await manager.initialize()
+    yield manager
+    await manager.close()
+
+@pytest.mark.asyncio
+async def test_messages_persist_across_restart(tmp_path, conversation_manager):
+    """Test that appended messages survive reopening the store"""
+    conversation = await conversation_manager.create_conversation(title="Test")
+    await conversation_manager.add_message(conversation["id"], "user", "Hello")
+    await conversation_manager.add_message(conversation["id"], "assistant", "Hi there", model="tiny.gguf")
+    await conversation_manager.close()
+
+    reopened = ConversationManager(tmp_path / "conversations")
+    await reopened.initialize()
+    assert (await reopened.get_summary(conversation["id"]))["message_count"] == 2
+
+    loaded = await reopened.get_conversation(conversation["id"])
+    assert [m["content"] for m in loaded["messages"]] == ["Hello", "Hi there"]
+    assert loaded["messages"][1]["model"] == "tiny.gguf"
+    await reopened.close()
+
+@pytest.mark.asyncio
+async def test_branch_conversation(conversation_manager):
+    """Test branching keeps the messages before the branch point"""
+    conversation = await conversation_manager.create_conversation(title="Original")
+    for i in range(4):
+        await conversation_manager.add_message(conversation["id"], "user", f"message {i}")
+
+    branch = await conversation_manager.branch_conversation(conversation["id"], 2)
+    assert branch["parent_id"] == conversation["id"]
+    messages = await conversation_manager.get_messages(branch["id"])
+    assert [m["content"] for m in messages] == ["message 0", "message 1"]
+
+@pytest.mark.asyncio
+async def test_delete_conversation(conversation_manager):
+    """Test deleting a conversation removes it from the index"""
+    conversation = await conversation_manager.create_conversation()
+    assert await conversation_manager.delete_conversation(conversation["id"])
+    assert await conversation_manager.get_conversation(conversation["id"]) is None
+    assert not await conversation_manager.delete_conversation(conversation["id"])
+
+@pytest.mark.asyncio
+async def test_legacy_json_import(tmp_path):
+    """Test that one-file-per-conversation JSON is imported on startup"""
+    conversations_dir = tmp_path / "conversations"
+    conversations_dir.mkdir()
+    legacy = {
+        "id": "legacy-1",
+        "title": "Old chat",
+        "created_at": "2024-01-01T00:00:00",
+        "messages": [{"role": "user", "content": "from disk"}]
+    }
+    (conversations_dir / "legacy-1.json").write_text(json.dumps(legacy))
+
+    manager = ConversationManager(conversations_dir)
+    await manager.initialize()
+    loaded = await manager.get_conversation("legacy-1")
+    assert loaded["messages"][0]["content"] == "from disk"
+    assert not (conversations_dir / "legacy-1.json").exists()
+    await manager.close()
+
+@pytest.mark.asyncio
+async def test_branch_shares_prefix(conversation_manager):
+    """Test that branching creates a head pointer instead of copying messages"""
+    conversation = await conversation_manager.create_conversation(title="Original")
+    for i in range(3):
+        await conversation_manager.add_message(conversation["id"], "user", f"message {i}")
+    store = conversation_manager.store
+    await conversation_manager.flush()
+    before = store._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    branch = await conversation_manager.branch_conversation(conversation["id"], 2)
+    await conversation_manager.flush()
+    assert store._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0] == before
+
+    reply = await conversation_manager.add_message(branch["id"], "user", "diverged")
+    original = await conversation_manager.get_messages(conversation["id"])
+    branched = await conversation_manager.get_messages(branch["id"])
+    assert [m["id"] for m in branched[:2]] == [m["id"] for m in original[:2]]
+    assert branched[-1]["parent_id"] == original[1]["id"]
+    assert reply["depth"] == 2
+
+@pytest.mark.asyncio
+async def test_delete_keeps_prefix_used_by_branch(conversation_manager):
+    """Test deleting the original conversation keeps messages a branch still needs"""
+    conversation = await conversation_manager.create_conversation(title="Original")
+    for i in range(4):
+        await conversation_manager.add_message(conversation["id"], "user", f"message {i}")
+    branch = await conversation_manager.branch_conversation(conversation["id"], 2)
+
+    await conversation_manager.delete_conversation(conversation["id"])
+    messages = await conversation_manager.get_messages(branch["id"])
+    assert [m["content"] for m in messages] == ["message 0", "message 1"]
+    count = conversation_manager.store._conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+    assert count == 2
+
+@pytest.mark.asyncio
+async def test_prefix_hash_identifies_identical_prefixes(conversation_manager):
+    """Test that identical conversation prefixes get the same prefix hash"""
+    first = await conversation_manager.create_conversation()
+    second = await conversation_manager.create_conversation()
+    a = await conversation_manager.add_message(first["id"], "user", "same")
+    b = await conversation_manager.add_message(second["id"], "user", "same")
+    c = await conversation_manager.add_message(second["id"], "assistant", "reply")
+    assert a["prefix_hash"] == b["prefix_hash"]
+    assert c["prefix_hash"] != b["prefix_hash"]
+
+@pytest.mark.asyncio
+async def test_flat_schema_is_migrated(tmp_path):
+    """Test that a store written with the flat per-conversation schema is upgraded"""
+    conversations_dir = tmp_path / "conversations"
+    conversations_dir.mkdir()
+    conn = sqlite3.connect(str(conversations_dir / "conversations.db"))
+    conn.executescript("""
+        CREATE TABLE conversations (id TEXT PRIMARY KEY, title TEXT, created_at TEXT, updated_at TEXT,
+                                    parent_id TEXT, branch_point INTEGER, message_count INTEGER);
+        CREATE TABLE messages (conversation_id TEXT, seq INTEGER, role TEXT, content TEXT,
+                               created_at TEXT, model TEXT, PRIMARY KEY (conversation_id, seq));
+        INSERT INTO conversations VALUES ('c1', 'Old', '2024-01-01', '2024-01-01', NULL, NULL, 2);
+        INSERT INTO messages VALUES ('c1', 0, 'user', 'question', '2024-01-01', NULL);
+        INSERT INTO messages VALUES ('c1', 1, 'assistant', 'answer', '2024-01-01', 'tiny.gguf');
+    """)
+    conn.close()
+
+    manager = ConversationManager(conversations_dir)
+    await manager.initialize()
+    messages = await manager.get_messages("c1")
+    assert [m["content"] for m in messages] == ["question", "answer"]
+    assert (await manager.get_summary("c1"))["message_count"] == 2
+    await manager.close()
+
+@pytest.mark.asyncio
+async def test_list_conversations_paginates(conversation_manager):
+    """Test cursor pagination walks every conversation exactly once"""
+    created = [await conversation_manager.create_conversation(title=f"Chat {i}") for i in range(7)]
+
+    seen, cursor = [], None
+    while True:
+        page = await conversation_manager.list_conversations(limit=3, cursor=cursor, sort="title", order="asc")
+        assert "messages" not in page["conversations"][0]
+        seen.extend(c["title"] for c in page["conversations"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == sorted(c["title"] for c in created)
+
+@pytest.mark.asyncio
+async def test_message_range(conversation_manager):
+    """Test fetching a range of messages from a cold conversation"""
+    conversation = await conversation_manager.create_conversation()
+    for i in range(6):
+        await conversation_manager.add_message(conversation["id"], "user", f"message {i}")
+    conversation_manager.cache.clear()
+
+    messages = await conversation_manager.get_messages(conversation["id"], offset=2, limit=3)
+    assert [m["content"] for m in messages] == ["message 2", "message 3", "message 4"]
+    assert conversation["id"] not in conversation_manager.cache
+
+@pytest.mark.asyncio
+async def test_hydration_cache_is_bounded(tmp_path):
+    """Test that only the most recently used conversations stay hydrated"""
+    manager = ConversationManager(tmp_path / "conversations", cache_size=2)
+    await manager.initialize()
+    ids = [(await manager.create_conversation())["id"] for _ in range(3)]
+    manager.cache.clear()
+
+    for conversation_id in ids:
+        await manager.get_conversation(conversation_id)
+    assert list(manager.cache) == ids[1:]
+
+    await manager.get_conversation(ids[1])
+    assert manager.cache_hits == 1
+    assert list(manager.cache) == [ids[2], ids[1]]
+    await manager.close()
+
+def test_snippet_escapes_message_text():
+    """Test that only the hit markers in a snippet are markup"""
+    snippet = make_snippet("<script>alert('pasta')</script> & O'Brien's pasta", "pasta o'brien's")
+    assert snippet == ("&lt;script&gt;alert(&#x27;<mark>pasta</mark>&#x27;)&lt;/script&gt; &amp; "
+                       "<mark>O&#x27;Brien&#x27;s</mark> <mark>pasta</mark>")
+
+@pytest.mark.asyncio
+async def test_search_ranks_and_filters(conversation_manager):
+    """Test BM25 search, prefix queries and the model/branch filters"""
+    first = await conversation_manager.create_conversation(title="Cooking")
+    await conversation_manager.add_message(first["id"], "user", "How long should pasta boil?")
+    await conversation_manager.add_message(first["id"], "assistant", "Boil pasta for ten minutes, pasta loves salt", model="tiny.gguf")
+    second = await conversation_manager.create_conversation(title="Travel")
+    await conversation_manager.add_message(second["id"], "user", "Best pasta in Rome?")
+
+    results = await conversation_manager.search("pasta")
+    assert len(results) == 3
+    assert results[0]["snippet"].count("<mark>") == 2
+
+    assert len(await conversation_manager.search("boi*")) == 2
+    assert [r["title"] for r in await conversation_manager.search("pasta", model="tiny.gguf")] == ["Cooking"]
+    assert [r["conversation_id"] for r in await conversation_manager.search("pasta", conversation_id=second["id"])] == [second["id"]]
+
+    await conversation_manager.delete_conversation(first["id"])
+    assert len(await conversation_manager.search("pasta")) == 1
+
+@pytest.mark.asyncio
+async def test_search_ranks_across_all_messages(conversation_manager):
+    """Test that an old strong match outranks newer weak ones, with paging and the opt-in recent window"""
+    old = await conversation_manager.create_conversation(title="Old")
+    await conversation_manager.add_message(old["id"], "user", "pasta pasta pasta")
+    new = await conversation_manager.create_conversation(title="New")
+    for i in range(30):
+        await conversation_manager.add_message(new["id"], "user", f"message {i} about travel plans, trains, hotels and maybe pasta")
+
+    results = await conversation_manager.search("pasta", limit=5)
+    assert results[0]["conversation_id"] == old["id"]
+    pages = [r["id"] for offset in range(0, 31, 5) for r in await conversation_manager.search("pasta", limit=5, offset=offset)]
+    assert len(pages) == len(set(pages)) == 31
+
+    recent = await conversation_manager.search("pasta", limit=5, recent=10)
+    assert len(recent) == 5 and old["id"] not in [r["conversation_id"] for r in recent]
+
+@pytest.mark.asyncio
+async def test_search_includes_shared_branch_prefix(conversation_manager):
+    """Test that a branch filter also finds messages the branch shares with its parent"""
+    conversation = await conversation_manager.create_conversation()
+    await conversation_manager.add_message(conversation["id"], "user", "shared question about llamas")
+    await conversation_manager.add_message(conversation["id"], "assistant", "original answer")
+    branch = await conversation_manager.branch_conversation(conversation["id"], 1)
+    await conversation_manager.add_message(branch["id"], "assistant", "alternative answer")
+
+    assert len(await conversation_manager.search("llamas", conversation_id=branch["id"])) == 1
+    assert len(await conversation_manager.search("original", conversation_id=branch["id"])) == 0
+
+@pytest.mark.asyncio
+async def test_writes_are_coalesced(tmp_path):
+    """Test that a burst of appends is committed as one batch with one head update"""
+    applied = []
+    manager = ConversationManager(tmp_path / "conversations", write_window=60)
+    await manager.initialize()
+    apply = manager.store.apply
+    manager.writes.apply_batch = lambda batch: (applied.append(batch), apply(batch))
+
+    conversation = await manager.create_conversation()
+    for i in range(5):
+        await manager.add_message(conversation["id"], "user", f"message {i}")
+    assert manager.store.get_conversation(conversation["id"]) is None
+
+    await manager.flush()
+    assert [[kind for kind, _ in batch] for batch in applied] == [["conversation"] + ["message"] * 5 + ["head"]]
+    assert manager.writes.coalesced == 4
+    assert manager.store.get_conversation(conversation["id"])["message_count"] == 5
+    await manager.close()
+
+@pytest.mark.asyncio
+async def test_failed_write_is_isolated_and_raised(tmp_path):
+    """Test that one failing write doesn't drop the rest of its batch and is raised by the next flush"""
+    manager = ConversationManager(tmp_path / "conversations", write_window=60)
+    await manager.initialize()
+    original = await manager.create_conversation(title="Original", conversation_id="chosen-id")
+    await manager.flush()
+
+    other = await manager.create_conversation(title="Other")
+    await manager.add_message(other["id"], "user", "must survive")
+    # A client reusing an id: the insert fails in the same batch as the writes above
+    await manager.create_conversation(title="Duplicate", conversation_id=original["id"])
+    with pytest.raises(WriteBehindError) as raised:
+        await manager.flush()
+    assert [(write[0], write[1]["title"]) for write, _ in raised.value.failures] == [("conversation", "Duplicate")]
+    assert manager.store.get_conversation(other["id"])["message_count"] == 1
+    # The unsaved copy is no longer served from the cache
+    assert (await manager.get_summary(original["id"]))["title"] == "Original"
+    await manager.flush()
+    await manager.close()
+
+@pytest.mark.asyncio
+async def test_writes_depending_on_a_failed_insert_do_not_land(tmp_path):
+    """Test that messages and head updates for a conversation whose insert failed are not applied"""
+    manager = ConversationManager(tmp_path / "conversations", write_window=60)
+    await manager.initialize()
+    original = await manager.create_conversation(title="Original", conversation_id="chosen-id")
+    await manager.add_message(original["id"], "user", "first")
+    await manager.flush()
+    head = manager.store.get_conversation(original["id"])["head_id"]
+
+    other = await manager.create_conversation(title="Other")
+    await manager.add_message(other["id"], "user", "must survive")
+    await manager.create_conversation(title="Duplicate", conversation_id=original["id"])
+    await manager.add_message(original["id"], "user", "belongs to the duplicate")
+    with pytest.raises(WriteBehindError) as raised:
+        await manager.flush()
+    assert sorted(write[0] for write, _ in raised.value.failures) == ["conversation", "head", "message"]
+
+    stored = manager.store.get_conversation(original["id"])
+    assert (stored["title"], stored["message_count"], stored["head_id"]) == ("Original", 1, head)
+    assert [m["content"] for m in await manager.get_messages(original["id"])] == ["first"]
+    assert manager.store.get_conversation(other["id"])["message_count"] == 1
+    await manager.close()
+
+@pytest.mark.asyncio
+async def test_pending_writes_are_visible_and_flushed_on_close(tmp_path):
+    """Test that reads see queued writes and close() makes them durable"""
+    manager = ConversationManager(tmp_path / "conversations", fsync_policy="always", write_window=60)
+    await manager.initialize()
+    conversation = await manager.create_conversation(title="Pending")
+    await manager.add_message(conversation["id"], "user", "not yet on disk")
+
+    page = await manager.list_conversations()
+    assert [c["message_count"] for c in page["conversations"]] == [1]
+    await manager.add_message(conversation["id"], "assistant", "queued at shutdown")
+    await manager.close()
+
+    reopened = ConversationManager(tmp_path / "conversations")
+    await reopened.initialize()
+    messages = await reopened.get_messages(conversation["id"])
+    assert [m["content"] for m in messages] == ["not yet on disk", "queued at shutdown"]
+    await reopened.close()
+
+def test_unknown_fsync_policy():
+    """Test that a misspelled fsync policy is rejected up front"""
+    with pytest.raises(ValueError):
+        ConversationManager(fsync_policy="sometimes")
+
+def test_build_match_query():
+    """Test query parsing: quoting, prefix terms and stop words"""
+    from backend.app.services.conversation_store import build_match_query
+
+    assert build_match_query('deploy* "config"') == '"deploy"* "config"'
+    assert build_match_query("how to boil the pasta") == '"boil" "pasta"'
+    assert build_match_query("the") == '"the"'
+    with pytest.raises(ValueError):
+        build_match_query("  ?! ")
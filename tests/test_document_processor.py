@@ -1,4 +1,5 @@
 import pytest
+import random
 from fastapi import UploadFile
 from io import BytesIO
 from backend.app.services.document_processor import DocumentProcessor
@@ -24,3 +25,131 @@ async def test_unsupported_format(document_processor):
     
     with pytest.raises(ValueError):
         await document_processor.process_file(file)
+
+def _upload(name, content):
+    return UploadFile(filename=name, file=BytesIO(content))
+
+_WORDS = ("supplier buyer deliver goods invoice payment term notice party agreement warranty defect "
+          "liability damages insurance shipment inspection acceptance price currency tax audit record "
+          "confidential dispute court law force majeure termination renewal period month year").split()
+
+def _paragraphs(count, changed=None):
+    paragraphs = []
+    for i in range(count):
+        words = random.Random(i).choices(_WORDS, k=60)
+        if i == changed:
+            words[30] = "amended"
+        paragraphs.append(f"Clause {i}. " + " ".join(words) + ".")
+    return "\n\n".join(paragraphs)
+
+@pytest.mark.asyncio
+async def test_revised_upload_reuses_unchanged_paragraphs(tmp_path):
+    """Test that a revised text file is recognised paragraph by paragraph, with its dedup ratio"""
+    processor = DocumentProcessor(tmp_path)
+    first = await processor.ingest(_upload("contract.txt", _paragraphs(20).encode()))
+    assert first["report"]["new"] == 20 and first["report"]["dedup_ratio"] == 0
+
+    revised = _paragraphs(20, changed=7) + "\n\nClause 20. An entirely new termination clause was added here."
+    second = await processor.ingest(_upload("contract-v2.txt", revised.encode()))
+    report = second["report"]
+    assert second["text"] == revised
+    assert (report["unchanged"], report["near_duplicate"], report["new"]) == (19, 1, 1)
+    assert 0.85 < report["dedup_ratio"] < 1
+    assert report["previous_version"]["document_id"] == first["report"]["document_id"]
+    near = [d for d in report["segment_details"] if d["status"] == "near_duplicate"][0]
+    assert near["similar_to"] == first["report"]["segment_details"][7]["hash"]
+
+    await processor.close()
+
+@pytest.mark.asyncio
+async def test_paragraph_repeated_within_an_upload_is_not_reused(tmp_path):
+    """Test that repeating a paragraph inside a new document doesn't count as reusing earlier uploads"""
+    processor = DocumentProcessor(tmp_path)
+    await processor.ingest(_upload("terms.txt", _paragraphs(3).encode()))
+
+    paragraphs = _paragraphs(6).split("\n\n")[3:]
+    repeated = "\n\n".join(paragraphs + [paragraphs[0], paragraphs[0]])
+    report = (await processor.ingest(_upload("other.txt", repeated.encode())))["report"]
+    assert [d["status"] for d in report["segment_details"]] == ["new"] * 5
+    assert report["dedup_ratio"] == 0 and report["previous_version"] is None
+
+    again = (await processor.ingest(_upload("other-v2.txt", repeated.encode())))["report"]
+    assert (again["unchanged"], again["dedup_ratio"]) == (5, 1)
+    await processor.close()
+
+def _pdf(pages, font="Helvetica"):
+    from PyPDF2 import PageObject, PdfWriter
+    from PyPDF2.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    writer = PdfWriter()
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/" + font),
+    })
+    for text in pages:
+        page = PageObject.create_blank_page(None, 612, 792)
+        page[NameObject("/Resources")] = DictionaryObject({NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})})
+        stream = DecodedStreamObject()
+        stream.set_data(f"BT /F1 12 Tf 72 712 Td ({text}) Tj ET".encode())
+        page[NameObject("/Contents")] = stream
+        writer.add_page(page)
+    output = BytesIO()
+    writer.write(output)
+    return output.getvalue()
+
+@pytest.mark.asyncio
+async def test_unchanged_pdf_pages_are_not_extracted_again(tmp_path, monkeypatch):
+    """Test that only changed pages of a re-uploaded PDF go through text extraction"""
+    PyPDF2 = pytest.importorskip("PyPDF2")
+    extracted = []
+    extract_text = PyPDF2.PageObject.extract_text
+    monkeypatch.setattr(PyPDF2.PageObject, "extract_text", lambda page, *a, **k: extracted.append(1) or extract_text(page, *a, **k))
+
+    processor = DocumentProcessor(tmp_path)
+    pages = [f"Page {i} of the operating manual for pump model {i * 7}" for i in range(5)]
+    first = await processor.ingest(_upload("manual.pdf", _pdf(pages)))
+    assert "Page 3 of the operating manual" in first["text"] and len(extracted) == 5
+
+    pages[2] = "Page 2 was rewritten completely for the new release"
+    second = await processor.ingest(_upload("manual.pdf", _pdf(pages)))
+    assert len(extracted) == 6
+    assert second["report"]["extractions_skipped"] == 4
+    assert second["text"].split("\n") == [line.strip() for line in pages]
+    await processor.close()
+
+@pytest.mark.asyncio
+async def test_pdf_page_with_other_fonts_is_extracted_again(tmp_path, monkeypatch):
+    """Test that the same content stream under different font resources isn't served from the index"""
+    PyPDF2 = pytest.importorskip("PyPDF2")
+    extracted = []
+    extract_text = PyPDF2.PageObject.extract_text
+    monkeypatch.setattr(PyPDF2.PageObject, "extract_text", lambda page, *a, **k: extracted.append(1) or extract_text(page, *a, **k))
+
+    processor = DocumentProcessor(tmp_path)
+    pages = ["Same drawing operators on every page"]
+    await processor.ingest(_upload("a.pdf", _pdf(pages)))
+    second = await processor.ingest(_upload("b.pdf", _pdf(pages, font="Courier")))
+    assert len(extracted) == 2 and second["report"]["extractions_skipped"] == 0
+    await processor.close()
+
+@pytest.mark.asyncio
+async def test_removed_and_expired_documents_leave_the_index(tmp_path):
+    """Test that deleting a document drops the text only it held, and that the index is bounded"""
+    processor = DocumentProcessor(tmp_path)
+    first = (await processor.ingest(_upload("a.txt", _paragraphs(3).encode())))["report"]
+    shared = (await processor.ingest(_upload("b.txt", _paragraphs(2).encode())))["report"]
+    assert await processor.remove_document(first["document_id"])
+    assert not await processor.remove_document(first["document_id"])
+
+    # Paragraphs 0 and 1 are still held by the second document; paragraph 2 is gone
+    again = (await processor.ingest(_upload("c.txt", _paragraphs(3).encode())))["report"]
+    assert [d["status"] for d in again["segment_details"]] == ["unchanged", "unchanged", "new"]
+
+    processor.index.max_documents = 1
+    await processor.ingest(_upload("d.txt", b"Something else entirely, with no earlier paragraphs in common."))
+    conn = processor.index._connection()
+    assert conn.execute("SELECT COUNT(*) FROM documents").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(*) FROM segments").fetchone()[0] == 1
+    assert conn.execute("SELECT COUNT(DISTINCT hash) FROM lsh").fetchone()[0] == 1
+    await processor.close()
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import urllib.error
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from models import download_models
+from models.download_models import DownloadError, download_model, main, read_index
+
+CHUNK = 64 * 1024
+PAYLOAD = os.urandom(5 * CHUNK + 1234)
+SHA256 = hashlib.sha256(PAYLOAD).hexdigest()
+
+class _Server:
+    """Serves PAYLOAD at /model.gguf, with byte ranges unless `ranges` is off.
+
+    `failures` maps range start offsets to how many of their responses are
+    cut off halfway, as a dropped connection would.
+    """
+
+    def __init__(self):
+        self.ranges = True
+        self.failures = {}
+        self.requests = []
+        self.bytes_sent = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                header = self.headers.get("Range")
+                server.requests.append(header)
+                match = re.match(r"bytes=(\d+)-(\d+)", header or "")
+                if match and server.ranges:
+                    start, end = int(match.group(1)), min(int(match.group(2)), len(PAYLOAD) - 1)
+                    body = PAYLOAD[start:end + 1]
+                    self.send_response(206)
+                    self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+                else:
+                    start, body = 0, PAYLOAD
+                    self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("ETag", '"v1"')
+                self.end_headers()
+                if server.failures.get(start):
+                    server.failures[start] -= 1
+                    body = body[:len(body) // 2]
+                self.wfile.write(body)
+                server.bytes_sent += len(body)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/model.gguf"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def server(monkeypatch):
+    monkeypatch.setattr(download_models, "RETRIES", 2)
+    monkeypatch.setattr(download_models.time, "sleep", lambda seconds: None)
+    server = _Server()
+    yield server
+    server.close()
+
+def _model(server, sha256=SHA256):
+    return {"name": "Test", "url": server.url, "filename": "model.gguf", "sha256": sha256}
+
+def test_parallel_download_verifies_and_registers(tmp_path, server):
+    """Test a chunked parallel download: verified, moved into place, registered, partials removed"""
+    path = download_model(_model(server), tmp_path, workers=3, chunk_size=CHUNK, quiet=True)
+    assert path.read_bytes() == PAYLOAD
+    assert sum(1 for r in server.requests if r and r != "bytes=0-0") == 6
+    assert list((tmp_path / ".partial").iterdir()) == []
+
+    entry = read_index(tmp_path)["model.gguf"]
+    assert entry["sha256"] == SHA256 and entry["size"] == len(PAYLOAD)
+
+    # Already present and unchanged: no further requests
+    server.requests.clear()
+    download_model(_model(server), tmp_path, workers=3, chunk_size=CHUNK, quiet=True)
+    assert server.requests == []
+
+def test_resume_fetches_only_missing_chunks(tmp_path, server):
+    """Test that an interrupted download resumes with the chunks it didn't finish"""
+    # Chunk 2 is cut off on both attempts, so the first run fails
+    server.failures = {2 * CHUNK: 2}
+    with pytest.raises(DownloadError):
+        download_model(_model(server), tmp_path, workers=2, chunk_size=CHUNK, quiet=True)
+    assert not (tmp_path / "model.gguf").exists()
+    state = json.loads((tmp_path / ".partial" / "model.gguf.part.json").read_text())
+    assert 2 not in state["done"] and len(state["done"]) == 5
+
+    server.requests.clear()
+    download_model(_model(server), tmp_path, workers=2, chunk_size=CHUNK, quiet=True)
+    assert (tmp_path / "model.gguf").read_bytes() == PAYLOAD
+    assert [r for r in server.requests if r != "bytes=0-0"] == [f"bytes={2 * CHUNK}-{3 * CHUNK - 1}"]
+
+def test_checksum_mismatch_keeps_nothing(tmp_path, server):
+    """Test that a file failing verification is neither moved into place nor kept"""
+    with pytest.raises(DownloadError, match="Checksum mismatch"):
+        download_model(_model(server, sha256="0" * 64), tmp_path, chunk_size=CHUNK, quiet=True)
+    assert not (tmp_path / "model.gguf").exists()
+    assert list((tmp_path / ".partial").iterdir()) == []
+    assert read_index(tmp_path) == {}
+
+def test_truncated_file_is_downloaded_again(tmp_path, server):
+    """Test that an existing but truncated file is not accepted"""
+    (tmp_path / "model.gguf").write_bytes(PAYLOAD[:1000])
+    download_model(_model(server, sha256=None), tmp_path, chunk_size=CHUNK, quiet=True)
+    assert (tmp_path / "model.gguf").read_bytes() == PAYLOAD
+    assert read_index(tmp_path)["model.gguf"]["sha256"] == SHA256
+
+@pytest.mark.parametrize("probe_result", [None, {"size": None, "sha256": None}])
+def test_unverifiable_file_is_not_accepted(tmp_path, monkeypatch, probe_result):
+    """Test that a leftover file is neither accepted nor registered when its size can't be confirmed"""
+    def probe(url):
+        if probe_result is None:
+            raise urllib.error.URLError("offline")
+        return probe_result
+    monkeypatch.setattr(download_models, "probe", probe)
+    (tmp_path / "model.gguf").write_bytes(PAYLOAD[:1000])
+    model = {"name": "Test", "url": "http://example.invalid/model.gguf", "filename": "model.gguf"}
+    assert not download_models._is_complete(tmp_path / "model.gguf", model, tmp_path, None)
+    assert read_index(tmp_path) == {}
+
+def test_server_without_ranges(tmp_path, server):
+    """Test the single-stream fallback, retried after a dropped connection"""
+    server.ranges = False
+    server.failures = {0: 1}
+    download_model(_model(server), tmp_path, chunk_size=CHUNK, quiet=True)
+    assert (tmp_path / "model.gguf").read_bytes() == PAYLOAD
+
+def test_checksum_mismatch_without_ranges(tmp_path, server):
+    """Test that a mismatch from a single-stream download is reported as such"""
+    server.ranges = False
+    with pytest.raises(DownloadError, match="Checksum mismatch"):
+        download_model(_model(server, sha256="0" * 64), tmp_path, chunk_size=CHUNK, quiet=True)
+    assert list((tmp_path / ".partial").iterdir()) == []
+
+def test_batch_mode(tmp_path, server):
+    """Test non-interactive provisioning from a manifest, and its exit codes"""
+    manifest = tmp_path / "manifest.json"
+    manifest.write_text(json.dumps({"models": [_model(server)]}))
+    models_dir = tmp_path / "models"
+    assert main(["--manifest", str(manifest), "--all", "--models-dir", str(models_dir), "--quiet"]) == 0
+    assert (models_dir / "model.gguf").read_bytes() == PAYLOAD
+    assert main(["--manifest", str(manifest), "--model", "missing.gguf", "--models-dir", str(models_dir)]) == 2
@@ -0,0 +1,119 @@
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import textwrap
+import threading
+import time
+import urllib.request
+from pathlib import Path
+
+import pytest
+from backend.app.launcher import event_loop_implementation, http_implementation
+
+REPO = Path(__file__).resolve().parent.parent
+
+APP = textwrap.dedent("""
+    import asyncio, os
+    PRELOADED_BY = None
+
+    async def preload():
+        global PRELOADED_BY
+        PRELOADED_BY = os.getpid()
+
+    async def app(scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": message["type"] + ".complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        if scope["path"] == "/slow":
+            await asyncio.sleep(1.0)
+        body = ('{"worker": %d, "preloaded_by": %d}' % (os.getpid(), PRELOADED_BY)).encode()
+        await send({"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]})
+        await send({"type": "http.response.body", "body": body})
+""")
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+def _get(port, path="/"):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}{path}", timeout=10) as response:
+        return json.loads(response.read())
+
+def test_implementation_choices():
+    """Test that the fast loop/parser are used only when installed"""
+    assert event_loop_implementation() in ("uvloop", "asyncio")
+    assert http_implementation() in ("httptools", "h11")
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="prefork workers need fork()")
+def test_prefork_workers_share_preload_and_drain(tmp_path):
+    """Test that workers are forked after preload and finish in-flight requests on SIGTERM"""
+    (tmp_path / "tiny_app.py").write_text(APP)
+    port = _free_port()
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(tmp_path), str(REPO)])}
+    server = subprocess.Popen(
+        [sys.executable, "-c", f"from backend.app.launcher import serve; serve('tiny_app:app', host='127.0.0.1', port={port}, workers=2)"],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    try:
+        for _ in range(100):
+            try:
+                first = _get(port)
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            pytest.fail("server did not start")
+
+        # The model was loaded once, in the supervisor, before forking
+        assert first["preloaded_by"] == server.pid
+        assert first["worker"] != server.pid
+
+        slow = {}
+        thread = threading.Thread(target=lambda: slow.update(_get(port, "/slow")))
+        thread.start()
+        time.sleep(0.3)
+        server.send_signal(signal.SIGTERM)
+        thread.join(10)
+        assert slow["preloaded_by"] == server.pid
+        assert server.wait(10) == 0
+        output = server.stdout.read()
+        assert "preload:" in output and "All workers stopped" in output
+    finally:
+        if server.poll() is None:
+            server.kill()
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="prefork workers need fork()")
+def test_single_worker_when_preload_is_not_fork_safe(tmp_path):
+    """Test that an app whose preloaded state can't be shared is served by one worker"""
+    (tmp_path / "tiny_app.py").write_text(APP + "\ndef fork_safe():\n    return False\n")
+    port = _free_port()
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(tmp_path), str(REPO)])}
+    server = subprocess.Popen(
+        [sys.executable, "-c", f"from backend.app.launcher import serve; serve('tiny_app:app', host='127.0.0.1', port={port}, workers=2)"],
+        env=env, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+    )
+    try:
+        for _ in range(100):
+            try:
+                response = _get(port)
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            pytest.fail("server did not start")
+
+        # Nothing was forked: the preloading process serves
+        assert response["worker"] == response["preloaded_by"] == server.pid
+        server.send_signal(signal.SIGTERM)
+        server.wait(10)
+        assert "starting a single worker" in server.stdout.read()
+    finally:
+        if server.poll() is None:
+            server.kill()
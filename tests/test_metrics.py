@@ -0,0 +1,73 @@
+import threading
+
+import pytest
+from backend.app.services.metrics import Registry
+from tests.test_chat_stream import client  # noqa: F401 (fixture)
+
+def _samples(text):
+    """{"name{labels}": value} for every sample line"""
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith("#"):
+            series, value = line.rsplit(" ", 1)
+            samples[series] = float(value)
+    return samples
+
+def test_histogram_and_counter_rendering():
+    """Test the text format: cumulative buckets, sum/count, labels and escaping"""
+    registry = Registry()
+    latency = registry.histogram("op_seconds", "Operation time", ["op"], buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 5.0):
+        latency.labels("read").observe(value)
+    errors = registry.counter("errors_total", "Errors", ["kind"])
+    errors.labels('quote"d').inc(2)
+    registry.register_collector(lambda: [("queue_depth", "gauge", "Queued", [({"priority": "batch"}, 3)])])
+
+    text = registry.render()
+    assert "# TYPE op_seconds histogram" in text
+    samples = _samples(text)
+    assert samples['op_seconds_bucket{op="read",le="0.1"}'] == 1
+    assert samples['op_seconds_bucket{op="read",le="1"}'] == 3
+    assert samples['op_seconds_bucket{op="read",le="+Inf"}'] == 4
+    assert samples['op_seconds_count{op="read"}'] == 4
+    assert samples['op_seconds_sum{op="read"}'] == pytest.approx(6.05)
+    assert samples['errors_total{kind="quote\\"d"}'] == 2
+    assert samples['queue_depth{priority="batch"}'] == 3
+    with pytest.raises(ValueError):
+        errors.labels("a", "b")
+
+def test_concurrent_updates_are_not_lost():
+    """Test that series updated from many threads count every update"""
+    registry = Registry()
+    tokens = registry.counter("tokens_total", "Tokens", ["model"])
+    latency = registry.histogram("latency_seconds", "Latency")
+
+    def work():
+        for _ in range(10000):
+            tokens.labels("tiny").inc()
+            latency.observe(0.01)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    samples = _samples(registry.render())
+    assert samples['tokens_total{model="tiny"}'] == 80000
+    assert samples["latency_seconds_count"] == 80000
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(client):  # noqa: F811
+    """Test that /metrics reports route latency, generation, admission, cache and memory metrics"""
+    await client.post("/api/chat", json={"message": "hello", "stream": True})
+    response = await client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+
+    samples = _samples(response.text)
+    assert samples['localai_http_request_duration_seconds_count{method="POST",route="/api/chat",status="200"}'] >= 1
+    assert any(series.startswith("localai_time_to_first_token_seconds_count") for series in samples)
+    assert any(series.startswith("localai_generated_tokens_total") for series in samples)
+    assert any(series.startswith('localai_conversation_store_seconds_count{op="write_batch"}') for series in samples)
+    assert samples['localai_admission_queue_depth{priority="interactive"}'] == 0
+    assert 0 <= samples["localai_conversation_cache_hit_ratio"] <= 1
+    assert samples["process_resident_memory_bytes"] > 0
@@ -30,3 +30,97 @@ def test_prompt_building(model_manager):
     assert context in prompt
     assert message in prompt
     assert "User:" in prompt or "Context information" in prompt
+
+class _FakeLlama:
+    def __init__(self):
+        self.calls = []
+
+    def create_chat_completion(self, messages, **kwargs):
+        self.calls.append(messages)
+        return {"choices": [{"message": {"content": "reply"}}]}
+
+@pytest.mark.asyncio
+async def test_history_and_prefix_cache_key(model_manager):
+    """Test that history is sent to the model and the next turn is a prefix hit"""
+    from backend.app.services.conversation_store import message_prefix_hash
+
+    model_manager.current_model = _FakeLlama()
+    first = await model_manager.generate_response("hello")
+    assert first["prefix_cache_hit"] is False
+
+    user_hash = message_prefix_hash(None, "user", "hello")
+    history = [
+        {"role": "user", "content": "hello", "prefix_hash": user_hash},
+        {"role": "assistant", "content": "reply", "prefix_hash": message_prefix_hash(user_hash, "assistant", "reply")},
+    ]
+    second = await model_manager.generate_response("again", history=history)
+    assert second["prefix_cache_hit"] is True
+    assert [m["content"] for m in model_manager.current_model.calls[-1]] == ["hello", "reply", "again"]
+
+class _FailingLlama(_FakeLlama):
+    def create_chat_completion(self, messages, **kwargs):
+        raise RuntimeError("decode failed")
+
+@pytest.mark.asyncio
+async def test_failed_generation_forgets_prefix(model_manager):
+    """Test that a generation that fails part-way doesn't leave a KV prefix to reuse"""
+    model_manager.current_model = _FakeLlama()
+    await model_manager.generate_response("hello")
+    assert model_manager.kv_prefix_key is not None
+
+    model_manager.current_model = _FailingLlama()
+    result = await model_manager.generate_response("again")
+    assert result["error"] is True
+    assert model_manager.kv_prefix_key is None
+
+class _StreamingLlama(_FakeLlama):
+    def __init__(self, tokens):
+        super().__init__()
+        self.tokens = tokens
+        self.kwargs = None
+        self.produced = 0
+
+    def create_chat_completion(self, messages, stream=False, **kwargs):
+        self.calls.append(messages)
+        self.kwargs = kwargs
+        if not stream:
+            return {"choices": [{"message": {"content": "".join(self.tokens)}}]}
+        return self._chunks()
+
+    def _chunks(self):
+        yield {"choices": [{"delta": {"role": "assistant"}}]}
+        for token in self.tokens:
+            self.produced += 1
+            yield {"choices": [{"delta": {"content": token}}]}
+
+@pytest.mark.asyncio
+async def test_stream_generate_matches_generate_response(model_manager):
+    """Test that streaming yields deltas and a final frame equal to the blocking reply"""
+    model_manager.current_model = _StreamingLlama(["Hel", "lo", " there"])
+    schema = {"type": "object"}
+    frames = [frame async for frame in model_manager.stream_generate("hi", documents=["doc"], json_schema=schema, max_tokens=64)]
+
+    assert [f["delta"] for f in frames[:-1]] == ["Hel", "lo", " there"]
+    final = frames[-1]
+    assert final["response"] == "Hello there"
+    assert final["usage"] == {"completion_tokens": 3}
+    assert final["timing"]["ttft_ms"] <= final["timing"]["total_ms"]
+    assert model_manager.current_model.kwargs["max_tokens"] == 64
+    assert model_manager.current_model.kwargs["response_format"]["schema"] == schema
+    assert "Document: doc" in model_manager.current_model.calls[-1][-1]["content"]
+
+    blocking = await model_manager.generate_response("hi", documents=["doc"], json_schema=schema, max_tokens=64)
+    assert blocking["response"] == final["response"]
+
+@pytest.mark.asyncio
+async def test_closing_stream_stops_generation(model_manager):
+    """Test that abandoning a stream stops pulling tokens from the model"""
+    model_manager.current_model = _StreamingLlama([f"t{i} " for i in range(10000)])
+    stream = model_manager.stream_generate("hi")
+    assert "delta" in await stream.__anext__()
+    await stream.aclose()
+    await asyncio.sleep(0.1)
+
+    assert model_manager.current_model.produced < 10000
+    assert model_manager.kv_prefix_key is None
+    assert not model_manager.generation_lock.locked()
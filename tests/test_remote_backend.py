@@ -0,0 +1,198 @@
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import pytest_asyncio
+from backend.app.services.model_manager import ModelManager
+from backend.app.services.remote_backend import RemotePool, RemoteUnavailable
+
+class _LlamaServer:
+    """Stands in for a llama.cpp server: /health, /v1/models, /props and /v1/chat/completions.
+
+    Generation takes `delay` seconds and runs `slots` at a time. With
+    `fail` set, completions answer 500.
+    """
+
+    def __init__(self, model, delay=0.0, slots=1):
+        self.model = model
+        self.fail = False
+        self.connections = set()
+        self.completions = 0
+        server = self
+        generating = threading.Semaphore(slots)
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _json(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _chunk(self, text):
+                data = text.encode()
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+
+            def do_GET(self):
+                if self.path == "/health":
+                    self._json(200, {"status": "ok"})
+                elif self.path == "/v1/models":
+                    self._json(200, {"data": [{"id": model, "meta": {"size": 2 * 1024 ** 3}}]})
+                elif self.path == "/props":
+                    self._json(200, {"total_slots": slots})
+                else:
+                    self._json(404, {"error": "not found"})
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                server.connections.add(self.client_address)
+                if server.fail:
+                    self._json(500, {"error": "model crashed"})
+                    return
+                with generating:
+                    time.sleep(delay)
+                    server.completions += 1
+                words = ["Hello", " from", f" {model}"]
+                if not body.get("stream"):
+                    self._json(200, {"choices": [{"message": {"role": "assistant", "content": "".join(words)}}]})
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for word in words:
+                    self._chunk("data: " + json.dumps({"choices": [{"delta": {"content": word}}]}) + "\n\n")
+                self._chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, args=(0.05,), daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(model, **kwargs):
+        server = _LlamaServer(model, **kwargs)
+        started.append(server)
+        return server
+
+    yield start
+    for server in started:
+        server.close()
+
+@pytest_asyncio.fixture
+async def pools():
+    opened = []
+
+    async def open_pool(urls, **kwargs):
+        pool = RemotePool(urls, probe_interval=60, **kwargs)
+        opened.append(pool)
+        await pool.start()
+        return pool
+
+    yield open_pool
+    for pool in opened:
+        await pool.close()
+
+@pytest.mark.asyncio
+async def test_probes_route_by_model_and_reuse_connections(servers, pools):
+    """Test that nodes are probed, requests go to a node serving the model, and connections are kept alive"""
+    small, large = servers("small"), servers("large", slots=2)
+    pool = await pools([small.url, large.url, "http://127.0.0.1:9"])
+
+    assert sorted(m["id"] for m in pool.models()) == ["large", "small"]
+    assert pool.capacity() == 3
+    assert [node.healthy for node in pool.nodes] == [True, True, False]
+
+    for _ in range(5):
+        assert await pool.complete([{"role": "user", "content": "hi"}], "large", {"max_tokens": 8}) == "Hello from large"
+    deltas = [delta async for delta in pool.stream([{"role": "user", "content": "hi"}], "small", {})]
+    assert deltas == ["Hello", " from", " small"]
+    assert (small.completions, large.completions) == (1, 5)
+    assert len(large.connections) == 1
+
+    with pytest.raises(RemoteUnavailable):
+        await pool.complete([{"role": "user", "content": "hi"}], "missing", {})
+
+@pytest.mark.asyncio
+async def test_failover_and_recovery(servers, pools):
+    """Test that a failing node is skipped for the rest and readmitted once a probe passes"""
+    started = {server.url: server for server in (servers("tiny"), servers("tiny"))}
+    pool = await pools(list(started))
+    # Whichever node would be picked first fails
+    node = pool.route("tiny")
+    failing = started[node.url]
+    failing.fail = True
+
+    deltas = [delta async for delta in pool.stream([{"role": "user", "content": "hi"}], "tiny", {})]
+    assert "".join(deltas) == "Hello from tiny"
+    assert node.healthy is False and node.failures == 1
+    await pool.complete([{"role": "user", "content": "hi"}], "tiny", {})
+    assert failing.completions == 0 and sum(server.completions for server in started.values()) == 2
+
+    failing.fail = False
+    await pool.probe_all()
+    assert node.healthy is True
+
+@pytest.mark.asyncio
+async def test_throughput_scales_with_nodes(servers, pools):
+    """Test that concurrent generations spread over nodes and finish proportionally sooner"""
+    async def run(nodes):
+        pool = await pools([servers("tiny", delay=0.2).url for _ in range(nodes)])
+        started = time.perf_counter()
+        await asyncio.gather(*(pool.complete([{"role": "user", "content": str(i)}], "tiny", {}) for i in range(4)))
+        return time.perf_counter() - started, [node.served for node in pool.nodes]
+
+    one, _ = await run(1)
+    two, served = await run(2)
+    assert served == [2, 2]
+    assert two < one * 0.75
+
+def test_start_on_a_new_loop_replaces_the_client(servers):
+    """Test that starting on another event loop (a worker after preload) closes the previous client"""
+    server = servers("tiny")
+    pool = RemotePool([server.url], probe_interval=60)
+
+    async def use():
+        await pool.start()
+        return await pool.complete([{"role": "user", "content": "hi"}], "tiny", {})
+
+    assert asyncio.run(use()) == "Hello from tiny"
+    first = pool.client
+    assert asyncio.run(use()) == "Hello from tiny"
+    assert first.is_closed and pool.client is not first
+    asyncio.run(pool.close())
+
+@pytest.mark.asyncio
+async def test_model_manager_uses_remote_backends(servers, monkeypatch):
+    """Test that LOCALAI_REMOTE_BACKENDS makes ModelManager list, select and stream from remote models"""
+    server = servers("remote-model")
+    monkeypatch.setenv("LOCALAI_REMOTE_BACKENDS", server.url)
+    manager = ModelManager()
+    await manager.initialize()
+    try:
+        assert manager.current_model_name == "remote-model"
+        listed = [m for m in await manager.get_available_models() if not m["local"]]
+        assert listed[0]["nodes"] == [server.url] and listed[0]["size_gb"] == 2
+
+        frames = [frame async for frame in manager.stream_generate("hi", max_tokens=8)]
+        assert [f["delta"] for f in frames[:-1]] == ["Hello", " from", " remote-model"]
+        assert frames[-1]["response"] == "Hello from remote-model"
+        assert (await manager.generate_response("hi"))["response"] == "Hello from remote-model"
+    finally:
+        await manager.close()
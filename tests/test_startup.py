@@ -0,0 +1,34 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+from backend.app.launcher import import_times
+
+REPO = Path(__file__).resolve().parent.parent
+
+# Modules the app needs only for some requests; importing the app must not load them
+HEAVY_MODULES = ["PyPDF2", "PIL", "pytesseract", "llama_cpp"]
+
+# Budget for the app's own import, on top of the web framework it builds on
+IMPORT_BUDGET_MS = float(os.environ.get("LOCALAI_IMPORT_BUDGET_MS", "400"))
+FRAMEWORK = ("fastapi", "fastapi.staticfiles", "fastapi.middleware.cors", "fastapi.responses")
+
+def test_app_import_is_lazy():
+    """Test that importing the app loads no heavy dependencies and constructs no services"""
+    code = (
+        "import sys, json; from backend.app import main; "
+        f"print(json.dumps([[m for m in {HEAVY_MODULES!r} if m in sys.modules], main.model_manager is None]))"
+    )
+    output = subprocess.run([sys.executable, "-c", code], cwd=REPO, stdout=subprocess.PIPE, check=True).stdout
+    loaded, deferred = json.loads(output.splitlines()[-1])
+    assert loaded == []
+    assert deferred
+
+def test_app_import_time_budget():
+    """Test that importing the app stays within its import-time budget"""
+    timings = import_times("backend.app.main", preimported=FRAMEWORK, cwd=str(REPO))
+    app = next(t for t in timings if t["module"] == "backend.app.main")
+    slowest = sorted(timings, key=lambda t: t["self_ms"], reverse=True)[:5]
+    assert app["cumulative_ms"] < IMPORT_BUDGET_MS, f"Slowest imports: {slowest}"
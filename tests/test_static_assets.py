@@ -0,0 +1,92 @@
+import gzip
+
+import httpx
+import pytest
+import pytest_asyncio
+from backend.app import main
+from backend.app.services import static_assets as static_module
+from backend.app.services.static_assets import IMMUTABLE, StaticAssets
+
+INDEX = """<html><head>
+<link rel="stylesheet" href="css/style.css">
+<link href="https://cdn.example.com/all.min.css" rel="stylesheet">
+</head><body><script src="./js/app.js"></script></body></html>
+"""
+
+@pytest.fixture
+def frontend(tmp_path):
+    root = tmp_path / "frontend"
+    (root / "css").mkdir(parents=True)
+    (root / "js").mkdir()
+    (root / "index.html").write_text(INDEX)
+    (root / "css" / "style.css").write_text("body { color: #333; }\n" * 200)
+    (root / "js" / "app.js").write_text("console.log('hello');\n" * 200)
+    return root
+
+@pytest_asyncio.fixture
+async def client(frontend, monkeypatch):
+    assets = StaticAssets(frontend)
+    await assets.initialize()
+    monkeypatch.setattr(main, "static_assets", assets)
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+        yield client
+
+def test_index_references_fingerprinted_assets(frontend):
+    """Test that index.html points at fingerprinted /static names and leaves other links alone"""
+    assets = StaticAssets(frontend)
+    assets.build()
+    html = assets.index.variants["identity"][0].decode()
+    css, js = assets.url("css/style.css"), assets.url("js/app.js")
+    assert css.startswith("/static/css/style.") and css.endswith(".css") and css != "/static/css/style.css"
+    assert f'href="{css}"' in html and f'src="{js}"' in html
+    assert 'href="https://cdn.example.com/all.min.css"' in html
+
+    # A content change gives a new name
+    (frontend / "css" / "style.css").write_text("body { color: red; }")
+    assets.build()
+    assert assets.url("css/style.css") != css
+
+@pytest.mark.asyncio
+async def test_served_from_memory_with_compression_and_304(client, frontend):
+    """Test encodings, cache headers and conditional requests, with no disk reads after startup"""
+    frontend.rename(frontend.with_name("moved"))
+
+    response = await client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/html")
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["cache-control"] == "no-cache"
+    assert "/static/css/style." in response.text
+
+    revalidated = await client.get("/", headers={"Accept-Encoding": "gzip", "If-None-Match": response.headers["etag"]})
+    assert revalidated.status_code == 304 and revalidated.content == b""
+
+    css_url = main.static_assets.url("css/style.css")
+    css = await client.get(css_url, headers={"Accept-Encoding": "identity"})
+    assert css.headers["cache-control"] == IMMUTABLE
+    assert "content-encoding" not in css.headers
+    assert css.content == main.static_assets.get("css/style.css").variants["identity"][0]
+    assert "Accept-Encoding" in css.headers["vary"]
+
+    # The original name still works, revalidated rather than immutable
+    plain = await client.get("/static/js/app.js", headers={"Accept-Encoding": "gzip;q=0, deflate"})
+    assert plain.status_code == 200 and plain.headers["cache-control"] == "no-cache"
+    assert "content-encoding" not in plain.headers
+    assert (await client.get("/static/../requests.jsonl")).status_code == 404
+
+def test_compression_variants(frontend):
+    """Test that compressed variants decode to the original and are only kept when smaller"""
+    assets = StaticAssets(frontend)
+    assets.build()
+    style = assets.get("css/style.css")
+    assert gzip.decompress(style.variants["gzip"][0]) == style.variants["identity"][0]
+    assert len({etag for _, etag in style.variants.values()}) == len(style.variants)
+    if static_module.brotli is not None:
+        assert style.select("gzip, br") == "br"
+        assert static_module.brotli.decompress(style.variants["br"][0]) == style.variants["identity"][0]
+    else:
+        assert style.select("gzip, br") == "gzip"
+
+    (frontend / "tiny.txt").write_text("x")
+    assets.build()
+    assert set(assets.get("tiny.txt").variants) == {"identity"}
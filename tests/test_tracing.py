@@ -0,0 +1,118 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from backend.app import main
+from backend.app.services.profiler import SamplingProfiler
+from backend.app.services.tracing import NOOP_SPAN, RingBufferExporter, Tracer, ring_buffer, tracer
+from tests.test_chat_stream import client  # noqa: F401 (fixture)
+
+@pytest.mark.asyncio
+async def test_spans_nest_across_awaits():
+    """Test that spans opened inside another span become its children, and errors are recorded"""
+    exporter = RingBufferExporter()
+    local = Tracer(enabled=True, exporters=[exporter])
+
+    async def step(name):
+        with local.span(name):
+            await asyncio.sleep(0.01)
+
+    with local.span("request", path="/x") as root:
+        await asyncio.gather(step("a"), step("b"))
+        with pytest.raises(ValueError):
+            with local.span("failing"):
+                raise ValueError("boom")
+        start = time.perf_counter()
+        local.record("measured", start, start + 0.005, tokens=3)
+
+    spans = {span["name"]: span for span in exporter.dump()}
+    assert set(spans) == {"a", "b", "failing", "measured", "request"}
+    assert {span["trace_id"] for span in spans.values()} == {root.trace_id}
+    assert all(spans[name]["parent_id"] == root.span_id for name in ["a", "b", "failing", "measured"])
+    assert spans["request"]["parent_id"] is None
+    assert spans["a"]["duration_ms"] >= 10
+    assert spans["failing"]["attributes"]["error"] == "ValueError: boom"
+    assert spans["measured"]["duration_ms"] == pytest.approx(5, abs=0.01)
+
+def test_disabled_tracer_records_nothing():
+    """Test that a disabled tracer hands out the shared no-op span"""
+    exporter = RingBufferExporter(capacity=2)
+    local = Tracer(enabled=False, exporters=[exporter])
+    with local.span("ignored") as span:
+        span.set(anything=1)
+    local.record("ignored", 0.0, 1.0)
+    assert span is NOOP_SPAN
+    assert exporter.dump() == []
+
+    local.enabled = True
+    for name in ["one", "two", "three"]:
+        with local.span(name):
+            pass
+    assert [span["name"] for span in exporter.dump()] == ["two", "three"]
+
+@pytest.mark.asyncio
+async def test_chat_request_trace(client, monkeypatch):  # noqa: F811
+    """Test that a streamed chat produces one trace covering storage, queueing, prefill and decode"""
+    monkeypatch.setattr(tracer, "enabled", True)
+    monkeypatch.setenv("LOCALAI_ADMIN_TOKEN", "secret")
+    client.headers["Authorization"] = "Bearer secret"
+    ring_buffer.clear()
+    await client.post("/api/chat", json={"message": "hello", "stream": True})
+
+    spans = (await client.get("/api/admin/traces")).json()["spans"]
+    root = next(span for span in spans if span["name"] == "POST /api/chat")
+    assert root["attributes"]["status"] == 200
+    names = {span["name"] for span in spans if span["trace_id"] == root["trace_id"]}
+    assert {"conversations.add_message", "admission.wait", "model.prompt", "model.prefill", "model.decode"} <= names
+    decode = next(span for span in spans if span["name"] == "model.decode")
+    assert decode["attributes"]["tokens"] == 3
+
+    one_trace = (await client.get("/api/admin/traces", params={"trace_id": root["trace_id"]})).json()["spans"]
+    assert {span["trace_id"] for span in one_trace} == {root["trace_id"]}
+
+def _spin_for_profiler(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+def test_sampling_profiler_collapsed_stacks():
+    """Test that the profiler attributes samples to the busy thread's function"""
+    stop = threading.Event()
+    worker = threading.Thread(target=_spin_for_profiler, args=(stop,), name="spinner")
+    worker.start()
+    try:
+        counts = SamplingProfiler(interval=0.002).run(0.2)
+    finally:
+        stop.set()
+        worker.join()
+
+    spinning = [stack for stack in counts if stack.startswith("spinner;") and "_spin_for_profiler" in stack]
+    assert spinning and sum(counts[stack] for stack in spinning) >= 10
+    for line in SamplingProfiler.collapsed(counts).splitlines():
+        stack, count = line.rsplit(" ", 1)
+        assert ";" in stack and int(count) > 0
+
+@pytest.mark.asyncio
+async def test_profile_endpoint(client, monkeypatch):  # noqa: F811
+    """Test that the admin profile endpoint returns collapsed stacks including the event loop"""
+    monkeypatch.setenv("LOCALAI_ADMIN_TOKEN", "secret")
+    client.headers["Authorization"] = "Bearer secret"
+    response = await client.get("/api/admin/profile", params={"seconds": 0.1, "interval_ms": 2})
+    assert response.status_code == 200
+    assert "MainThread;" in response.text
+
+@pytest.mark.asyncio
+async def test_admin_endpoints_need_token(client, monkeypatch):  # noqa: F811
+    """Test that admin endpoints are off without LOCALAI_ADMIN_TOKEN and reject a missing or wrong token"""
+    monkeypatch.delenv("LOCALAI_ADMIN_TOKEN", raising=False)
+    enabled = tracer.enabled
+    assert (await client.get("/api/admin/traces")).status_code == 404
+    assert (await client.put("/api/admin/tracing", params={"enabled": not enabled})).status_code == 404
+    assert (await client.post("/api/models/benchmark")).status_code == 404
+    assert tracer.enabled is enabled
+
+    monkeypatch.setenv("LOCALAI_ADMIN_TOKEN", "secret")
+    assert (await client.get("/api/admin/profile", params={"seconds": 0.1})).status_code == 401
+    assert (await client.get("/api/admin/traces", headers={"Authorization": "Bearer wrong"})).status_code == 401
+    assert (await client.post("/api/models/benchmark", headers={"Authorization": "Bearer wrong"})).status_code == 401
+    assert (await client.get("/api/admin/backends", headers={"Authorization": "Bearer secret"})).status_code == 200
@@ -0,0 +1,207 @@
+import asyncio
+import json
+import struct
+import threading
+
+import pytest
+from backend.app.services.admission import AdmissionController
+from backend.app.services.gguf import GGUFError, quantization_from_name, read_metadata
+from backend.app.services.model_manager import ModelManager
+from backend.app.services.variants import VariantSelector
+
+def _string(text):
+    data = text.encode()
+    return struct.pack("<Q", len(data)) + data
+
+def _write_gguf(path, metadata):
+    """A GGUF v3 header with `metadata` (str, int or list-of-str values) and no tensors"""
+    body = b""
+    for key, value in metadata.items():
+        body += _string(key)
+        if isinstance(value, str):
+            body += struct.pack("<I", 8) + _string(value)
+        elif isinstance(value, list):
+            body += struct.pack("<IIQ", 9, 8, len(value)) + b"".join(_string(item) for item in value)
+        else:
+            body += struct.pack("<II", 4, value)
+    path.write_bytes(b"GGUF" + struct.pack("<IQQ", 3, 0, len(metadata)) + body + b"\0" * 64)
+
+def _variant(tmp_path, filename, file_type, name="Tiny Llama 1B Instruct"):
+    _write_gguf(tmp_path / filename, {
+        "general.architecture": "llama",
+        "general.name": name,
+        "general.file_type": file_type,
+        "tokenizer.ggml.tokens": [f"t{i}" for i in range(1000)],
+    })
+
+def test_read_metadata(tmp_path):
+    """Test reading GGUF metadata: scalars, strings, skipped arrays, early stop and bad files"""
+    _variant(tmp_path, "tiny.gguf", 15)
+    metadata = read_metadata(tmp_path / "tiny.gguf")
+    assert metadata["general.name"] == "Tiny Llama 1B Instruct"
+    assert metadata["general.file_type"] == 15
+    assert metadata["tokenizer.ggml.tokens"] == {"array_length": 1000}
+    assert read_metadata(tmp_path / "tiny.gguf", arrays=True)["tokenizer.ggml.tokens"][999] == "t999"
+    assert "tokenizer.ggml.tokens" not in read_metadata(tmp_path / "tiny.gguf", ["general.name"])
+
+    (tmp_path / "bad.gguf").write_bytes(b"nope")
+    with pytest.raises(GGUFError):
+        read_metadata(tmp_path / "bad.gguf")
+    assert quantization_from_name("qwen2.5-7b-instruct-q4_k_m.gguf") == "Q4_K_M"
+    assert quantization_from_name("model.Q8_0.gguf") == "Q8_0"
+    assert quantization_from_name("model.gguf") is None
+
+def test_variants_grouped_by_base_model(tmp_path):
+    """Test that quantizations of one model are grouped, best first, whatever their file names"""
+    _variant(tmp_path, "tiny-a.gguf", 15)
+    _variant(tmp_path, "tiny-b.gguf", 7)
+    _variant(tmp_path, "tiny-c.gguf", 17, name="Tiny Llama 1B Instruct Q5_K_M")
+    _variant(tmp_path, "other.gguf", 15, name="Other 3B")
+    (tmp_path / "plain-Q4_0.gguf").write_bytes(b"not really gguf")
+    manager = ModelManager()
+    manager.models_dir = tmp_path
+
+    groups = manager.get_variant_groups()
+    tiny = groups["llama:tiny-llama-1b-instruct"]
+    assert [(m["filename"], m["quantization"]) for m in tiny] == [
+        ("tiny-b.gguf", "Q8_0"), ("tiny-c.gguf", "Q5_K_M"), ("tiny-a.gguf", "Q4_K_M")
+    ]
+    assert [m["filename"] for m in groups["llama:other-3b"]] == ["other.gguf"]
+    assert groups["plain"][0]["quantization"] == "Q4_0"
+
+def _benchmarked(filename, prefill, decode, load=2.0):
+    return {"filename": filename, "benchmark": {
+        "prefill_tokens_per_second": prefill, "decode_tokens_per_second": decode, "load_seconds": load
+    }}
+
+def test_selector_falls_back_under_load_and_recovers():
+    """Test SLO-driven choice: best quality when idle, smaller under load, back up after the dwell time"""
+    variants = [_benchmarked("q8", 100, 10), _benchmarked("q5", 200, 20), _benchmarked("q4", 400, 40)]
+    selector = VariantSelector(min_dwell=30, headroom=0.2)
+    choose = lambda ahead, now: selector.choose(variants, current, 5.0, 100, 64, ahead, now)["filename"]
+
+    current = "q8"
+    assert choose(0, now=0) == "q8"
+    # Three requests ahead: none meets 5 s; q4 is fastest at 3 * (0.25 + 1.6) + 0.25 s, plus 2 s to load
+    current = choose(3, now=1)
+    assert current == "q4"
+    selector.switched(now=1)
+    # Idle again, but upgrades wait out the dwell time
+    assert choose(0, now=10) == "q4"
+    assert choose(0, now=40) == "q8"
+    # A choice that was never loaded doesn't restart the dwell time
+    assert selector.switched_at == 1
+    # Nothing meets the SLO: the fastest
+    assert selector.choose(variants, "q4", 0.1, 100, 64, 10, 100)["filename"] == "q4"
+
+class _BenchLlama:
+    def __init__(self, model_path, **kwargs):
+        self.model_path = model_path
+
+    def tokenize(self, text, add_bos=True):
+        return list(range(len(text.split())))
+
+    def create_completion(self, tokens, max_tokens, **kwargs):
+        for i in range(max_tokens):
+            yield {"choices": [{"text": "x"}]}
+
+class _FakeLlama:
+    def create_chat_completion(self, messages, **kwargs):
+        return {"choices": [{"message": {"content": "reply"}}]}
+
+@pytest.mark.asyncio
+async def test_benchmark_and_switch_for_slo(tmp_path, monkeypatch):
+    """Test benchmarking variants on this host, then switching down for a request's SLO under load"""
+    _variant(tmp_path, "tiny-q8.gguf", 7)
+    _variant(tmp_path, "tiny-q4.gguf", 15)
+    manager = ModelManager()
+    manager.models_dir = tmp_path
+
+    results = await manager.benchmark_variants(factory=_BenchLlama)
+    assert {r["filename"] for r in results} == {"tiny-q8.gguf", "tiny-q4.gguf"}
+    stored = json.loads((tmp_path / "benchmarks.json").read_text())
+    assert stored["tiny-q8.gguf"]["prefill_tokens_per_second"] > 0
+    # Cached until the file changes
+    assert all(r["benchmark"] for r in await manager.benchmark_variants(factory=None))
+
+    manager.benchmarks.put(tmp_path / "tiny-q8.gguf", _benchmarked("", 100, 10)["benchmark"])
+    manager.benchmarks.put(tmp_path / "tiny-q4.gguf", _benchmarked("", 400, 40, load=0.5)["benchmark"])
+    loaded = []
+
+    async def load_model(name):
+        # The previous variant is released before the next one is loaded
+        assert manager.current_model is None
+        loaded.append(name)
+        manager.current_model, manager.current_model_name = _FakeLlama(), name
+        return name not in failing
+
+    failing = set()
+    monkeypatch.setattr(manager, "load_model", load_model)
+    manager.admission = AdmissionController(max_concurrent=1)
+    manager.current_model, manager.current_model_name = _FakeLlama(), "tiny-q8.gguf"
+    async with manager.admission.slot():
+        await manager.generate_response("hi", latency_slo_ms=3000, max_tokens=64)
+    assert loaded == []
+
+    # Four more requests queue up behind the one being served
+    async with manager.admission.slot():
+        queued = [asyncio.ensure_future(manager.admission.acquire()) for _ in range(4)]
+        await asyncio.sleep(0)
+        assert manager.admission.pending() == 5
+        result = await manager.generate_response("hi", latency_slo_ms=3000, max_tokens=64)
+    assert loaded == ["tiny-q4.gguf"] and result["response"] == "reply"
+    for ticket in queued:
+        manager.admission.release(await ticket)
+    assert manager.variant_selector.switched_at is not None
+
+@pytest.mark.asyncio
+async def test_failed_switch_reloads_previous_variant(tmp_path, monkeypatch):
+    """Test that a variant that fails to load leaves the previous one loaded and no dwell time started"""
+    _variant(tmp_path, "tiny-q8.gguf", 7)
+    _variant(tmp_path, "tiny-q4.gguf", 15)
+    manager = ModelManager()
+    manager.models_dir = tmp_path
+    manager.benchmarks.put(tmp_path / "tiny-q8.gguf", _benchmarked("", 0.5, 0.1)["benchmark"])
+    manager.benchmarks.put(tmp_path / "tiny-q4.gguf", _benchmarked("", 4000, 400, load=0.1)["benchmark"])
+    loaded = []
+
+    async def load_model(name):
+        loaded.append(name)
+        if name == "tiny-q4.gguf":
+            return False
+        manager.current_model, manager.current_model_name = _FakeLlama(), name
+        return True
+
+    monkeypatch.setattr(manager, "load_model", load_model)
+    manager.current_model, manager.current_model_name = _FakeLlama(), "tiny-q8.gguf"
+    result = await manager.generate_response("hi", latency_slo_ms=1000, max_tokens=64)
+    assert loaded == ["tiny-q4.gguf", "tiny-q8.gguf"] and result["response"] == "reply"
+    assert manager.variant_selector.switched_at is None
+
+@pytest.mark.asyncio
+async def test_cancelled_switch_releases_generation_lock(tmp_path):
+    """Test that a request cancelled while waiting to switch variants doesn't leave the model locked"""
+    _variant(tmp_path, "tiny-q8.gguf", 7)
+    _variant(tmp_path, "tiny-q4.gguf", 15)
+    manager = ModelManager()
+    manager.models_dir = tmp_path
+    manager.benchmarks.put(tmp_path / "tiny-q8.gguf", _benchmarked("", 0.5, 0.1)["benchmark"])
+    manager.benchmarks.put(tmp_path / "tiny-q4.gguf", _benchmarked("", 4000, 400, load=0.1)["benchmark"])
+    manager.current_model, manager.current_model_name = _FakeLlama(), "tiny-q8.gguf"
+
+    # A generation is running: the switch waits for the lock, and is cancelled meanwhile
+    manager.generation_lock.acquire()
+    request = asyncio.ensure_future(manager.generate_response("hi", latency_slo_ms=1000, max_tokens=64))
+    await asyncio.sleep(0.1)
+    request.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await request
+    manager.generation_lock.release()
+
+    free = threading.Event()
+    def take():
+        if manager.generation_lock.acquire(timeout=2):
+            manager.generation_lock.release()
+            free.set()
+    await asyncio.get_event_loop().run_in_executor(None, take)
+    assert free.is_set()
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import pytest
+from backend.app.services.ws_protocol import ChatSocket
+
+class _FakeWebSocket:
+    def __init__(self):
+        self.incoming = asyncio.Queue()
+        self.sent = []
+
+    def client_send(self, frame):
+        self.incoming.put_nowait({"type": "websocket.receive", "text": json.dumps(frame)})
+
+    def client_close(self):
+        self.incoming.put_nowait({"type": "websocket.disconnect"})
+
+    async def receive(self):
+        return await self.incoming.get()
+
+    async def send_text(self, data):
+        self.sent.append(json.loads(data))
+
+    async def send_bytes(self, data):
+        import msgpack
+        self.sent.append(msgpack.unpackb(data, raw=False))
+
+def _fake_chat(tokens, delay=0.0):
+    async def start_chat(payload):
+        async def frames():
+            for token in tokens:
+                await asyncio.sleep(delay)
+                yield {"delta": token}
+            yield {"response": "".join(tokens), "model": "fake"}
+        return payload.get("conversation_id") or "conv-" + payload["id"], frames()
+    return start_chat
+
+async def _run_until(socket, websocket, predicate, timeout=5):
+    server = asyncio.ensure_future(socket.serve())
+    deadline = asyncio.get_event_loop().time() + timeout
+    while not predicate(websocket.sent):
+        assert asyncio.get_event_loop().time() < deadline, websocket.sent
+        await asyncio.sleep(0.01)
+    websocket.client_close()
+    await server
+
+def _frames(sent, request_id, kind=None):
+    return [f for f in sent if f.get("id") == request_id and (kind is None or f["type"] == kind)]
+
+@pytest.mark.asyncio
+async def test_concurrent_generations_are_coalesced():
+    """Test two interleaved generations on one socket, with deltas batched into few frames"""
+    websocket = _FakeWebSocket()
+    tokens = [f"tok{i} " for i in range(200)]
+    socket = ChatSocket(websocket, _fake_chat(tokens), coalesce_ms=10, coalesce_bytes=256)
+    websocket.client_send({"type": "generate", "id": "a", "message": "first"})
+    websocket.client_send({"type": "generate", "id": "b", "message": "second"})
+
+    done = lambda sent: len([f for f in sent if f["type"] == "done"]) == 2
+    await _run_until(socket, websocket, done)
+
+    for request_id in ("a", "b"):
+        deltas = _frames(websocket.sent, request_id, "delta")
+        assert "".join(f["text"] for f in deltas) == "".join(tokens)
+        assert len(deltas) < len(tokens) / 10
+        assert _frames(websocket.sent, request_id)[-1]["response"] == "".join(tokens)
+
+@pytest.mark.asyncio
+async def test_cancel_and_ping():
+    """Test that cancel ends one generation and ping is answered while it runs"""
+    websocket = _FakeWebSocket()
+    socket = ChatSocket(websocket, _fake_chat(["x"] * 1000, delay=0.005))
+    websocket.client_send({"type": "generate", "id": 1, "message": "long"})
+    websocket.client_send({"type": "ping", "ts": 42})
+    websocket.client_send({"type": "cancel", "id": 1})
+
+    await _run_until(socket, websocket, lambda sent: any(f["type"] == "cancelled" for f in sent))
+    assert {"type": "pong", "ts": 42} in websocket.sent
+    assert not _frames(websocket.sent, 1, "done")
+    assert not socket.tasks
+
+@pytest.mark.asyncio
+async def test_msgpack_encoding_and_errors():
+    """Test msgpack negotiation, duplicate ids and unknown versions"""
+    pytest.importorskip("msgpack")
+    websocket = _FakeWebSocket()
+    socket = ChatSocket(websocket, _fake_chat(["hi"], delay=0.05))
+    websocket.client_send({"type": "hello", "version": 99})
+    websocket.client_send({"type": "hello", "version": 1, "encoding": "msgpack"})
+    websocket.client_send({"type": "generate", "id": "r", "message": "x"})
+    websocket.client_send({"type": "generate", "id": "r", "message": "x"})
+
+    await _run_until(socket, websocket, lambda sent: any(f["type"] == "done" for f in sent))
+    assert websocket.sent[0]["type"] == "error"
+    assert websocket.sent[1]["encoding"] == "msgpack"
+    assert _frames(websocket.sent, "r", "error")
+    assert socket.encoding == "msgpack"
+
+@pytest.mark.asyncio
+async def test_legacy_frames():
+    """Test that untyped frames keep the original one-chunk-per-token protocol"""
+    websocket = _FakeWebSocket()
+
+    async def legacy_chat(payload):
+        for token in ["a", "b"]:
+            yield {"delta": token}
+        yield {"response": "ab"}
+
+    socket = ChatSocket(websocket, _fake_chat([]), legacy_chat=legacy_chat)
+    websocket.client_send({"message": "hi"})
+    await _run_until(socket, websocket, lambda sent: len(sent) == 2)
+    assert websocket.sent == [{"chunk": "a"}, {"chunk": "b"}]